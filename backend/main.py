@@ -1,17 +1,72 @@
-from fastapi import FastAPI
+from contextlib import asynccontextmanager
+from email.utils import formatdate, parsedate_to_datetime
+import asyncio
+import json
+import logging
+import os
+import threading
+import time
+import pandas as pd
+from fastapi import FastAPI, HTTPException, Query, Request
+from fastapi.responses import JSONResponse, StreamingResponse, PlainTextResponse, Response
+from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
+from strategy.context import data_context, SPY_CSV
+from strategy.cache import result_cache, result_key, data_fingerprint, last_modified
+from strategy.backtest import sweep, ensemble
+from strategy.clustering import KMEANS_DIR
+from strategy.risk import ROLLING_WINDOW, cluster_labels, risk_report
+from strategy.jobs import run_backtest, job_manager, request_slots, RESULT_TABLES
+from strategy.utils import getMetrics, resolve_window
+from strategy.models import MODEL_REGISTRY, MAX_MODEL_COST, get_model_backend, model_cost
+from strategy.timing import Timings, current_timings, registry
+from strategy.encoding import NDJSON, NotAcceptable, EncodedPayload, negotiate, encode, iter_ndjson, accepts_gzip, representation_etag
 
-app = FastAPI()
-print("App initialized")
+logging.basicConfig(level=os.environ.get('LOG_LEVEL', 'INFO'), format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+logger = logging.getLogger('api')
 
-from fastapi.middleware.cors import CORSMiddleware
-import pandas as pd
-from strategy.dataset import load_df_dict, price_data
-from strategy.backtest import main, simulate_portfolio_ledger
-from strategy.utils import getMetrics
+MAX_ENSEMBLE_SEEDS = int(os.environ.get('MAX_ENSEMBLE_SEEDS', 100))
 
-df_dict = load_df_dict()
-spy_baseline = pd.read_csv('data/seed/spy_data.csv')
+# each seed payload is read and encoded once per format (and once gzipped) until its files change
+SEED_FILES = {
+    'ledger': ('data/seed/ledger.csv',),
+    'transactions': ('data/seed/transactions.csv',),
+    'metrics': ('data/seed/ledger.csv', SPY_CSV),
+}
+SEED_LOADERS = {
+    'ledger': lambda: pd.read_csv('data/seed/ledger.csv'),
+    'transactions': lambda: pd.read_csv('data/seed/transactions.csv'),
+    'metrics': lambda: getMetrics(pd.read_csv('data/seed/ledger.csv'), pd.read_csv(SPY_CSV)),
+}
+seed_payloads = {}
 
+def seed_payload(name):
+    paths = SEED_FILES[name]
+    version = data_fingerprint(paths)
+    payload = seed_payloads.get(name)
+    if payload is None or payload.version != version:
+        payload = seed_payloads[name] = EncodedPayload(SEED_LOADERS[name], version=version,
+                                                       last_modified=last_modified(paths))
+    return payload
+
+def warm_up():
+    data_context.warm_up()
+    try:
+        for name in SEED_FILES:
+            seed_payload(name).body('application/json')
+            seed_payload(name).body('application/json', compressed=True)
+    except Exception as e:
+        logger.exception("Seed pre-encoding failed: %s", e)
+
+@asynccontextmanager
+async def lifespan(app):
+    # load the data in the background so /health answers immediately; set DATA_WARMUP=0 to load on first use
+    if os.environ.get('DATA_WARMUP', '1') != '0':
+        threading.Thread(target=warm_up, daemon=True).start()
+    yield
+
+app = FastAPI(lifespan=lifespan)
+logger.info("App initialized")
 
 app.add_middleware(
     CORSMiddleware,
@@ -19,7 +74,92 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Server-Timing"],
 )
+app.add_middleware(GZipMiddleware, minimum_size=1024)
+
+def media_type_for(request):
+    try:
+        return negotiate(request.headers.get('accept'))
+    except NotAcceptable as e:
+        raise HTTPException(status_code=406, detail=str(e))
+
+def respond(request, payload):
+    """Encode a frame or {name: frame | value} payload in the format the Accept header asks for."""
+    media_type = media_type_for(request)
+    if media_type == NDJSON:
+        return StreamingResponse(iter_ndjson(payload), media_type=media_type)
+    try:
+        return Response(encode(payload, media_type), media_type=media_type)
+    except NotAcceptable as e:
+        raise HTTPException(status_code=406, detail=str(e))
+
+def not_modified(request, etag, modified):
+    """True if the request's If-None-Match / If-Modified-Since validators still match."""
+    if_none_match = request.headers.get('if-none-match')
+    if if_none_match is not None:
+        tags = [tag.strip() for tag in if_none_match.split(',')]
+        return etag is not None and ('*' in tags or etag in tags or f'W/{etag}' in tags)
+    if_modified_since = request.headers.get('if-modified-since')
+    if if_modified_since and modified is not None:
+        try:
+            return int(modified) <= parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+    return False
+
+def validator_headers(etag, modified):
+    headers = {'Vary': 'Accept, Accept-Encoding', 'Cache-Control': 'no-cache'}
+    if etag is not None:
+        headers['ETag'] = etag
+    if modified is not None:
+        headers['Last-Modified'] = formatdate(modified, usegmt=True)
+    return headers
+
+def respond_encoded(request, encoded):
+    """
+    Serve an EncodedPayload, pre-gzipped when the client accepts it (GZipMiddleware skips encoded bodies).
+    Versioned payloads carry ETag / Last-Modified and answer conditional requests with 304.
+    """
+    media_type = media_type_for(request)
+    compressed = accepts_gzip(request.headers.get('accept-encoding'))
+    etag = encoded.etag(media_type, compressed)
+    headers = validator_headers(etag, encoded.last_modified)
+    if not_modified(request, etag, encoded.last_modified):
+        return Response(status_code=304, headers=headers)
+    try:
+        body = encoded.body(media_type, compressed)
+    except NotAcceptable as e:
+        raise HTTPException(status_code=406, detail=str(e))
+    if compressed:
+        headers['Content-Encoding'] = 'gzip'
+    return Response(body, media_type=media_type, headers=headers)
+
+@app.middleware("http")
+async def serverTiming(request: Request, call_next):
+    # every span recorded while handling the request lands in `timings` (sync endpoints run with a copy of this context)
+    timings = Timings()
+    token = current_timings.set(timings)
+    start = time.perf_counter()
+    try:
+        response = await call_next(request)
+    finally:
+        current_timings.reset(token)
+    elapsed = time.perf_counter() - start
+
+    route = request.scope.get('route')
+    path = route.path if route is not None else 'unmatched'
+    registry.observe('http_request_duration_seconds', elapsed, method=request.method, path=path, status=response.status_code)
+
+    header = timings.server_timing()
+    response.headers['Server-Timing'] = f'{header + ", " if header else ""}total;dur={elapsed * 1000:.1f}'
+    response.headers['Timing-Allow-Origin'] = '*'
+    logger.info('%s %s %d %.1fms %s', request.method, request.url.path, response.status_code, elapsed * 1000, header)
+    return response
+
+@app.get("/metrics")
+def metrics():
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
 
 @app.get("/health")
 def health():
@@ -29,63 +169,280 @@ def health():
 def health_head():
     return {}
 
+@app.get("/ready")
+def ready():
+    if data_context.error is not None:
+        return JSONResponse({"status": "error", "detail": str(data_context.error)}, status_code=503)
+    if not data_context.is_ready():
+        return JSONResponse({"status": "loading"}, status_code=503)
+    return {"status": "ready"}
+
+def resolve_model(model_strategy):
+    """Canonical MODEL_REGISTRY name for `model_strategy`; 400 if unknown, 422 if above MAX_MODEL_COST."""
+    try:
+        backend = get_model_backend(model_strategy)
+    except NotImplementedError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if model_cost(backend.name) > MAX_MODEL_COST:
+        raise HTTPException(status_code=422, detail=f"Model '{backend.name}' costs {model_cost(backend.name):.2f} per quarter, above the limit of {MAX_MODEL_COST:.2f}")
+    return backend.name
+
+def resolve_quarters(start_quarter, end_quarter):
+    """Normalized trading window (see resolve_window); 400 for an unrecognized quarter or a window with nothing to trade."""
+    try:
+        return resolve_window(start_quarter, end_quarter, data_context.quarters_dict,
+                              last_date=data_context.price_data.index.max())
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+def cache_result(key, fingerprint, result):
+    """result_cache.put() of a result computed on the data with `fingerprint`; not cached if the data was reloaded meanwhile."""
+    if data_context.fingerprint != fingerprint:
+        payload = EncodedPayload(lambda: result)
+        payload.value = result
+        return payload
+    return result_cache.put(key, result)
+
+def resolve_benchmarks(benchmark):
+    """Requested benchmarks (price_data columns, or SPY) in order, without duplicates; 400 for an unknown one."""
+    names = tuple(dict.fromkeys(name.strip().upper() for name in benchmark if name.strip())) or ('SPY',)
+    unknown = [name for name in names if not data_context.benchmarks.available(name)]
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown benchmark(s): {', '.join(unknown)}")
+    return names
+
+@app.get("/api/models")
+def listModels():
+    return [
+        {"name": b.name, "description": b.description, "fit_cost": b.fit_cost, "predict_cost": b.predict_cost,
+         "allowed": model_cost(b.name) <= MAX_MODEL_COST}
+        for b in MODEL_REGISTRY.values()
+    ]
+
 @app.get("/api/uploadLedger")
-def uploadLedger():
-    print('ledger upload requested')
-    ledger = pd.read_csv('data/seed/ledger.csv')
-    return ledger.to_dict(orient="records")
+def uploadLedger(request: Request):
+    return respond_encoded(request, seed_payload('ledger'))
 
 @app.get("/api/uploadTransactions")
-def uploadTransactions():
-    print('transactions upload requested')
-    transactions = pd.read_csv('data/seed/transactions.csv')
-    return transactions.to_dict(orient="records")
+def uploadTransactions(request: Request):
+    return respond_encoded(request, seed_payload('transactions'))
 
 @app.get("/api/uploadMetrics")
-def uploadMetrics():
-    print('metrics upload requested')
-    ledger = pd.read_csv('data/seed/ledger.csv')
-    metrics = getMetrics(ledger, spy_baseline)
-    return metrics
+def uploadMetrics(request: Request):
+    return respond_encoded(request, seed_payload('metrics'))
 
 @app.get("/api/backtest")
 def customBacktest(
+    request: Request,
     k: int,
     initial_capital: float,
     random_state: int,
     model_strategy: str,
     sell_threshold: float,
-    start_quarter: str,
-    end_quarter: str
+    start_quarter: str = None,
+    end_quarter: str = None,
+    benchmark: list[str] = Query(['SPY'])
 ):
-    print("Backtest request received with:")
-    print(f"k={k}, capital={initial_capital}, model={model_strategy}, threshold={sell_threshold}, start={start_quarter}, end={end_quarter}")
-
-    transactions = main(
-        df_dict=df_dict,
-        price_data=price_data,
-        random_state=random_state,
-        k=k,
-        sell_threshold=sell_threshold,
-        log=True,
-        write_csv=False,
-        fundamentals_only=False,
-        relative_performance=False
-    )
-    
-    ledger = simulate_portfolio_ledger(
-        returns_df=transactions,
-        price_data=price_data,
-        initial_capital=initial_capital
-    )
-
-    ledger = ledger.iloc[:-1] # for some reason ledger returns a zero row at the end
-
-    # janky method to get SPY baseline (see top of script) --> refine
-    metrics = getMetrics(ledger, spy_baseline)
-
-    return {
-        "transactions": transactions.to_dict(orient="records"),
-        "ledger": ledger.to_dict(orient="records"),
-        "metrics": metrics
-    }
\ No newline at end of file
+    logger.info("Backtest request: k=%s, capital=%s, model=%s, threshold=%s, start=%s, end=%s, benchmarks=%s",
+                k, initial_capital, model_strategy, sell_threshold, start_quarter, end_quarter, benchmark)
+    fingerprint = data_context.refresh()  # data files rewritten since they were loaded are reloaded first
+    model_strategy = resolve_model(model_strategy)
+    # equivalent spellings ('Q1_2021' / '2021_Q1') and out-of-range bounds share one cached result
+    start_quarter, end_quarter = resolve_quarters(start_quarter, end_quarter)
+    benchmarks = resolve_benchmarks(benchmark)
+    media_type = media_type_for(request)  # reject an unsupported Accept before running anything
+    params = dict(k=k, initial_capital=initial_capital, random_state=random_state, model_strategy=model_strategy,
+                  sell_threshold=sell_threshold, start_quarter=start_quarter, end_quarter=end_quarter,
+                  benchmarks=benchmarks)
+
+    # deterministic for (params, data version): a matching ETag needs neither the result nor the cache
+    key = result_key(params, fingerprint)
+    etag = representation_etag(key, media_type, accepts_gzip(request.headers.get('accept-encoding')))
+    if request.headers.get('if-none-match') is not None and not_modified(request, etag, None):
+        return Response(status_code=304, headers=validator_headers(etag, None))
+
+    entry = result_cache.get(key)
+    if entry is None:
+        # serially, in this process: at most BACKTEST_CONCURRENCY requests run a backtest at a time
+        with request_slots:
+            result = run_backtest(params)
+        entry = cache_result(key, fingerprint, {name: result[name] for name in RESULT_TABLES})
+    return respond_encoded(request, entry)
+
+@app.get("/api/risk")
+def riskReport(
+    request: Request,
+    k: int,
+    initial_capital: float,
+    random_state: int,
+    model_strategy: str,
+    sell_threshold: float,
+    start_quarter: str = None,
+    end_quarter: str = None,
+    window: int = ROLLING_WINDOW
+):
+    """Rolling Sharpe / Sortino, drawdowns, per-quarter hit rate and turnover, and per-cluster attribution of a backtest."""
+    logger.info("Risk request: k=%s, capital=%s, model=%s, threshold=%s, start=%s, end=%s, window=%s",
+                k, initial_capital, model_strategy, sell_threshold, start_quarter, end_quarter, window)
+    if window < 2:
+        raise HTTPException(status_code=422, detail="window must be at least 2")
+    fingerprint = data_context.refresh()
+    model_strategy = resolve_model(model_strategy)
+    start_quarter, end_quarter = resolve_quarters(start_quarter, end_quarter)
+    media_type_for(request)  # reject an unsupported Accept before running anything
+    params = dict(k=k, initial_capital=initial_capital, random_state=random_state, model_strategy=model_strategy,
+                  sell_threshold=sell_threshold, start_quarter=start_quarter, end_quarter=end_quarter,
+                  benchmarks=('SPY',))
+
+    # the report is cached like a result; the backtest under it is shared with /api/backtest
+    key = result_key({**params, 'report': 'risk', 'window': window}, fingerprint)
+    entry = result_cache.get(key)
+    if entry is None:
+        backtest_key = result_key(params, fingerprint)
+        backtest = result_cache.get(backtest_key)
+        if backtest is None:
+            with request_slots:
+                result = run_backtest(params)
+            backtest = cache_result(backtest_key, fingerprint, {name: result[name] for name in RESULT_TABLES})
+        ledger, transactions = backtest.value['ledger'], backtest.value['transactions']
+        labels = cluster_labels(data_context.df_dict, transactions['quarter'].unique(), model_dir=KMEANS_DIR)
+        entry = cache_result(key, fingerprint, risk_report(ledger, transactions, window, labels))
+    return respond_encoded(request, entry)
+
+@app.post("/api/jobs")
+def submitBacktest(
+    k: int,
+    initial_capital: float,
+    random_state: int,
+    model_strategy: str,
+    sell_threshold: float,
+    start_quarter: str = None,
+    end_quarter: str = None,
+    benchmark: list[str] = Query(['SPY'])
+):
+    model_strategy = resolve_model(model_strategy)
+    start_quarter, end_quarter = resolve_quarters(start_quarter, end_quarter)
+    job = job_manager.submit(dict(k=k, initial_capital=initial_capital, random_state=random_state,
+                                  model_strategy=model_strategy, sell_threshold=sell_threshold,
+                                  start_quarter=start_quarter, end_quarter=end_quarter,
+                                  benchmarks=resolve_benchmarks(benchmark)))
+    return {"job_id": job.job_id, "status": job.status}
+
+@app.get("/api/jobs/{job_id}")
+def jobStatus(job_id: str):
+    job = job_manager.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Unknown job")
+    return job.to_dict()
+
+@app.get("/api/jobs/{job_id}/events")
+async def jobEvents(job_id: str):
+    job = job_manager.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Unknown job")
+
+    async def events():
+        last = None
+        while True:
+            state = job.to_dict()
+            if state != last:
+                yield f"data: {json.dumps(state)}\n\n"
+                last = state
+            if job.status in ('done', 'failed'):
+                break
+            await asyncio.sleep(0.5)
+
+    return StreamingResponse(events(), media_type="text/event-stream")
+
+@app.get("/api/jobs/{job_id}/result")
+def jobResult(job_id: str, request: Request):
+    job = job_manager.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Unknown job")
+    if job.status == 'failed':
+        # the job ran and failed; there is no result to serve
+        raise HTTPException(status_code=409, detail=f"Job failed: {job.error}")
+    if job.status != 'done':
+        raise HTTPException(status_code=409, detail=f"Job is {job.status}")
+
+    if job.encoded is None:
+        job.encoded = EncodedPayload(lambda: {name: job.result[name] for name in RESULT_TABLES})
+    return respond_encoded(request, job.encoded)
+
+@app.get("/api/sweep")
+def sweepBacktest(
+    request: Request,
+    random_state: int,
+    k: list[int] = Query(...),
+    sell_threshold: list[float] = Query(...),
+    initial_capital: list[float] = Query([100_000]),
+    confidence_weighted: list[bool] = Query([True]),
+    model_strategy: str = 'RandomForest',
+    start_quarter: str = None,
+    end_quarter: str = None
+):
+    logger.info("Sweep request: k=%s, threshold=%s, capital=%s, weighted=%s, model=%s, start=%s, end=%s",
+                k, sell_threshold, initial_capital, confidence_weighted, model_strategy, start_quarter, end_quarter)
+    data_context.refresh()
+    model_strategy = resolve_model(model_strategy)
+    start_quarter, end_quarter = resolve_quarters(start_quarter, end_quarter)
+
+    with request_slots:
+        results = sweep(
+            df_dict=data_context.df_dict,
+            price_data=data_context.price_data,
+            spy=data_context.spy_baseline,
+            ks=k,
+            sell_thresholds=sell_threshold,
+            initial_capitals=initial_capital,
+            confidence_weighted=confidence_weighted,
+            random_state=random_state,
+            fundamentals_only=False,
+            relative_performance=False,
+            use_cache=True,
+            model=model_strategy,
+            start_quarter=start_quarter,
+            end_quarter=end_quarter
+        )
+
+    return respond(request, results)
+
+@app.get("/api/ensemble")
+def ensembleBacktest(
+    request: Request,
+    k: int,
+    initial_capital: float,
+    sell_threshold: float,
+    n_seeds: int = 20,
+    random_state: int = 0,
+    model_strategy: str = 'RandomForest',
+    start_quarter: str = None,
+    end_quarter: str = None
+):
+    logger.info("Ensemble request: k=%s, capital=%s, threshold=%s, seeds=%s+%s, model=%s, start=%s, end=%s",
+                k, initial_capital, sell_threshold, random_state, n_seeds, model_strategy, start_quarter, end_quarter)
+    if not 1 <= n_seeds <= MAX_ENSEMBLE_SEEDS:
+        raise HTTPException(status_code=422, detail=f"n_seeds must be between 1 and {MAX_ENSEMBLE_SEEDS}")
+    data_context.refresh()
+    model_strategy = resolve_model(model_strategy)
+    start_quarter, end_quarter = resolve_quarters(start_quarter, end_quarter)
+    media_type_for(request)  # reject an unsupported Accept before running anything
+
+    with request_slots:
+        runs, summary = ensemble(
+            df_dict=data_context.df_dict,
+            price_data=data_context.price_data,
+            spy=data_context.spy_baseline,
+            seeds=range(random_state, random_state + n_seeds),
+            k=k,
+            sell_threshold=sell_threshold,
+            initial_capital=initial_capital,
+            fundamentals_only=False,
+            relative_performance=False,
+            use_cache=True,
+            model=model_strategy,
+            start_quarter=start_quarter,
+            end_quarter=end_quarter
+        )
+
+    return respond(request, {"runs": runs, "summary": summary})
@@ -1,41 +1,73 @@
-from .utils import quarters_dict
-from .models import build_training_data, train_model, rank_stocks, get_buys, get_sells
+from .utils import quarters_dict, quarter_window, getMetrics
+from .models import build_training_data, build_quarter_chunk, train_model, rank_stocks, get_buys, get_sells
+from .cache import get_training_data
+from .clustering import KMEANS_DIR, performance_window
+from .benchmark import benchmark_series
+from .positions import PositionBook, TradeLog
+from .risk import batch_summary
+from .timing import span, timed, collect, merge
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from itertools import product
 import pandas as pd
 import numpy as np
+import logging
 import random
 
-def compute_quarterly_returns(buys_df, sells_df, price_data, quarters_dict):
-    results = []
+logger = logging.getLogger(__name__)
+
+LEDGER_BLOCK = 256  # symbols per block of the ledger's holdings matrices
+
+def last_valid_prices(price_data):
+    """Last non-null price and its date for every symbol in price_data (NaT / NaN if never priced)."""
+    values = price_data.to_numpy()  # no float64 copy of a float32 (large-universe) panel
+    valid = ~np.isnan(values)
+    last_pos = len(values) - 1 - np.argmax(valid[::-1], axis=0)
+    has_price = valid.any(axis=0)
+    last_date = np.where(has_price, price_data.index.values[last_pos], np.datetime64('NaT'))
+    last_price = np.where(has_price, values[last_pos, np.arange(values.shape[1])], np.nan)
+    return pd.DataFrame({'last_date': last_date, 'last_price': last_price}, index=price_data.columns)
+
+@timed('trade_matching')
+def compute_quarterly_returns(buys_df, sells_df, price_data, quarters_dict, last_prices=None):
+    date_to_quarter = {}
+    for q, start in quarters_dict.items():
+        date_to_quarter.setdefault(start, q)  # first matching quarter wins
+
+    # per-symbol sell dates in order; a buy closes at the first sell strictly after it
+    sell_index = {}
+    if not sells_df.empty:
+        sell_dates = pd.to_datetime(sells_df['sell_date']).to_numpy()
+        for symbol, rows in sells_df.groupby('symbol', sort=False).indices.items():
+            rows = rows[np.argsort(sell_dates[rows], kind='stable')]
+            sell_index[symbol] = (sell_dates[rows], rows)
+
+    if last_prices is None:
+        last_prices = last_valid_prices(price_data)
 
-    for _, row in buys_df.iterrows():
-        symbol = row['symbol']
-        buy_date = row['buy_date']
-        buy_price = row['buy_price']
-        confidence = row['confidence']
-        quarter = None
-
-        # Find matching quarter
-        for q, start in quarters_dict.items():
-            if start == buy_date:
-                quarter = q
-                break
-
-        # Determine sell price
-        sell_row = next(
-            (r for r in sells_df.itertuples() if r.symbol == symbol and r.sell_date > buy_date),
-            None
-        )
-
-        if sell_row:
-            sell_price = sell_row.sell_price
-            sell_date = sell_row.sell_date
+    results = []
+    buy_dates = pd.to_datetime(buys_df['buy_date']).to_numpy() if not buys_df.empty else []
+    for row, buy_ts in zip(buys_df.itertuples(index=False), buy_dates):
+        symbol = row.symbol
+        buy_date = row.buy_date
+        buy_price = row.buy_price
+        quarter = date_to_quarter.get(buy_date)
+
+        sell_row = None
+        if symbol in sell_index:
+            dates, rows = sell_index[symbol]
+            pos = np.searchsorted(dates, buy_ts, side='right')
+            if pos < len(dates):
+                sell_row = rows[pos]
+
+        if sell_row is not None:
+            sell_price = sells_df['sell_price'].iat[sell_row]
+            sell_date = sells_df['sell_date'].iat[sell_row]
         else:
             # Perma hold — use last available price
-            try:
-                sell_price = price_data.loc[buy_date:, symbol].dropna().iloc[-1]
-                sell_date = price_data.loc[buy_date:, symbol].dropna().index[-1]
-            except:
+            if symbol not in last_prices.index or not last_prices.at[symbol, 'last_date'] >= buy_ts:
                 continue  # skip if no future price data
+            sell_price = last_prices.at[symbol, 'last_price']
+            sell_date = last_prices.at[symbol, 'last_date']
 
         gain = (sell_price - buy_price) / buy_price
 
@@ -47,30 +79,38 @@ def compute_quarterly_returns(buys_df, sells_df, price_data, quarters_dict):
             'sell_price': sell_price,
             'gain': gain,
             'quarter': quarter,
-            'confidence': confidence
+            'confidence': row.confidence
         })
 
-    return pd.DataFrame(results)
+    # column-ful even without trades, so the baseline merge still finds 'quarter'
+    return pd.DataFrame(results, columns=['symbol', 'buy_date', 'buy_price', 'sell_date', 'sell_price', 'gain',
+                                          'quarter', 'confidence'])
 
 def compute_baseline_returns(price_data: pd.DataFrame, quarters_dict: dict) -> pd.DataFrame:
-    capital = [100000]
-    results = []
-
-    last_date = price_data.index.max()
-    for q in sorted(quarters_dict.keys())[:-2]:
-        try:
-            start_date = pd.to_datetime(quarters_dict[q])
-            start_price = price_data.loc[start_date:, 'SPY'].dropna().iloc[0]
-            end_price = price_data.loc[last_date:, 'SPY'].dropna().iloc[0]
-            ret = (end_price - start_price) / start_price
-            results.append({'quarter': q, 'baseline_return': ret})
-            capital.append(capital[-1] * (1 + ret))
-        except Exception as e:
-            print(f"Skipping {q}: {e}")
-            continue
-
-    df = pd.DataFrame(results)
-    df['baseline_capital'] = capital[1:]
+    """
+    SPY buy-and-hold return from each quarter's date (first SPY price on or after it) to the last
+    price_data date, and the capital compounded over those returns. Quarters without a price are skipped.
+    """
+    quarters = sorted(quarters_dict.keys())[:-2]
+    if 'SPY' not in price_data.columns or not quarters:
+        logger.debug("No SPY baseline for %s", quarters)
+        return pd.DataFrame(columns=['quarter', 'baseline_return', 'baseline_capital'])
+
+    spy = price_data['SPY'].dropna()
+    if spy.empty or spy.index[-1] != price_data.index.max():
+        # the end price is the first one on or after the last date, so only a price on that date will do
+        logger.debug("No SPY price on %s", price_data.index.max())
+        return pd.DataFrame(columns=['quarter', 'baseline_return', 'baseline_capital'])
+
+    values = spy.to_numpy()
+    pos = spy.index.searchsorted(pd.to_datetime([quarters_dict[q] for q in quarters]), side='left')
+    priced = pos < len(values)
+    start_price = values[pos[priced]]
+    ret = (values[-1] - start_price) / start_price
+
+    df = pd.DataFrame({'quarter': np.array(quarters, dtype=object)[priced], 'baseline_return': ret})
+    # compounded quarter by quarter, left to right
+    df['baseline_capital'] = np.multiply.accumulate(np.concatenate([np.array([100000], dtype=ret.dtype), 1 + ret]))[1:]
     return df
 
 def get_train_test_data(data_dict, q_train, q_feat, fundamentals_only):
@@ -79,7 +119,7 @@ def get_train_test_data(data_dict, q_train, q_feat, fundamentals_only):
         train_df = data_dict[q_train].dropna(subset=['target'])
         test_df = data_dict[q_feat].dropna(subset=['target'])
     except KeyError as e:
-        print(f"Missing data for quarter: {e}")
+        logger.debug("Missing data for quarter: %s", e)
         return None, None, None, None, None
 
     if train_df.empty or test_df.empty:
@@ -104,71 +144,246 @@ def get_train_test_data(data_dict, q_train, q_feat, fundamentals_only):
 
     return X_train, y_train, X_test, y_test, symbols
 
-def backtest_loop(df_dict, price_data, quarters_dict, fundamentals_only, k=10, sell_threshold=0.3, relative_performance=True):
-    data_dict = build_training_data(df_dict, price_data, relative_performance=relative_performance)
+def fit_and_rank(X_train, y_train, X_test, y_test, symbols, n_jobs=-1, model='RandomForest', quarter=None, seed=17):
+    """Fit one quarter's model and rank the next quarter's stocks by predicted probability."""
+    with span('fit', quarter=quarter, model=model):
+        model = train_model(X_train, y_train, model=model, seed=seed, n_jobs=n_jobs)
+    with span('predict', quarter=quarter):
+        return rank_stocks(model, X_test, y_test, symbols)
+
+def ranking_tasks(data_dict, quarters, fundamentals_only, only=None):
+    """{q_feat: (X_train, y_train, X_test, y_test, symbols)} for every (q_train, q_feat) pair with data."""
+    tasks = {}
+    for i in range(len(quarters) - 2):
+        q_train, q_feat = quarters[i], quarters[i+1]
+        if only is not None and q_feat not in only:
+            continue
+        X_train, y_train, X_test, y_test, symbols = get_train_test_data(data_dict, q_train, q_feat, fundamentals_only)
+        if X_train is None:
+            continue
+        tasks[q_feat] = (X_train, y_train, X_test, y_test, symbols)
+    return tasks
+
+def run_fits(fits, n_workers=1, executor='process', progress=None):
+    """
+    Run {key: (args, kwargs)} fit_and_rank calls, over a process or thread pool unless n_workers == 1.
+    Returns {key: rankings_df} in the order of `fits`.
+    """
+    if n_workers is None or n_workers > 1:
+        # one tree-building thread per task; the pool provides the parallelism
+        pool_cls = ProcessPoolExecutor if executor == 'process' else ThreadPoolExecutor
+        with pool_cls(max_workers=n_workers) as pool:
+            # spans recorded in the workers come back with each result
+            futures = {pool.submit(collect, fit_and_rank, *args, n_jobs=1, **kwargs): key
+                       for key, (args, kwargs) in fits.items()}
+            rankings = {}
+            for done, future in enumerate(as_completed(futures), start=1):
+                rankings[futures[future]], events = future.result()
+                merge(events)
+                if progress:
+                    progress('models', done, len(fits))
+            return {key: rankings[key] for key in fits}
+
+    rankings = {}
+    for done, (key, (args, kwargs)) in enumerate(fits.items(), start=1):
+        rankings[key] = fit_and_rank(*args, **kwargs)
+        if progress:
+            progress('models', done, len(fits))
+    return rankings
+
+def compute_rankings(data_dict, quarters, fundamentals_only, n_workers=1, executor='process', progress=None, only=None,
+                     model='RandomForest', seed=17):
+    """
+    Phase 1 of the walk-forward: fit every (q_train, q_feat) model and rank q_feat's stocks.
+    The fits are independent, so they can be spread over a process or thread pool.
+    Returns {q_feat: rankings_df} in quarter order. progress(stage, done, total) is called
+    after every fitted quarter. `only` restricts the fits to a set of q_feat quarters; `model` names
+    a MODEL_REGISTRY backend and `seed` is its random_state.
+    """
+    tasks = ranking_tasks(data_dict, quarters, fundamentals_only, only)
+    fits = {q: (args, dict(model=model, quarter=q, seed=seed)) for q, args in tasks.items()}
+    return run_fits(fits, n_workers, executor, progress)
+
+@timed('replay')
+def next_valid_prices(price_data, date, symbols, block=64):
+    """
+    First non-null price on or after `date` for each symbol, NaN if there is none (or the symbol is not
+    in price_data), like price_data.loc[date:, symbol].dropna().iloc[0]. Rows are scanned `block` at a
+    time, only for the symbols still unpriced, so a long history is never copied.
+    """
+    values = price_data.to_numpy()
+    row = price_data.index.searchsorted(pd.Timestamp(date), side='left')
+    cols = price_data.columns.get_indexer(symbols)
+    out = np.full(len(cols), np.nan, dtype=values.dtype)
+    pending = np.flatnonzero(cols >= 0)
+    while len(pending) and row < len(values):
+        chunk = values[row:row + block, cols[pending]]
+        valid = ~np.isnan(chunk)
+        found = valid.any(axis=0)
+        out[pending[found]] = chunk[valid.argmax(axis=0)[found], np.flatnonzero(found)]
+        pending = pending[~found]
+        row += block
+    return out
+
+def replay_rankings(rankings, price_data, quarters_dict, k=10, sell_threshold=0.3, verbose=True):
+    """
+    Phase 2 of the walk-forward: replay buys and sells in quarter order from precomputed rankings.
+    Open positions live in a PositionBook and the trades in TradeLogs, so each quarter's buys and
+    sells are a few array operations however many positions are open.
+    """
     quarters = list(quarters_dict.keys())
 
-    active_positions = []
-    buy_records = []
-    sell_records = []
+    book = PositionBook(dtype=price_data.to_numpy().dtype)
+    buy_records = TradeLog(['symbol', 'buy_date', 'buy_price', 'confidence'])
+    sell_records = TradeLog(['symbol', 'sell_date', 'sell_price', 'gain'])
 
     for i in range(len(quarters) - 2):
-        q_train, q_feat, q_eval = quarters[i], quarters[i+1], quarters[i+2]
+        q_feat, q_eval = quarters[i+1], quarters[i+2]
         start_date = quarters_dict[q_feat]
         end_date = quarters_dict[q_eval]
 
-        X_train, y_train, X_test, y_test, symbols = get_train_test_data(data_dict, q_train, q_feat, fundamentals_only)
-        if X_train is None:
+        rankings_df = rankings.get(q_feat)
+        if rankings_df is None:
             continue
 
-        model = train_model(X_train, y_train)
-        rankings_df = rank_stocks(model, X_test, y_test, symbols) # rank all stocks based on predicted future returns
         buys = get_buys(rankings_df, k=k)
-        print(buys)
-        # Record buys
-        for _, row in buys.iterrows():
-            symbol = row['symbol']
-            confidence = row['prob']
-            try:
-                start_price = price_data.loc[start_date:, symbol].dropna().iloc[0]
-                buy_records.append({
-                    'symbol': symbol,
-                    'buy_date': start_date,
-                    'buy_price': start_price,
-                    'confidence': confidence
-                })
-                active_positions.append({
-                    'symbol': symbol,
-                    'start_price': start_price,
-                    'start_date': start_date,
-                })
-            except:
-                continue
-
-        # Record closes
-        sells = get_sells(rankings_df, active_positions, threshold=sell_threshold)
-        for closed_position in sells:
-            symbol = closed_position['symbol']
-            try:
-                end_price = price_data.loc[end_date:, symbol].dropna().iloc[0]
-                gain = (end_price - closed_position['start_price']) / closed_position['start_price']
-                sell_records.append({
-                    'symbol': symbol,
-                    'sell_date': end_date,
-                    'sell_price': end_price,
-                    'gain': gain
-                })
-                active_positions.remove(closed_position)
-            except:
-                continue
-
-    buys_df = pd.DataFrame(buy_records)
-    sells_df = pd.DataFrame(sell_records)
-    return buys_df, sells_df
-
-def main(df_dict, price_data, random_state=102, k=10, sell_threshold=0.3, log=True, write_csv=False, fundamentals_only=False, relative_performance=True, quarters_dict=quarters_dict):
+        if verbose and logger.isEnabledFor(logging.DEBUG):
+            logger.debug("%s buys: %s", q_feat, ', '.join(buys['symbol']))
+        # Record buys (symbols without a price from start_date on are skipped)
+        symbols = buys['symbol'].to_numpy()
+        start_prices = next_valid_prices(price_data, start_date, symbols)
+        priced = ~np.isnan(start_prices)
+        buy_records.add(symbol=symbols[priced], buy_date=start_date, buy_price=start_prices[priced],
+                        confidence=buys['prob'].to_numpy()[priced])
+        book.open(symbols[priced], start_prices[priced], start_date)
+
+        # Record closes (positions without a price from end_date on stay open)
+        slots = get_sells(rankings_df, book, threshold=sell_threshold)
+        symbols = book.symbols(slots)
+        end_prices = next_valid_prices(price_data, end_date, symbols)
+        priced = ~np.isnan(end_prices)
+        slots, symbols, end_prices = slots[priced], symbols[priced], end_prices[priced]
+        gains = (end_prices - book.start_price[slots]) / book.start_price[slots]
+        sell_records.add(symbol=symbols, sell_date=end_date, sell_price=end_prices, gain=gains)
+        book.close(slots)
+
+    return buy_records.to_frame(), sell_records.to_frame()
+
+@timed('training_data')
+def prepare_training_data(df_dict, price_data, relative_performance=True, use_cache=False, quarters_dict=quarters_dict,
+                          fingerprint=None):
+    if use_cache:
+        return get_training_data(df_dict, price_data, relative_performance=relative_performance, model_dir=KMEANS_DIR,
+                                 quarters_dict=quarters_dict, fingerprint=fingerprint)
+    return build_training_data(df_dict, price_data, relative_performance=relative_performance, quarters_dict=quarters_dict)
+
+def stream_rankings(df_dict, price_data, quarters_dict, fundamentals_only, relative_performance=True, progress=None,
+                    model='RandomForest', seed=17, dtype=np.float32):
+    """
+    compute_rankings() for universes too large to hold every quarter's features at once: a quarter is
+    built (build_quarter_chunk, stored as `dtype`) when the walk-forward first reaches it and dropped
+    once the pair training on it is fitted, so at most two quarters of features are alive. The fits
+    run one at a time, each on every core.
+    """
+    quarters = list(quarters_dict.keys())
+    buildable = set(sorted(df_dict)[:-2])
+    chunks = {}
+    rankings = {}
+    for i in range(len(quarters) - 2):
+        q_train, q_feat = quarters[i], quarters[i+1]
+        for q in (q_train, q_feat):
+            if q not in chunks:
+                chunks[q] = build_quarter_chunk(df_dict, price_data, q, relative_performance=relative_performance,
+                                                quarters_dict=quarters_dict, dtype=dtype) if q in buildable else None
+        data = {q: chunks[q] for q in (q_train, q_feat) if chunks[q] is not None}
+        X_train, y_train, X_test, y_test, symbols = get_train_test_data(data, q_train, q_feat, fundamentals_only)
+        del chunks[q_train]
+        if X_train is not None:
+            rankings[q_feat] = fit_and_rank(X_train, y_train, X_test, y_test, symbols, model=model, quarter=q_feat, seed=seed)
+        if progress:
+            progress('models', i + 1, len(quarters) - 2)
+    return rankings
+
+def window_prices(price_data, window, quarters_dict=quarters_dict):
+    """
+    price_data rows a windowed backtest trades, marks and benchmarks on: from the window's first quarter
+    up to the report date of its last one, so positions still open are marked as of the quarter after
+    the final sells. A window reaching the last quarter keeps every later row, like the full backtest.
+    """
+    quarters = list(window)
+    dates = price_data.index
+    keep = dates >= pd.Timestamp(window[quarters[0]])
+    if quarters[-1] != list(quarters_dict)[-1]:
+        keep &= dates < pd.Timestamp(window[quarters[-1]])
+    return price_data[keep]
+
+def lookahead_prices(price_data, window, quarters_dict=quarters_dict):
+    """price_data rows the window's features and targets read: through its last quarter's performance window."""
+    quarters = list(window)
+    _, end = performance_window(quarters[-1], quarters_dict=quarters_dict)
+    dates = price_data.index
+    return price_data[(dates >= pd.Timestamp(window[quarters[0]])) & (dates <= end)]
+
+def apply_window(df_dict, price_data, quarters_dict=quarters_dict, start_quarter=None, end_quarter=None):
+    """
+    (window, df_dict, feature_prices, trade_prices) for a backtest trading start_quarter .. end_quarter
+    (see quarter_window): only the window's quarters are clustered, featurized and modeled. The full
+    range returns the inputs unchanged.
+    """
+    window = quarter_window(start_quarter, end_quarter, quarters_dict)
+    if len(window) == len(quarters_dict):
+        return quarters_dict, df_dict, price_data, price_data
+    df_dict = {q: df for q, df in df_dict.items() if q in window}
+    return window, df_dict, lookahead_prices(price_data, window, quarters_dict), window_prices(price_data, window, quarters_dict)
+
+def backtest_loop(df_dict, price_data, quarters_dict, fundamentals_only, k=10, sell_threshold=0.3, relative_performance=True, use_cache=False, n_workers=1, executor='process', progress=None, model='RandomForest', feature_prices=None, calendar=None, large_universe=False, seed=17, fingerprint=None):
+    """
+    Buys and sells over quarters_dict, from models fitted with random_state `seed`. `feature_prices` (default price_data) is what the targets are computed from and
+    `calendar` (default quarters_dict) the full quarter calendar they are dated by, and `fingerprint` identifies
+    the data for the training data cache (see cache.get_training_data). large_universe streams the
+    features quarter by quarter (stream_rankings) instead of building them all up front.
+    """
+    if progress:
+        progress('training_data', 0, 1)
+    feature_prices = price_data if feature_prices is None else feature_prices
+    calendar = quarters_dict if calendar is None else calendar
+    quarters = list(quarters_dict.keys())
+
+    if large_universe:
+        rankings = stream_rankings(df_dict, feature_prices, calendar, fundamentals_only, relative_performance,
+                                   progress=progress, model=model, seed=seed)
+    else:
+        data_dict = prepare_training_data(df_dict, feature_prices, relative_performance, use_cache, calendar, fingerprint)
+        rankings = compute_rankings(data_dict, quarters, fundamentals_only, n_workers=n_workers, executor=executor, progress=progress,
+                                    model=model, seed=seed)
+    return replay_rankings(rankings, price_data, quarters_dict, k=k, sell_threshold=sell_threshold)
+
+def build_transactions(buys_df, sells_df, price_data, quarters_dict, baseline_returns=None, last_prices=None):
+    """Match buys to sells and merge the per-trade returns with the SPY baseline."""
+    strategy_returns = compute_quarterly_returns(buys_df, sells_df, price_data, quarters_dict, last_prices)
+    if baseline_returns is None:
+        baseline_returns = compute_baseline_returns(price_data, quarters_dict)
+
+    merged = pd.merge(baseline_returns, strategy_returns, on='quarter')
+    merged['strat_edge'] = merged['gain'] - merged['baseline_return']
+    merged = merged[['quarter', 'buy_date', 'sell_date', 'baseline_return', 'symbol',
+                     'buy_price', 'sell_price', 'gain', 'strat_edge', 'confidence']]
+    merged = merged.rename(columns={
+        'buy_date': 'purchase_date',
+        'buy_price': 'start_price',
+        'sell_price': 'end_price',
+        'gain': 'return'
+    })
+    return merged
+
+def main(df_dict, price_data, random_state=102, k=10, sell_threshold=0.3, log=True, write_csv=False, fundamentals_only=False, relative_performance=True, quarters_dict=quarters_dict, use_cache=False, n_workers=1, executor='process', progress=None, model='RandomForest', start_quarter=None, end_quarter=None, large_universe=False, fingerprint=None):
+    # random_state also seeds every model fit, so main(random_state=s) reproduces ensemble seed s
     np.random.seed(random_state)
     random.seed(random_state)
+    if large_universe:
+        price_data = price_data.astype(np.float32)  # no copy if it already is
+    calendar = quarters_dict
+    quarters_dict, df_dict, feature_prices, price_data = apply_window(df_dict, price_data, quarters_dict, start_quarter, end_quarter)
 
     # main backtesting loop
     buys_df, sells_df = backtest_loop(
@@ -179,22 +394,20 @@ def main(df_dict, price_data, random_state=102, k=10, sell_threshold=0.3, log=Tr
         k=k,
         sell_threshold=sell_threshold,
         relative_performance=relative_performance,
+        use_cache=use_cache,
+        n_workers=n_workers,
+        executor=executor,
+        progress=progress,
+        model=model,
+        feature_prices=feature_prices,
+        calendar=calendar,
+        large_universe=large_universe,
+        seed=random_state,
+        fingerprint=fingerprint,
     )
 
     # compute strategy vs. baseline returns
-    strategy_returns = compute_quarterly_returns(buys_df, sells_df, price_data, quarters_dict)
-    baseline_returns = compute_baseline_returns(price_data, quarters_dict)
-
-    merged = pd.merge(baseline_returns, strategy_returns, on='quarter')
-    merged['strat_edge'] = merged['gain'] - merged['baseline_return']
-    merged = merged[['quarter', 'buy_date', 'sell_date', 'baseline_return', 'symbol',
-                     'buy_price', 'sell_price', 'gain', 'strat_edge', 'confidence']]
-    merged = merged.rename(columns={
-        'buy_date': 'purchase_date',
-        'buy_price': 'start_price',
-        'sell_price': 'end_price',
-        'gain': 'return'
-    })
+    merged = build_transactions(buys_df, sells_df, price_data, quarters_dict)
 
     if log:
         avg_return = merged['return'].mean()
@@ -202,101 +415,230 @@ def main(df_dict, price_data, random_state=102, k=10, sell_threshold=0.3, log=Tr
         avg_edge = merged['strat_edge'].mean()
         sharpe = avg_edge / merged['strat_edge'].std()
 
-        print("===== Backtest Summary =====")
-        print(f"Avg Return:         {avg_return:.2%}")
-        print(f"Avg Baseline:       {avg_baseline:.2%}")
-        print(f"Avg Strategy Edge:  {avg_edge:.2%}")
-        print(f"Sharpe (Edge):      {sharpe:.2f}")
-        print(f"Total Trades:       {len(merged)}")
-        print("============================")
+        logger.info("Backtest summary: avg return %.2f%%, avg baseline %.2f%%, avg edge %.2f%%, sharpe (edge) %.2f, %d trades",
+                    avg_return * 100, avg_baseline * 100, avg_edge * 100, sharpe, len(merged))
 
     if write_csv:
         path = f'data/results/results_randomstate{random_state}_k{k}.csv'
         merged.to_csv(path, index=False)
         if log:
-            print(f"Results written to: {path}")
+            logger.info("Results written to: %s", path)
 
     return merged
 
-def simulate_portfolio_ledger(returns_df, price_data, initial_capital=100_000, confidence_weighted=True):
-    returns_df = returns_df.copy()
-    returns_df['purchase_date'] = pd.to_datetime(returns_df['purchase_date'])
-    returns_df['sell_date'] = pd.to_datetime(returns_df['sell_date'])
+def sweep(df_dict, price_data, spy, ks=(10,), sell_thresholds=(0.3,), initial_capitals=(100_000,),
+          confidence_weighted=(True,), random_state=102, fundamentals_only=False, relative_performance=True,
+          quarters_dict=quarters_dict, use_cache=False, n_workers=1, executor='process', model='RandomForest',
+          start_quarter=None, end_quarter=None):
+    """
+    Grid search over k / sell_threshold / initial_capital / confidence weighting, with models fitted
+    with random_state `random_state` (as main() and each ensemble() seed). None of these affect the models, so the per-quarter rankings are computed once and every
+    combination only replays trades and simulates its ledger. Returns one row of getMetrics per combination,
+    plus the batched risk columns (see with_risk).
+    """
+    np.random.seed(random_state)
+    random.seed(random_state)
+    window, df_dict, feature_prices, price_data = apply_window(df_dict, price_data, quarters_dict, start_quarter, end_quarter)
+    calendar, quarters_dict = quarters_dict, window
 
-    start = returns_df['purchase_date'].min()
-    end = returns_df['sell_date'].max()
-    all_dates = pd.date_range(start, end, freq='B')
+    data_dict = prepare_training_data(df_dict, feature_prices, relative_performance, use_cache, calendar)
+    rankings = compute_rankings(data_dict, list(quarters_dict.keys()), fundamentals_only, n_workers=n_workers, executor=executor,
+                                model=model, seed=random_state)
+    baseline_returns = compute_baseline_returns(price_data, quarters_dict)
+    last_prices = last_valid_prices(price_data)
+    spy = benchmark_series(spy)  # parsed once, aligned to each ledger by getMetrics
+
+    results, ledgers, trades = [], [], []
+    for k, sell_threshold in product(ks, sell_thresholds):
+        buys_df, sells_df = replay_rankings(rankings, price_data, quarters_dict, k=k, sell_threshold=sell_threshold, verbose=False)
+        transactions = build_transactions(buys_df, sells_df, price_data, quarters_dict, baseline_returns, last_prices)
+
+        for initial_capital, weighted in product(initial_capitals, confidence_weighted):
+            ledger = simulate_portfolio_ledger(transactions, price_data, initial_capital, confidence_weighted=weighted)
+            results.append({
+                'k': k,
+                'sell_threshold': sell_threshold,
+                'initial_capital': initial_capital,
+                'confidence_weighted': weighted,
+                'num_trades': len(transactions),
+                **getMetrics(ledger, spy)
+            })
+            ledgers.append(ledger)
+            trades.append(transactions)
+
+    return with_risk(pd.DataFrame(results), ledgers, trades)
+
+def with_risk(results, ledgers, trades, columns=('sortino_ratio', 'max_drawdown_duration', 'hit_rate')):
+    """`results` (one row per ledger) plus the risk.batch_summary() columns getMetrics doesn't already report."""
+    if not ledgers:
+        return results
+    risk = batch_summary(ledgers, trades)
+    return pd.concat([results, risk[list(columns)]], axis=1)
+
+def summarize_runs(runs, quantiles=(0.05, 0.25, 0.5, 0.75, 0.95)):
+    """One row per metric of `runs`: mean, std, min, the given quantiles, max and the interquartile range."""
+    values = runs.drop(columns=['seed'])
+    stats = {'mean': values.mean(), 'std': values.std(), 'min': values.min()}
+    for q in quantiles:
+        stats[f'q{q * 100:g}'] = values.quantile(q)
+    stats['max'] = values.max()
+    stats['iqr'] = values.quantile(0.75) - values.quantile(0.25)
+    summary = pd.DataFrame(stats)
+    summary.index.name = 'metric'
+    return summary.reset_index()
+
+def ensemble(df_dict, price_data, spy, seeds=range(10), k=10, sell_threshold=0.3, initial_capital=100_000,
+             fundamentals_only=False, relative_performance=True, quarters_dict=quarters_dict, use_cache=False,
+             n_workers=1, executor='process', progress=None, model='RandomForest', start_quarter=None, end_quarter=None):
+    """
+    The backtest once per seed in `seeds`, each seed being the random_state of every model fit.
+    Clustering, features, the train/test splits, the SPY baseline and the last prices don't depend on
+    the seed and are computed once; all (seed, quarter) fits go through one pool, and each seed then
+    only replays its trades and simulates its ledger. Returns (runs, summary): a row of getMetrics (and
+    the with_risk columns) per seed, and summarize_runs() over them.
+    """
+    seeds = list(seeds)
+    window, df_dict, feature_prices, price_data = apply_window(df_dict, price_data, quarters_dict, start_quarter, end_quarter)
+    calendar, quarters_dict = quarters_dict, window
+
+    if progress:
+        progress('training_data', 0, 1)
+    data_dict = prepare_training_data(df_dict, feature_prices, relative_performance, use_cache, calendar)
+    tasks = ranking_tasks(data_dict, list(quarters_dict.keys()), fundamentals_only)
+    fits = {(seed, q): (args, dict(model=model, quarter=q, seed=seed)) for seed in seeds for q, args in tasks.items()}
+    fitted = run_fits(fits, n_workers, executor, progress)
 
+    baseline_returns = compute_baseline_returns(price_data, quarters_dict)
+    last_prices = last_valid_prices(price_data)
+    spy = benchmark_series(spy)  # parsed once, aligned to each ledger by getMetrics
+    rows, ledgers, trades = [], [], []
+    for seed in seeds:
+        rankings = {q: fitted[(seed, q)] for q in tasks}
+        buys_df, sells_df = replay_rankings(rankings, price_data, quarters_dict, k=k, sell_threshold=sell_threshold, verbose=False)
+        transactions = build_transactions(buys_df, sells_df, price_data, quarters_dict, baseline_returns, last_prices)
+        ledger = simulate_portfolio_ledger(transactions, price_data, initial_capital)
+        rows.append({'seed': seed, 'num_trades': len(transactions),
+                     **getMetrics(ledger, spy)})
+        ledgers.append(ledger)
+        trades.append(transactions)
+
+    runs = with_risk(pd.DataFrame(rows), ledgers, trades)
+    return runs, summarize_runs(runs)
+
+def mark_prices(price_data, symbols, dates):
+    """
+    (dates x symbols) matrix of mark-to-market prices. Dates present in price_data use that day's
+    price as-is; dates missing from it (holidays) fall back to the last known price.
+    """
+    prices = price_data[symbols]
+    raw = prices.reindex(dates).to_numpy(dtype=np.float64)
+    last_known = prices.ffill().reindex(dates, method='ffill').to_numpy(dtype=np.float64)
+    in_index = dates.isin(price_data.index)
+    return np.where(in_index[:, None], raw, last_known)
+
+@timed('ledger')
+def simulate_portfolio_ledger(returns_df, price_data, initial_capital=100_000, confidence_weighted=True):
+    """
+    Daily (business day) portfolio ledger for a transactions frame from main().
+    Positions are share vectors over [purchase, sell) date intervals, so cash only has to be stepped
+    through the handful of trade dates; holdings and values are cumulative sums over the date axis.
+    The final liquidation day (everything closed, nothing invested) is not part of the ledger.
+    Without any trades there is no holding period, and the ledger is empty.
+    """
+    if returns_df.empty:
+        return pd.DataFrame({'date': pd.DatetimeIndex([]), 'portfolio_value': np.array([]), 'cash': np.array([]),
+                             'invested': np.array([]), 'num_positions': np.array([], dtype=np.int64)})
+
+    purchase_dates = pd.to_datetime(returns_df['purchase_date']).to_numpy()
+    sell_dates = pd.to_datetime(returns_df['sell_date']).to_numpy()
+    symbols = returns_df['symbol'].to_numpy()
+    confidence = returns_df['confidence'].to_numpy(dtype=np.float64)
+
+    start = purchase_dates.min()
+    end = sell_dates.max()
+    all_dates = pd.date_range(start, end, freq='B')
+    n_dates = len(all_dates)
+
+    # trades can only open on a business day that has a row in price_data for a known symbol
+    buy_idx = all_dates.get_indexer(purchase_dates)
+    tradable = (buy_idx >= 0) & pd.Index(purchase_dates).isin(price_data.index) & pd.Index(symbols).isin(price_data.columns)
+
+    prices = price_data.to_numpy()  # a view for a single-dtype panel
+    price_rows = price_data.index.get_indexer(purchase_dates)
+    price_cols = price_data.columns.get_indexer(symbols)
+    buy_price = np.full(len(symbols), np.nan)
+    buy_price[tradable] = prices[price_rows[tradable], price_cols[tradable]]
+
+    # positions are dropped on the first business day on/after their sell date, but only
+    # realize proceeds if the sell date itself is a trading day in price_data
+    close_idx = np.maximum(np.searchsorted(all_dates.values, sell_dates, side='left'), buy_idx + 1)
+    sells_on_close = (close_idx < n_dates) & (all_dates.values[np.minimum(close_idx, n_dates - 1)] == sell_dates)
+    sell_rows = price_data.index.get_indexer(sell_dates)
+    realized = tradable & sells_on_close & (sell_rows >= 0)
+    sell_price = np.full(len(symbols), np.nan)
+    sell_price[realized] = prices[sell_rows[realized], price_cols[realized]]
+
+    # step cash through the trade dates: sells first, then buys sized off the running cash
+    shares = np.zeros(len(symbols))
+    cash_after = {}
     cash = initial_capital
-    positions = []
-    portfolio_history = []
-
-    for current_date in all_dates:
-        # Close positions
-        closing_today = [pos for pos in positions if pos['sell_date'] == current_date]
-        for pos in closing_today:
-            try:
-                sell_price = price_data.at[current_date, pos['symbol']]
-                proceeds = sell_price * pos['shares']
-                cash += proceeds
-            except KeyError:
-                continue  # missing price
-
-        # Remove closed positions
-        positions = [pos for pos in positions if pos['sell_date'] > current_date]
-
-        # Open new positions
-        todays_buys = returns_df[returns_df['purchase_date'] == current_date]
-        if not todays_buys.empty:
-            if confidence_weighted:
-                total_conf = todays_buys['confidence'].sum()
-                weights = (
-                    todays_buys['confidence'] / total_conf if total_conf > 0
-                    else np.repeat(1 / len(todays_buys), len(todays_buys))
-                )
+    event_days = np.union1d(buy_idx[buy_idx >= 0], close_idx[realized])
+    for day in event_days:
+        closing = np.flatnonzero(realized & (close_idx == day))
+        if len(closing):
+            cash += np.sum(sell_price[closing] * shares[closing])
+
+        buying = np.flatnonzero(buy_idx == day)
+        if len(buying):
+            total_conf = confidence[buying].sum()
+            if confidence_weighted and total_conf > 0:
+                weights = confidence[buying] / total_conf
             else:
-                weights = np.repeat(1 / len(todays_buys), len(todays_buys))
-
-            for (_, row), weight in zip(todays_buys.iterrows(), weights):
-                allocation = cash * weight
-                try:
-                    buy_price = price_data.at[current_date, row['symbol']]
-                    shares = allocation / buy_price
-                    positions.append({
-                        'symbol': row['symbol'],
-                        'shares': shares,
-                        'buy_price': buy_price,
-                        'purchase_date': row['purchase_date'],
-                        'sell_date': row['sell_date']
-                    })
-                    cash -= allocation
-                except KeyError:
-                    continue  # missing buy price
-
-        # Compute total portfolio value
-        invested = 0
-        for pos in positions:
-            try:
-                try:
-                    price = price_data.at[current_date, pos['symbol']]
-                except KeyError:
-                    try:
-                        # fallback to last known price before this date
-                        price = price_data.loc[:current_date, pos['symbol']].dropna().iloc[-1]
-                    except:
-                        raise IndexError(f"Index out of range for {pos}")
-
-                invested += price * pos['shares']
-            except KeyError as e:
-                continue
-
-        portfolio_value = cash + invested
-        portfolio_history.append({
-            'date': current_date,
-            'portfolio_value': portfolio_value,
-            'cash': cash,
-            'invested': invested,
-            'num_positions': len(positions)
-        })
+                weights = np.repeat(1 / len(buying), len(buying))
+            # each allocation is a fraction of the cash left after the previous buy
+            weights = np.where(tradable[buying], weights, 0.0)
+            cash_before = cash * np.concatenate([[1.0], np.cumprod(1 - weights)[:-1]])
+            allocation = cash_before * weights
+            shares[buying] = np.where(tradable[buying], allocation / buy_price[buying], 0.0)
+            cash = cash_before[-1] - allocation[-1]
+
+        cash_after[day] = cash
+
+    cash_series = np.full(n_dates, np.nan)
+    cash_series[list(cash_after)] = list(cash_after.values())
+    cash_series = pd.Series(cash_series).ffill().fillna(initial_capital).to_numpy()
+
+    # holdings per symbol via difference arrays over the date axis, LEDGER_BLOCK symbols at a time so the
+    # (dates x symbols) matrices stay linear in the history however many symbols it ever holds
+    held = np.flatnonzero(tradable)
+    held_symbols, sym_idx = np.unique(symbols[held], return_inverse=True)
+    invested = np.zeros(n_dates)
+    num_positions = np.zeros(n_dates, dtype=np.int64)
+    for first in range(0, len(held_symbols), LEDGER_BLOCK):
+        width = min(LEDGER_BLOCK, len(held_symbols) - first)
+        in_block = (sym_idx >= first) & (sym_idx < first + width)
+        rows, cols = held[in_block], sym_idx[in_block] - first
+        share_delta = np.zeros((n_dates + 1, width))
+        count_delta = np.zeros((n_dates + 1, width), dtype=np.int64)
+        np.add.at(share_delta, (buy_idx[rows], cols), shares[rows])
+        np.add.at(share_delta, (np.minimum(close_idx[rows], n_dates), cols), -shares[rows])
+        np.add.at(count_delta, (buy_idx[rows], cols), 1)
+        np.add.at(count_delta, (np.minimum(close_idx[rows], n_dates), cols), -1)
+        held_shares = np.cumsum(share_delta, axis=0)[:-1]
+        held_counts = np.cumsum(count_delta, axis=0)[:-1]
+
+        marks = mark_prices(price_data, list(held_symbols[first:first + width]), all_dates)
+        invested += np.where(held_counts > 0, held_shares * marks, 0.0).sum(axis=1)
+        num_positions += held_counts.sum(axis=1)
+
+    ledger = pd.DataFrame({
+        'date': all_dates,
+        'portfolio_value': cash_series + invested,
+        'cash': cash_series,
+        'invested': invested,
+        'num_positions': num_positions
+    })
 
-    return pd.DataFrame(portfolio_history)
+    if n_dates and all_dates[-1] == end:
+        ledger = ledger.iloc[:-1]
+    return ledger
@@ -0,0 +1,244 @@
+"""
+Benchmark harness for the backtest pipeline.
+
+Times every stage (and the whole /api/backtest flow) on the bundled data and on synthetic data of
+any size, records wall time and peak traced memory per stage, writes the results as JSON and
+compares them with a stored baseline. Run from the backend directory:
+
+    python -m strategy.bench --synthetic 500x16 --synthetic 2000x16x1200 --save-baseline
+    python -m strategy.bench --synthetic 500x16 --synthetic 2000x16x1200   # exits 1 on a regression
+    python -m strategy.bench --no-bundled --large --synthetic 5000x80 --memory-budget 2048
+
+Synthetic sizes are SYMBOLSxQUARTERS[xDAYS]. Stages run without the training-data and KMeans caches.
+--large benchmarks the large-universe mode (float32 prices, features streamed quarter by quarter) and
+--memory-budget exits 1 if any stage's peak traced memory exceeds the given number of MB.
+"""
+import argparse
+import contextlib
+import gc
+import io
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+from types import SimpleNamespace
+import numpy as np
+import pandas as pd
+import sklearn
+from .backtest import compute_rankings, stream_rankings, replay_rankings, compute_quarterly_returns, build_transactions, simulate_portfolio_ledger
+from .clustering import train_kmeans
+from .jobs import run_backtest
+from .models import build_training_data
+from .store import PRICE_CSV, QUARTERLY_DIR, load_price_data, load_quarterlies
+from .synthetic import synthetic_data, synthetic_quarters
+from .utils import quarters_dict, getMetrics
+
+RESULTS_PATH = 'data/bench/latest.json'
+BASELINE_PATH = 'data/bench/baseline.json'
+
+BENCH_PARAMS = dict(k=10, initial_capital=100_000, random_state=102, model_strategy='RandomForest',
+                    sell_threshold=0.3, start_quarter=None, end_quarter=None)
+
+
+def measure(fn, memory=True):
+    """Run fn() for wall time, then (if memory) again under tracemalloc for its peak allocation."""
+    gc.collect()
+    with contextlib.redirect_stdout(io.StringIO()):
+        start = time.perf_counter()
+        out = fn()
+        seconds = time.perf_counter() - start
+
+        peak_mb = None
+        if memory:
+            gc.collect()
+            tracemalloc.start()
+            fn()
+            peak_mb = tracemalloc.get_traced_memory()[1] / 2**20
+            tracemalloc.stop()
+    return out, {'seconds': round(seconds, 4), 'peak_mb': None if peak_mb is None else round(peak_mb, 2)}
+
+
+def bench_pipeline(df_dict, price_data, spy, stages, memory=True, model='RandomForest', n_workers=1,
+                   quarters_dict=quarters_dict, large=False):
+    """
+    Time each stage of the pipeline on one dataset, feeding every stage the previous stage's output.
+    With `large` the features are streamed (stream_rankings) instead of built up front, and the
+    prices are float32, as in the large-universe mode.
+    """
+    quarters = list(quarters_dict.keys())
+    params = dict(BENCH_PARAMS, model_strategy=model)
+    if large:
+        price_data = price_data.astype(np.float32)
+
+    def stage(name, fn):
+        out, stats = measure(fn, memory)
+        stages[name] = stats
+        print(f"  {name:28s} {stats['seconds']:9.3f}s  {stats['peak_mb'] or 0:9.1f} MB", flush=True)
+        return out
+
+    stage('train_kmeans', lambda: train_kmeans(df_dict))
+    if large:
+        rankings = stage('train_model', lambda: stream_rankings(df_dict, price_data, quarters_dict, False,
+                                                                relative_performance=False, model=model))
+    else:
+        data_dict = stage('build_training_data', lambda: build_training_data(df_dict, price_data, relative_performance=False,
+                                                                             quarters_dict=quarters_dict))
+        rankings = stage('train_model', lambda: compute_rankings(data_dict, quarters, False, n_workers=n_workers, model=model))
+    stages['train_model']['per_quarter'] = round(stages['train_model']['seconds'] / max(len(rankings), 1), 4)
+    buys_df, sells_df = stage('replay_rankings', lambda: replay_rankings(rankings, price_data, quarters_dict, verbose=False))
+    stage('compute_quarterly_returns', lambda: compute_quarterly_returns(buys_df, sells_df, price_data, quarters_dict))
+    transactions = stage('build_transactions', lambda: build_transactions(buys_df, sells_df, price_data, quarters_dict))
+    ledger = stage('simulate_portfolio_ledger', lambda: simulate_portfolio_ledger(transactions, price_data))
+    stage('getMetrics', lambda: getMetrics(ledger, spy))
+
+    context = SimpleNamespace(df_dict=df_dict, price_data=price_data, spy_baseline=spy, quarters_dict=quarters_dict)
+    stage('backtest', lambda: run_backtest(params, n_workers=n_workers, context=context, use_cache=False,
+                                           large_universe=large))
+    return stages
+
+
+def bench_bundled(memory=True, model='RandomForest', n_workers=1, large=False):
+    if not os.path.exists(PRICE_CSV) or not os.path.isdir(QUARTERLY_DIR):
+        print(f"Skipping bundled data: {PRICE_CSV} or {QUARTERLY_DIR} not found")
+        return None
+    print("bundled")
+    stages = {}
+    df_dict, stages['load_df_dict'] = measure(lambda: load_quarterlies(QUARTERLY_DIR), memory)
+    price_data, stages['load_price_data'] = measure(lambda: load_price_data(PRICE_CSV), memory)
+    spy = pd.read_csv('data/seed/spy_data.csv')
+    for name in ('load_df_dict', 'load_price_data'):
+        print(f"  {name:28s} {stages[name]['seconds']:9.3f}s  {stages[name]['peak_mb'] or 0:9.1f} MB")
+    bench_pipeline(df_dict, price_data, spy, stages, memory, model, n_workers, large=large)
+    return {'shape': shape(df_dict, price_data), 'stages': stages}
+
+
+def bench_synthetic(n_symbols, n_quarters, n_days=None, memory=True, model='RandomForest', n_workers=1, seed=0, large=False):
+    print(f"synthetic {n_symbols}x{n_quarters}x{n_days or 'auto'}")
+    stages = {}
+    dtype = np.float32 if large else np.float64
+    (df_dict, price_data, spy), stages['generate'] = measure(
+        lambda: synthetic_data(n_symbols, n_quarters, n_days, seed=seed, dtype=dtype), memory=False)
+    bench_pipeline(df_dict, price_data, spy, stages, memory, model, n_workers,
+                   quarters_dict=synthetic_quarters(n_quarters), large=large)
+    return {'shape': shape(df_dict, price_data), 'stages': stages}
+
+
+def shape(df_dict, price_data):
+    return {'symbols': int(price_data.shape[1]), 'quarters': len(df_dict), 'days': int(price_data.shape[0]),
+            'rows': int(sum(len(df) for df in df_dict.values()))}
+
+
+def parse_size(spec):
+    parts = [int(p) for p in spec.lower().split('x')]
+    if len(parts) not in (2, 3):
+        raise argparse.ArgumentTypeError(f"expected SYMBOLSxQUARTERS[xDAYS], got '{spec}'")
+    return tuple(parts) + (None,) * (3 - len(parts))
+
+
+def compare(results, baseline, tolerance=0.25, min_seconds=0.05, min_mb=1.0):
+    """
+    Regressions of `results` against `baseline`: stages whose wall time or peak memory grew by more
+    than `tolerance` (and by more than min_seconds / min_mb, so tiny stages don't flap).
+    """
+    regressions = []
+    for dataset, run in results['datasets'].items():
+        base = baseline.get('datasets', {}).get(dataset)
+        if base is None:
+            continue
+        for name, stats in run['stages'].items():
+            base_stats = base['stages'].get(name)
+            if base_stats is None:
+                continue
+            for metric, floor in (('seconds', min_seconds), ('peak_mb', min_mb)):
+                new, old = stats.get(metric), base_stats.get(metric)
+                if new is None or old is None:
+                    continue
+                if new > old * (1 + tolerance) and new - old > floor:
+                    regressions.append({'dataset': dataset, 'stage': name, 'metric': metric,
+                                        'baseline': old, 'current': new, 'ratio': round(new / old, 2) if old else None})
+    return regressions
+
+
+def over_budget(results, budget_mb):
+    """(dataset, stage, peak_mb) of every stage whose peak traced memory exceeds budget_mb."""
+    return [(dataset, name, stats['peak_mb'])
+            for dataset, run in results['datasets'].items()
+            for name, stats in run['stages'].items()
+            if stats.get('peak_mb') is not None and stats['peak_mb'] > budget_mb]
+
+
+def write_json(obj, path):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as f:
+        json.dump(obj, f, indent=2)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the backtest pipeline stages.")
+    parser.add_argument('--synthetic', action='append', type=parse_size, default=[],
+                        help="synthetic dataset SYMBOLSxQUARTERS[xDAYS]; repeat for a scaling series")
+    parser.add_argument('--no-bundled', action='store_true', help="skip the bundled data")
+    parser.add_argument('--no-memory', action='store_true', help="skip the tracemalloc pass (halves the run time)")
+    parser.add_argument('--model', default='RandomForest')
+    parser.add_argument('--n-workers', type=int, default=1)
+    parser.add_argument('--out', default=RESULTS_PATH)
+    parser.add_argument('--baseline', default=BASELINE_PATH)
+    parser.add_argument('--save-baseline', action='store_true', help="also write the results as the new baseline")
+    parser.add_argument('--tolerance', type=float, default=0.25)
+    parser.add_argument('--large', action='store_true', help="benchmark the large-universe mode")
+    parser.add_argument('--memory-budget', type=float, metavar='MB',
+                        help="exit 1 if any stage's peak traced memory exceeds MB")
+    args = parser.parse_args(argv)
+
+    memory = not args.no_memory
+    datasets = {}
+    if not args.no_bundled:
+        run = bench_bundled(memory, args.model, args.n_workers, args.large)
+        if run is not None:
+            datasets['bundled'] = run
+    for n_symbols, n_quarters, n_days in args.synthetic:
+        name = f"synthetic_{n_symbols}x{n_quarters}x{n_days or 'auto'}" + ('_large' if args.large else '')
+        datasets[name] = bench_synthetic(n_symbols, n_quarters, n_days, memory, args.model, args.n_workers,
+                                         large=args.large)
+
+    results = {
+        'meta': {
+            'timestamp': pd.Timestamp.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(), 'numpy': np.__version__, 'pandas': pd.__version__,
+            'sklearn': sklearn.__version__, 'cpu_count': os.cpu_count(), 'model': args.model,
+            'n_workers': args.n_workers, 'large': args.large,
+        },
+        'datasets': datasets,
+    }
+    write_json(results, args.out)
+    print(f"Results written to {args.out}")
+
+    failed = False
+    if args.memory_budget is not None:
+        for dataset, name, peak_mb in over_budget(results, args.memory_budget):
+            print(f"OVER BUDGET {dataset}/{name}: {peak_mb} MB > {args.memory_budget} MB")
+            failed = True
+        if not failed:
+            print(f"Every stage within the {args.memory_budget} MB memory budget")
+
+    if args.save_baseline:
+        write_json(results, args.baseline)
+        print(f"Baseline written to {args.baseline}")
+        return 1 if failed else 0
+    if not os.path.exists(args.baseline):
+        print(f"No baseline at {args.baseline}; rerun with --save-baseline to create one")
+        return 1 if failed else 0
+
+    with open(args.baseline) as f:
+        regressions = compare(results, json.load(f), args.tolerance)
+    for r in regressions:
+        print(f"REGRESSION {r['dataset']}/{r['stage']} {r['metric']}: {r['baseline']} -> {r['current']} (x{r['ratio']})")
+    if not regressions:
+        print(f"No regressions against {args.baseline} (tolerance {args.tolerance:.0%})")
+    return 1 if regressions or failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
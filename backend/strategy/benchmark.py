@@ -0,0 +1,167 @@
+"""
+Benchmark comparison against a portfolio ledger.
+
+A benchmark is a date-indexed price series: a price_data column, or the SPY closes in spy_data.csv.
+It is aligned to the ledger's dates once, to the last price on or before each date, and every
+comparison (daily and per-quarter relative returns, tracking error, information ratio, beta,
+drawdowns) is then a handful of array operations over all requested benchmarks at once.
+"""
+from collections import OrderedDict
+import threading
+import numpy as np
+import pandas as pd
+
+PERIODS_PER_YEAR = 252
+# the per-benchmark statistics compare() returns
+COMPARISON = ('benchmark_return', 'relative_return', 'tracking_error', 'information_ratio', 'beta',
+              'benchmark_max_drawdown', 'relative_max_drawdown')
+
+
+def benchmark_series(spy):
+    """Close prices of a spy_data.csv-style frame (Date, Close) as a sorted, date-indexed Series."""
+    if isinstance(spy, pd.Series):
+        return spy
+    series = pd.Series(spy['Close'].to_numpy(dtype=np.float64), index=pd.to_datetime(spy['Date']), name='SPY')
+    return series[series.notna()].sort_index()
+
+
+def align(series, dates):
+    """
+    Price of `series` as of each of `dates`: its last price on or before the date. Dates before its
+    first price take the first price, so the benchmark is flat until it starts.
+    """
+    series = series[series.notna()]
+    pos = series.index.searchsorted(pd.DatetimeIndex(dates), side='right') - 1
+    return series.to_numpy(dtype=np.float64)[np.clip(pos, 0, None)] if len(series) else np.full(len(dates), np.nan)
+
+
+def drawdown(values):
+    """Drawdown from the running peak, along the first axis."""
+    return values / np.maximum.accumulate(values, axis=0) - 1
+
+
+def daily_returns(values):
+    return values[1:] / values[:-1] - 1
+
+
+def compare(portfolio, benchmarks, periods_per_year=PERIODS_PER_YEAR):
+    """
+    Comparison of a portfolio value path (n,) with aligned benchmark paths (n, m), one entry per
+    benchmark: total and relative return, annualized tracking error, information ratio, beta and
+    the benchmark's and the relative (portfolio / benchmark) maximum drawdown.
+    """
+    portfolio = np.asarray(portfolio, dtype=np.float64)
+    benchmarks = np.asarray(benchmarks, dtype=np.float64).reshape(len(portfolio), -1)
+    r = daily_returns(portfolio)
+    R = daily_returns(benchmarks)
+    active = r[:, None] - R
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        tracking = active.std(axis=0, ddof=1) * np.sqrt(periods_per_year)
+        information = active.mean(axis=0) * periods_per_year / tracking
+        covariance = ((r - r.mean())[:, None] * (R - R.mean(axis=0))).sum(axis=0) / (len(r) - 1)
+        beta = covariance / R.var(axis=0, ddof=1)
+        benchmark_return = benchmarks[-1] / benchmarks[0] - 1
+        portfolio_return = portfolio[-1] / portfolio[0] - 1
+        return {
+            'benchmark_return': benchmark_return,
+            'relative_return': portfolio_return - benchmark_return,
+            'tracking_error': tracking,
+            'information_ratio': information,
+            'beta': beta,
+            'benchmark_max_drawdown': drawdown(benchmarks).min(axis=0),
+            'relative_max_drawdown': drawdown(portfolio[:, None] / benchmarks).min(axis=0),
+        }
+
+
+def quarter_periods(dates, quarters_dict):
+    """(quarter, first row, last row) of the ledger rows from each quarter's date up to the next one's."""
+    dates = pd.DatetimeIndex(dates)
+    starts = np.minimum(dates.searchsorted(pd.to_datetime(list(quarters_dict.values())), side='left'), len(dates) - 1)
+    ends = np.append(starts[1:], len(dates) - 1)
+    return [(q, start, end) for q, start, end in zip(quarters_dict, starts, ends) if start < end]
+
+
+class BenchmarkEngine:
+    """
+    Benchmarks for ledgers over one price panel: every price_data column, plus 'SPY' from the
+    spy_data.csv frame when given (which takes precedence over a price_data column of that name).
+    Aligned paths are cached per (benchmark, date range), so comparing many ledgers over the same
+    dates - a sweep, an ensemble, repeated requests - aligns each benchmark once.
+    """
+
+    def __init__(self, price_data, spy=None, cache_size=64):
+        self.price_data = price_data
+        self.series = {'SPY': benchmark_series(spy)} if spy is not None else {}
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    def available(self, name):
+        return name in self.series or name in self.price_data.columns
+
+    def _series(self, name):
+        if name not in self.series:
+            if name not in self.price_data.columns:
+                raise KeyError(f"Unknown benchmark '{name}'")
+            self.series[name] = self.price_data[name].astype(np.float64)
+        return self.series[name]
+
+    def aligned(self, name, dates):
+        """`name` aligned to `dates`, plus its daily returns and drawdown; cached by the date range."""
+        dates = pd.DatetimeIndex(dates)
+        key = (name, dates[0], dates[-1], len(dates)) if len(dates) else (name, None, None, 0)
+        with self._lock:
+            hit = self._cache.get(key)
+            if hit is not None:
+                self._cache.move_to_end(key)
+                return hit
+        values = align(self._series(name), dates)
+        hit = {'values': values, 'returns': daily_returns(values), 'drawdown': drawdown(values)}
+        with self._lock:
+            self._cache[key] = hit
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return hit
+
+    def values(self, names, dates):
+        """(n dates, n benchmarks) aligned prices."""
+        return np.column_stack([self.aligned(name, dates)['values'] for name in names])
+
+    def compare(self, ledger, names=('SPY',)):
+        """One row per benchmark: compare() of the ledger's portfolio value against each (NaN without two ledger dates)."""
+        names = list(names)
+        if len(ledger) < 2:
+            return pd.DataFrame({'benchmark': names, **dict.fromkeys(COMPARISON, np.nan)})
+        stats = compare(ledger['portfolio_value'].to_numpy(), self.values(names, ledger['date']))
+        return pd.DataFrame({'benchmark': names, **stats})
+
+    def daily_relative(self, ledger, names=('SPY',)):
+        """Per-day portfolio return minus each benchmark's return, one column per benchmark."""
+        dates = pd.DatetimeIndex(ledger['date'])
+        r = daily_returns(ledger['portfolio_value'].to_numpy(dtype=np.float64))
+        relative = r[:, None] - np.column_stack([self.aligned(name, dates)['returns'] for name in names])
+        return pd.DataFrame(relative, index=dates[1:], columns=list(names))
+
+    def quarterly_relative(self, ledger, quarters_dict, names=('SPY',)):
+        """Portfolio and benchmark returns between consecutive quarter dates, one row per (quarter, benchmark)."""
+        names = list(names)
+        periods = quarter_periods(ledger['date'], quarters_dict)
+        if not periods:
+            return pd.DataFrame(columns=['quarter', 'benchmark', 'portfolio_return', 'benchmark_return', 'relative_return'])
+        portfolio = ledger['portfolio_value'].to_numpy(dtype=np.float64)
+        benchmarks = self.values(names, ledger['date'])
+        quarters, first, last = (np.array(column) for column in zip(*periods))
+        port = portfolio[last] / portfolio[first] - 1
+        bench = benchmarks[last] / benchmarks[first] - 1
+        return pd.DataFrame({
+            'quarter': np.repeat(quarters, len(names)),
+            'benchmark': np.tile(names, len(quarters)),
+            'portfolio_return': np.repeat(port, len(names)),
+            'benchmark_return': bench.ravel(),
+            'relative_return': (port[:, None] - bench).ravel(),
+        })
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
@@ -0,0 +1,252 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+import joblib
+from .encoding import EncodedPayload
+from .models import build_quarters
+from .utils import quarters_dict
+
+logger = logging.getLogger(__name__)
+
+DATA_PATHS = ('data/quarterly/', 'data/price_data.csv')
+
+
+def data_fingerprint(paths=DATA_PATHS):
+    """
+    Cheap fingerprint of the data files: hash of (path, size, mtime) of every CSV under `paths`, stable
+    across processes. File metadata, not content: rewriting a file changes it even if nothing else does.
+    """
+    entries = []
+    for path in paths:
+        if os.path.isdir(path):
+            files = sorted(os.path.join(path, f) for f in os.listdir(path) if f.endswith('.csv'))
+        else:
+            files = [path]
+        for fname in files:
+            try:
+                stat = os.stat(fname)
+            except OSError:
+                continue  # missing file --> not part of the fingerprint
+            entries.append((fname, stat.st_size, stat.st_mtime_ns))
+    return hashlib.sha1(repr(entries).encode()).hexdigest()
+
+
+def last_modified(paths=DATA_PATHS):
+    """Latest mtime (epoch seconds) of the CSVs under `paths`, or None if none exist."""
+    mtimes = []
+    for path in paths:
+        if os.path.isdir(path):
+            files = [os.path.join(path, f) for f in os.listdir(path) if f.endswith('.csv')]
+        else:
+            files = [path]
+        mtimes.extend(os.stat(f).st_mtime for f in files if os.path.exists(f))
+    return max(mtimes) if mtimes else None
+
+
+class LRUCache:
+    """Small thread-safe LRU mapping used for process-wide caches."""
+
+    def __init__(self, maxsize=4):
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            if key not in self._data:
+                return None
+            self._data.move_to_end(key)
+            return self._data[key]
+
+    def put(self, key, value):
+        with self._lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+training_data_cache = LRUCache(maxsize=4)
+
+
+def get_training_data(df_dict, price_data, n_clusters=15, seed=42, relative_performance=True, fingerprint=None,
+                      warm_start=False, minibatch=False, model_dir=None, quarters_dict=quarters_dict):
+    """
+    Cached build_training_data(). The result only depends on the clustering parameters and the
+    data, so it is shared across backtests that differ in k / sell_threshold / capital.
+    Quarters are cached individually: a windowed backtest reuses every quarter an earlier run built
+    and only builds the ones it is missing. The returned dict must not be mutated.
+    `fingerprint` identifies the data the frames come from (e.g. their DataContext's). Without it, frames
+    of data_context (or windows of them) use the fingerprint taken when it loaded them, and reloading
+    drops every cached entry; any other frames are built without caching, as nothing identifies them.
+    """
+    if fingerprint is None:
+        from .context import data_context  # context imports this module
+        if data_context.owns(df_dict):
+            fingerprint = data_context.fingerprint
+    # a warm-started quarter also depends on where the chain of warm starts began
+    chain_start = min(df_dict) if warm_start else None
+    key = (n_clusters, seed, relative_performance, fingerprint, warm_start, minibatch, chain_start,
+           tuple(quarters_dict.items())) if fingerprint is not None else None
+
+    quarters = sorted(df_dict.keys())[:-2]
+    built = (training_data_cache.get(key) if key is not None else None) or {}
+    missing = [q for q in quarters if q not in built]
+    if missing:
+        built = {**built, **build_quarters(df_dict, price_data, missing, n_clusters=n_clusters, seed=seed,
+                                           relative_performance=relative_performance, warm_start=warm_start,
+                                           minibatch=minibatch, model_dir=model_dir, quarters_dict=quarters_dict)}
+        if key is not None:
+            training_data_cache.put(key, built)
+
+    # quarters that could not be built are cached as None, so they are not retried
+    data_dict = {q: built[q] for q in quarters if built[q] is not None}
+    if not data_dict:
+        raise ValueError("No data generated. Check cluster mapping or construct_params.")
+    return data_dict
+
+
+def invalidate_training_data():
+    """Drop every cached data_dict; DataContext.reload() calls it once the data files were rewritten."""
+    training_data_cache.clear()
+
+
+# bump when a code change alters backtest results, so cached results from older code are not served
+RESULT_VERSION = 4
+RESULT_CACHE_DIR = os.environ.get('RESULT_CACHE_DIR', 'data/cache/results/')
+
+
+def result_key(params, fingerprint=None):
+    """
+    Stable hash of normalized backtest parameters, the data version and RESULT_VERSION. `fingerprint`
+    should be that of the data the result is computed from (DataContext.refresh()).
+    """
+    if fingerprint is None:
+        fingerprint = data_fingerprint()
+    normalized = {name: float(value) if isinstance(value, (int, float)) and not isinstance(value, bool) else value
+                  for name, value in params.items()}
+    blob = json.dumps({'params': normalized, 'data': fingerprint, 'version': RESULT_VERSION}, sort_keys=True, default=str)
+    return hashlib.sha1(blob.encode()).hexdigest()
+
+
+class ResultCache:
+    """
+    Two-tier cache of finished backtest results, keyed by result_key().
+      - memory: EncodedPayloads (frames plus every encoded body), LRU-evicted above memory_bytes. An entry's
+                size is measured once when it is added and grows by each body encoded afterwards.
+      - disk:   one joblib file per result under `path`, oldest-used evicted above disk_bytes (0 disables)
+    A disk hit is promoted to memory. Results are immutable, so entries never need invalidating:
+    new data or code simply produce new keys.
+    """
+
+    def __init__(self, memory_bytes=256 * 2**20, disk_bytes=1024 * 2**20, path=RESULT_CACHE_DIR):
+        self.memory_bytes = memory_bytes
+        self.disk_bytes = disk_bytes
+        self.path = path
+        self._entries = OrderedDict()
+        self._sizes = {}
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def _file(self, key):
+        return os.path.join(self.path, f'{key}.joblib')
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+                return entry
+
+        if not self.disk_bytes:
+            return None
+        fname = self._file(key)
+        try:
+            stored = joblib.load(fname)
+            os.utime(fname)  # mark as recently used for disk eviction
+        except Exception:
+            return None
+        entry = self._entry(key, stored['result'], stored['created'])
+        self._remember(key, entry)
+        return entry
+
+    def put(self, key, result):
+        created = time.time()
+        entry = self._entry(key, result, created)
+        self._remember(key, entry)
+        if self.disk_bytes:
+            try:
+                os.makedirs(self.path, exist_ok=True)
+                tmp = f'{self._file(key)}.{os.getpid()}.tmp'
+                joblib.dump({'result': result, 'created': created}, tmp)
+                os.replace(tmp, self._file(key))
+                self._evict_disk()
+            except OSError as e:
+                logger.warning("Could not write result cache entry %s: %s", key, e)
+        return entry
+
+    def _entry(self, key, result, created):
+        entry = EncodedPayload(lambda: result, version=key, last_modified=created)
+        entry.value = result  # loaded already; needed for nbytes()
+        return entry
+
+    def _remember(self, key, entry):
+        size = entry.nbytes()
+        with self._lock:
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = entry
+            self._sizes[key] = size
+            self._bytes += size
+            entry.on_grow = lambda added: self._grew(key, entry, added)
+            self._evict_memory()
+
+    def _grew(self, key, entry, added):
+        with self._lock:
+            if self._entries.get(key) is entry:
+                self._sizes[key] += added
+                self._bytes += added
+                self._evict_memory()
+
+    def _drop(self, key):
+        self._entries.pop(key).on_grow = None
+        self._bytes -= self._sizes.pop(key)
+
+    def _evict_memory(self):
+        while self._bytes > self.memory_bytes and len(self._entries) > 1:
+            self._drop(next(iter(self._entries)))
+
+    def _evict_disk(self):
+        files = []
+        for name in os.listdir(self.path):
+            if name.endswith('.joblib'):
+                stat = os.stat(os.path.join(self.path, name))
+                files.append((stat.st_mtime, stat.st_size, name))
+        total = sum(size for _, size, _ in files)
+        for _, size, name in sorted(files):
+            if total <= self.disk_bytes:
+                break
+            os.remove(os.path.join(self.path, name))
+            total -= size
+
+    def clear(self):
+        with self._lock:
+            for key in list(self._entries):
+                self._drop(key)
+
+
+result_cache = ResultCache(
+    memory_bytes=int(float(os.environ.get('RESULT_CACHE_MEMORY_MB', 256)) * 2**20),
+    disk_bytes=int(float(os.environ.get('RESULT_CACHE_DISK_MB', 1024)) * 2**20),
+)
@@ -1,39 +1,131 @@
+import hashlib
+import os
+import joblib
 import pandas as pd
 import numpy as np
-from sklearn.cluster import KMeans
+from sklearn.cluster import KMeans, MiniBatchKMeans
 from datetime import timedelta
-from strategy.utils import quarters_dict, next_quarter, returns, get_data
+from strategy.utils import quarters_dict, next_quarter, returns, get_data, build_quarter_index
+from .timing import timed
 
 
-def train_kmeans(df_dict, n_clusters=15, seed=42, feature_start_idx=3):
+KMEANS_DIR = 'data/models/kmeans/'
+
+
+def make_kmeans(n_clusters, seed, init=None, minibatch=False):
+    # an explicit init (previous quarter's centroids) only needs a single run
+    n_init = 10 if init is None else 1
+    init = 'k-means++' if init is None else init
+    if minibatch:
+        return MiniBatchKMeans(n_clusters=n_clusters, random_state=seed, n_init=n_init, init=init, batch_size=1024)
+    return KMeans(n_clusters=n_clusters, random_state=seed, n_init=n_init, init=init)
+
+
+def kmeans_path(model_dir, quarter, X, n_clusters, seed, init=None, minibatch=False):
+    """Cache file for one quarter's model, keyed by quarter, n_clusters, seed and a hash of the inputs."""
+    digest = hashlib.sha1()
+    digest.update(','.join(map(str, X.columns)).encode())
+    digest.update(np.ascontiguousarray(X.to_numpy(dtype=np.float64)).tobytes())
+    if init is not None:
+        digest.update(np.ascontiguousarray(init).tobytes())
+    kind = 'minibatch' if minibatch else 'kmeans'
+    return os.path.join(model_dir, f'{quarter}_k{n_clusters}_s{seed}_{kind}_{digest.hexdigest()[:16]}.joblib')
+
+
+def load_kmeans(path):
+    try:
+        return joblib.load(path)
+    except Exception:
+        return None  # missing, truncated or from an incompatible sklearn --> refit
+
+
+def save_kmeans(model, path):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f'{path}.{os.getpid()}.tmp'
+    joblib.dump(model, tmp)
+    os.replace(tmp, path)
+
+
+@timed('clustering')
+def train_kmeans(df_dict, n_clusters=15, seed=42, feature_start_idx=3, warm_start=False, minibatch=False, model_dir=None):
+    """
+    Fit one clustering model per quarter.
+    warm_start: initialize each quarter from the previous quarter's centroids (fewer iterations,
+    cluster IDs stay stable from quarter to quarter).
+    minibatch: use MiniBatchKMeans, for large universes.
+    model_dir: persist fitted models (with their labels_) there and reload them on the next call.
+    """
     models = {}
-    for quarter, df in df_dict.items():
-        X = df.iloc[:, feature_start_idx:]
-        model = KMeans(n_clusters=n_clusters, random_state=seed, n_init=10)
-        model.fit(X)
+    prev_model = None
+    quarters = sorted(df_dict) if warm_start else list(df_dict)
+    for quarter in quarters:
+        X = df_dict[quarter].iloc[:, feature_start_idx:]
+
+        init = None
+        if warm_start and prev_model is not None and list(prev_model.feature_names_in_) == list(X.columns):
+            init = prev_model.cluster_centers_
+
+        model = None
+        if model_dir:
+            path = kmeans_path(model_dir, quarter, X, n_clusters, seed, init, minibatch)
+            model = load_kmeans(path)
+        if model is None:
+            model = make_kmeans(n_clusters, seed, init, minibatch)
+            model.fit(X)
+            if model_dir:
+                save_kmeans(model, path)
+
         models[quarter] = model
+        prev_model = model
     return models
 
 
-def get_cluster_mapping(df_dict, model, quarter, stock_list):
+def get_cluster_mapping(df_dict, model, quarter, stock_list, index=None, feature_start_idx=3):
+    """Group stock_list by cluster label, using one batched predict over the whole quarter."""
+    df = df_dict.get(quarter)
+    if df is None:
+        return {}
+    if index is None:
+        index = build_quarter_index(df, feature_start_idx)
+
+    labels = model.predict(df.iloc[:, feature_start_idx:])
     cluster_stock_mapping = {}
     for stock in stock_list:
-        data = get_data(stock, quarter, df_dict)
-        if data is not None:
-            cluster = model.predict(data)[0]
-            cluster_stock_mapping.setdefault(cluster, []).append(stock)
+        row = index.rows.get(stock)
+        if row is not None:
+            cluster_stock_mapping.setdefault(labels[row], []).append(stock)
     return cluster_stock_mapping
 
 
-def construct_data(cluster, quarter, df_dict):
-    cluster_data = {symbol: get_data(symbol, quarter, df_dict) for symbol in cluster}
-    cluster_df = pd.concat(cluster_data, axis=0).reset_index(level=0).rename(columns={'level_0': 'symbol'})
+def construct_data(cluster, quarter, df_dict, index=None):
+    if index is None:
+        cluster_data = {symbol: get_data(symbol, quarter, df_dict) for symbol in cluster}
+        cluster_df = pd.concat(cluster_data, axis=0).reset_index(level=0).rename(columns={'level_0': 'symbol'})
+        return cluster_df
+
+    # fancy-index the quarter's feature matrix instead of scanning the frame per symbol
+    symbols = [symbol for symbol in cluster if symbol in index.rows]
+    rows = [index.rows[symbol] for symbol in symbols]
+    cluster_df = pd.DataFrame(index.features[rows], columns=index.columns)
+    cluster_df.insert(0, 'symbol', symbols)
     return cluster_df
 
 
+def mean_rows(values):
+    """
+    Column means of a (rows x features) matrix, skipping NaNs like DataFrame.mean(). Rows are added one
+    at a time, in order, as DataFrame.mean() did over the concatenated per-symbol rows construct_data
+    originally built, so the result does not depend on how a frame happens to lay out its values.
+    """
+    values = np.ascontiguousarray(values, dtype=np.float64)
+    valid = ~np.isnan(values)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(valid, values, 0.0).sum(axis=0) / valid.sum(axis=0)
+
+
 def centroid(cluster_data):
     cols = cluster_data.columns[1:]
-    values = cluster_data[cols].mean()
+    values = mean_rows(cluster_data[cols].to_numpy(dtype=np.float64))
     centroid_df = pd.DataFrame([values], columns=cols)
     centroid_df.insert(0, 'symbol', 'centroid')
     return centroid_df
@@ -47,30 +139,29 @@ def centroid_distance(cluster_data):
     all_data[cols] = delta
     return all_data
 
-def calculate_relative_performance(price_data, cluster, train_quarter, days=1):
+def calculate_relative_performance(price_data, cluster, train_quarter, days=1, returns_table=None, quarters_dict=quarters_dict):
     start_date = pd.to_datetime(quarters_dict[train_quarter])
     end_date = start_date + timedelta(days=90)
     
     valid_stocks = [stock for stock in cluster if stock in price_data.columns]
     if not valid_stocks:
         return None
-    cluster_prices = price_data[valid_stocks].loc[start_date:end_date]
-
-    rets_df = returns(cluster_prices, days=days) # days = window for average price calculation
-
-    results = []
-    for symbol in cluster:
-        stock_ret = rets_df[rets_df['symbol'] == symbol]['returns'].values
-        if len(stock_ret) == 0: # skip missing stocks
-            continue
-        stock_ret = stock_ret[0] # flatten relative performance for x3 and target 
-        cluster_avg = rets_df[rets_df['symbol'] != symbol]['returns'].mean()
-        rel_perf = stock_ret - cluster_avg
-        results.append({'symbol': symbol, 'relative_performance': rel_perf})
+    if returns_table is not None:
+        rets_df = returns_table.returns(valid_stocks, start_date, end_date, days=days)
+    else:
+        cluster_prices = price_data[valid_stocks].loc[start_date:end_date]
+        rets_df = returns(cluster_prices, days=days) # days = window for average price calculation
 
-    return pd.DataFrame(results)
+    # everyone else's mean return from the cluster total, instead of re-averaging the cluster once per symbol
+    rets = rets_df['returns'].to_numpy(dtype=np.float64)
+    valid = ~np.isnan(rets)
+    total, count = rets[valid].sum(), valid.sum()
+    with np.errstate(invalid='ignore', divide='ignore'):
+        others_avg = np.where(valid, (total - rets) / (count - 1), total / count)
+    return pd.DataFrame({'symbol': rets_df['symbol'], 'relative_performance': rets - others_avg})
 
-def calculate_outright_performance(price_data, cluster, train_quarter, quarters_ahead=2, days=7):
+def performance_window(train_quarter, quarters_ahead=2, quarters_dict=quarters_dict):
+    """Price window used for a quarter's performance: its start through `quarters_ahead` quarters later."""
     start_date = pd.to_datetime(quarters_dict[train_quarter])
 
     current_q = train_quarter
@@ -81,28 +172,36 @@ def calculate_outright_performance(price_data, cluster, train_quarter, quarters_
         current_q = next_q
 
     end_date = pd.to_datetime(quarters_dict[current_q]) + timedelta(days=90)
+    return start_date, end_date
+
+def calculate_outright_performance(price_data, cluster, train_quarter, quarters_ahead=2, days=7, returns_table=None,
+                                   quarters_dict=quarters_dict):
+    start_date, end_date = performance_window(train_quarter, quarters_ahead, quarters_dict)
 
     valid_stocks = [stock for stock in cluster if stock in price_data.columns]
     if not valid_stocks:
         return None
 
-    price_window = price_data[valid_stocks].loc[start_date:end_date]
-
-    rets_df = returns(price_window, days=days)
+    if returns_table is not None:
+        rets_df = returns_table.returns(valid_stocks, start_date, end_date, days=days)
+    else:
+        price_window = price_data[valid_stocks].loc[start_date:end_date]
+        rets_df = returns(price_window, days=days)
 
     return rets_df.rename(columns={'returns': 'outright_performance'})
 
-def construct_params(price_data, cluster, quarter, df_dict, relative_performance=True):
+def construct_params(price_data, cluster, quarter, df_dict, relative_performance=True, index_dict=None, returns_table=None):
     q1 = next_quarter(quarter)
     q2 = next_quarter(q1)
+    index_dict = index_dict or {}
 
     # gather base features
-    cluster_data_base = construct_data(cluster, quarter, df_dict)
+    cluster_data_base = construct_data(cluster, quarter, df_dict, index_dict.get(quarter))
     base_features = cluster_data_base.copy()
 
     # centroid distances
     d0 = centroid_distance(cluster_data_base)
-    d1 = centroid_distance(construct_data(cluster, q1, df_dict))
+    d1 = centroid_distance(construct_data(cluster, q1, df_dict, index_dict.get(q1)))
 
     d0 = d0[d0['symbol'] != 'centroid'].reset_index(drop=True)
     d1 = d1[d1['symbol'] != 'centroid'].reset_index(drop=True)
@@ -114,8 +213,8 @@ def construct_params(price_data, cluster, quarter, df_dict, relative_performance
     delta.insert(0, 'symbol', d0['symbol'].values)
 
     if relative_performance:
-        rel_perf_q1 = calculate_outright_performance(price_data, cluster, q1)
-        rel_perf_q2 = calculate_outright_performance(price_data, cluster, q2)
+        rel_perf_q1 = calculate_outright_performance(price_data, cluster, q1, returns_table=returns_table)
+        rel_perf_q2 = calculate_outright_performance(price_data, cluster, q2, returns_table=returns_table)
         rel_perf_q2.columns = ['symbol', 'target']
 
         # --- Final merge ---
@@ -125,8 +224,8 @@ def construct_params(price_data, cluster, quarter, df_dict, relative_performance
                         .merge(rel_perf_q2, on='symbol')
         
     else:
-        out_perf_q1 = calculate_outright_performance(price_data, cluster, q1)
-        out_perf_q2 = calculate_outright_performance(price_data, cluster, q2)
+        out_perf_q1 = calculate_outright_performance(price_data, cluster, q1, returns_table=returns_table)
+        out_perf_q2 = calculate_outright_performance(price_data, cluster, q2, returns_table=returns_table)
         out_perf_q2.columns = ['symbol', 'target']
 
         # --- Final merge ---
@@ -137,4 +236,84 @@ def construct_params(price_data, cluster, quarter, df_dict, relative_performance
          
 
 
-    return df
\ No newline at end of file
+    return df
+
+def cluster_centroids(features, cluster, n_clusters):
+    """
+    Per-cluster mean of the feature rows, with rows grouped by ascending cluster id. Each cluster's
+    rows go through mean_rows(), as in centroid(), so the centroids match construct_params() bit for bit.
+    """
+    centroids = np.full((n_clusters, features.shape[1]), np.nan)
+    bounds = np.searchsorted(cluster, np.arange(n_clusters + 1))
+    for c in range(n_clusters):
+        first, last = bounds[c], bounds[c + 1]
+        if last > first:
+            centroids[c] = mean_rows(features[first:last])
+    return centroids
+
+
+def construct_quarter_params(price_data, quarter, labels, index_dict, returns_table, relative_performance=True,
+                             quarters_dict=quarters_dict):
+    """
+    construct_params() for every cluster of a quarter at once. `labels` holds the cluster of each row
+    of index_dict[quarter]. Rows come out cluster by cluster (clusters in order of their first symbol,
+    symbols sorted within a cluster), exactly like concatenating construct_params() over get_cluster_mapping().
+    """
+    q1 = next_quarter(quarter)
+    q2 = next_quarter(q1)
+    index = index_dict[quarter]
+    index_q1 = index_dict.get(q1)
+
+    # final row order: clusters by first appearance in symbol order, symbols sorted within each
+    by_symbol = np.argsort(index.symbols.astype(str), kind='stable')
+    uniq, first_pos, inverse = np.unique(labels[by_symbol], return_index=True, return_inverse=True)
+    rank = np.empty(len(uniq), dtype=np.int64)
+    rank[np.argsort(first_pos, kind='stable')] = np.arange(len(uniq))
+    cluster = rank[inverse]
+    order = np.argsort(cluster, kind='stable')
+    rows = by_symbol[order]
+    cluster = cluster[order]
+    n_clusters = len(uniq)
+    symbols = index.symbols[rows]
+    X = index.features[rows]
+
+    # distance to the cluster centroid in this quarter
+    d0 = X - cluster_centroids(X, cluster, n_clusters)[cluster]
+
+    # same for next quarter, over the members that are still listed; construct_params lines the
+    # deltas up by position within the cluster, so member i is compared with the i-th survivor
+    starts = np.flatnonzero(np.r_[True, cluster[1:] != cluster[:-1]])
+    position = np.arange(len(rows)) - np.repeat(starts, np.diff(np.r_[starts, len(rows)]))
+    delta = np.full_like(d0, np.nan)
+    if index_q1 is not None:
+        q1_rows = np.array([index_q1.rows.get(symbol, -1) for symbol in symbols], dtype=np.int64)
+        present = q1_rows >= 0
+        X1 = index_q1.features[q1_rows[present]]
+        c1 = cluster[present]
+        d1 = X1 - cluster_centroids(X1, c1, n_clusters)[c1]
+
+        survivors = np.bincount(c1, minlength=n_clusters)
+        survivor_start = np.r_[0, np.cumsum(survivors)[:-1]]
+        aligned = position < survivors[cluster]
+        delta[aligned] = d1[survivor_start[cluster[aligned]] + position[aligned]] - d0[aligned]
+
+    # targets, attached by position instead of merging on symbol
+    priced = np.array([symbol in returns_table.columns for symbol in symbols], dtype=bool)
+    priced_symbols = list(symbols[priced])
+    if not priced_symbols:
+        return None
+    perf_q1 = calculate_outright_performance(price_data, priced_symbols, q1, returns_table=returns_table,
+                                             quarters_dict=quarters_dict)
+    perf_q2 = calculate_outright_performance(price_data, priced_symbols, q2, returns_table=returns_table,
+                                             quarters_dict=quarters_dict)
+
+    feature_cols = list(index.columns)
+    values = np.hstack([X[priced], d0[priced], delta[priced],
+                        perf_q1['outright_performance'].to_numpy()[:, None],
+                        perf_q2['outright_performance'].to_numpy()[:, None]])
+    columns = [f"{col}_x" for col in feature_cols] + [f"{col}_y" for col in feature_cols] + \
+              [f"{col}_delta" for col in feature_cols] + ['outright_performance', 'target']
+
+    df = pd.DataFrame(values, columns=columns)
+    df.insert(0, 'symbol', priced_symbols)
+    return df
@@ -0,0 +1,105 @@
+import logging
+import threading
+import pandas as pd
+from .benchmark import BenchmarkEngine
+from .cache import data_fingerprint, invalidate_training_data
+from .store import PRICE_CSV, QUARTERLY_DIR, load_price_data, load_quarterlies
+from .timing import span
+from .utils import quarters_dict
+
+logger = logging.getLogger(__name__)
+
+SPY_CSV = 'data/seed/spy_data.csv'
+
+
+class DataContext:
+    """
+    Lazily loaded, process-wide data (price_data, df_dict, SPY baseline) and the quarter calendar
+    (quarters_dict) it covers. Nothing is read until an attribute is first used, so importing
+    strategy.* does no I/O. `fingerprint` is the data_fingerprint() of the files as they were when
+    loading started; refresh() reloads once they change on disk.
+    """
+
+    def __init__(self, price_path=PRICE_CSV, quarterly_path=QUARTERLY_DIR, spy_path=SPY_CSV):
+        self.quarters_dict = quarters_dict
+        self.price_path = price_path
+        self.quarterly_path = quarterly_path
+        self.spy_path = spy_path
+        self._lock = threading.RLock()
+        self._loaded = {}
+        self.fingerprint = None
+        self.error = None
+
+    def paths(self):
+        return (self.quarterly_path, self.price_path, self.spy_path)
+
+    def _get(self, name, loader):
+        value = self._loaded.get(name)
+        if value is None:
+            with self._lock:
+                value = self._loaded.get(name)
+                if value is None:
+                    if self.fingerprint is None:
+                        # taken before reading, so a file rewritten mid-load is picked up by the next refresh()
+                        self.fingerprint = data_fingerprint(self.paths())
+                    with span(f'load_{name}'):
+                        value = loader()
+                    self._loaded[name] = value
+                    self.error = None
+        return value
+
+    @property
+    def price_data(self):
+        return self._get('price_data', lambda: load_price_data(self.price_path))
+
+    @property
+    def df_dict(self):
+        return self._get('df_dict', lambda: load_quarterlies(self.quarterly_path))
+
+    @property
+    def spy_baseline(self):
+        return self._get('spy_baseline', lambda: pd.read_csv(self.spy_path))
+
+    @property
+    def benchmarks(self):
+        """BenchmarkEngine over price_data and the SPY baseline, so aligned benchmarks are shared across requests."""
+        return self._get('benchmarks', lambda: BenchmarkEngine(self.price_data, self.spy_baseline))
+
+    def warm_up(self):
+        """Load everything up front (e.g. from a background thread at startup)."""
+        try:
+            self.price_data, self.df_dict, self.spy_baseline
+        except Exception as e:
+            self.error = e
+            logger.exception("Data warm-up failed: %s", e)
+
+    def is_ready(self):
+        return all(name in self._loaded for name in ('price_data', 'df_dict', 'spy_baseline'))
+
+    def owns(self, df_dict):
+        """Whether every frame of df_dict is one this context loaded (its df_dict, or a window of it)."""
+        loaded = self._loaded.get('df_dict')
+        return loaded is not None and all(loaded.get(q) is df for q, df in df_dict.items())
+
+    def reload(self):
+        """Forget everything loaded so far; the next access re-reads the (possibly updated) files."""
+        with self._lock:
+            self._loaded = {}
+            self.fingerprint = None
+            self.error = None
+            invalidate_training_data()  # built from the frames just dropped
+
+    def refresh(self):
+        """
+        reload() if the files changed since they were loaded. Returns their current fingerprint, which is
+        also `fingerprint` once they are (re)loaded.
+        """
+        current = data_fingerprint(self.paths())
+        with self._lock:
+            if self.fingerprint is not None and self.fingerprint != current:
+                logger.info("Data files changed, reloading")
+                self.reload()
+        return current
+
+
+data_context = DataContext()
@@ -1,24 +1,27 @@
+import logging
 import pandas as pd
-import os
 from strategy.clustering import train_kmeans, get_cluster_mapping, construct_params
-from .utils import price_data
+from .utils import index_df_dict
+from .store import load_quarterlies
+
+logger = logging.getLogger(__name__)
+
+def __getattr__(name):
+    if name == 'price_data':
+        from .context import data_context
+        return data_context.price_data
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 def load_df_dict(path='data/quarterly/', feature_start_idx=3):
-    df_dict = {}
-    for fname in os.listdir(path):
-        if fname.endswith('.csv'):
-            quarter = fname.replace('.csv', '')
-            df = pd.read_csv(os.path.join(path, fname))
-            df = df.loc[:, ~df.columns.str.contains('^Unnamed')]
-            df = df.sort_values(by='symbol').reset_index(drop=True)
-            df_dict[quarter] = df
-    return df_dict
+    # binary store when it is up to date, otherwise the CSVs
+    return load_quarterlies(path)
 
 def build_dataset(stock_list, df_dict, price_data, n_clusters=15, relative_performance=True):
     """
     Constructs cluster-relative training dataset using construct_params().
     """
     cluster_models = train_kmeans(df_dict, n_clusters=n_clusters)
+    index_dict = index_df_dict(df_dict)
     all_data = []
 
     for quarter in sorted(df_dict.keys())[:-2]:
@@ -26,15 +29,16 @@ def build_dataset(stock_list, df_dict, price_data, n_clusters=15, relative_perfo
         if model is None:
             continue
 
-        cluster_map = get_cluster_mapping(model, quarter, stock_list)
+        cluster_map = get_cluster_mapping(df_dict, model, quarter, stock_list, index=index_dict[quarter])
 
         for cluster in cluster_map.values():
-            df = construct_params(price_data, cluster, quarter, df_dict, relative_performance)
+            df = construct_params(price_data, cluster, quarter, df_dict, relative_performance, index_dict=index_dict)
             if df is not None and not df.empty:
                 df['quarter'] = quarter
                 all_data.append(df)
 
     if not all_data:
         raise ValueError("No data constructed. Check clustering or feature issues.")
-    print(f'dataset: {pd.concat(all_data)}')
-    return pd.concat(all_data, ignore_index=True)
+    dataset = pd.concat(all_data, ignore_index=True)
+    logger.debug('dataset: %d rows x %d columns', *dataset.shape)
+    return dataset
@@ -0,0 +1,134 @@
+"""
+Incremental refresh of the walk-forward pipeline.
+
+Every stage is keyed by a signature of exactly the inputs it reads:
+  - data_dict[q]: q's and q+1's fundamentals, the clustering parameters and the price windows
+    behind q+1's feature / q+2's target (see clustering.performance_window)
+  - rankings[q_feat]: the signatures of data_dict[q_train] and data_dict[q_feat]
+A new quarter or new price rows only change the last few signatures, so only those quarters are
+re-clustered, re-featurized and re-fit. Replaying trades and the ledger from the stored rankings is
+cheap and is always redone.
+
+Run the nightly refresh from the backend directory with:
+    python -m strategy.incremental
+"""
+import hashlib
+import os
+import joblib
+import pandas as pd
+from .backtest import compute_rankings, replay_rankings, build_transactions, simulate_portfolio_ledger
+from .clustering import train_kmeans, performance_window, KMEANS_DIR
+from .models import build_quarter_data
+from .utils import data_calendar, next_quarter, index_df_dict, ReturnsTable
+
+STATE_PATH = 'data/state/pipeline.joblib'
+
+
+def frame_hash(df):
+    digest = hashlib.sha1()
+    digest.update(','.join(map(str, df.columns)).encode())
+    digest.update(pd.util.hash_pandas_object(df, index=True).values.tobytes())
+    return digest.hexdigest()
+
+
+def quarter_signature(df_dict, price_data, quarter, config, calendar):
+    """Hash of every input build_quarter_data() reads for `quarter`, or None if it cannot be built yet."""
+    q1 = next_quarter(quarter)
+    q2 = next_quarter(q1)
+    if q1 not in df_dict or q1 not in calendar or q2 not in calendar:
+        return None
+
+    parts = [repr(config), frame_hash(df_dict[quarter]), frame_hash(df_dict[q1])]
+    for q in (q1, q2):
+        start_date, end_date = performance_window(q, quarters_dict=calendar)
+        parts.append(f'{start_date}:{end_date}')
+        parts.append(frame_hash(price_data.loc[start_date:end_date]))
+    return hashlib.sha1('|'.join(parts).encode()).hexdigest()
+
+
+def load_state(path=STATE_PATH):
+    try:
+        return joblib.load(path)
+    except Exception:
+        return None
+
+
+def save_state(state, path=STATE_PATH):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f'{path}.{os.getpid()}.tmp'
+    joblib.dump(state, tmp)
+    os.replace(tmp, path)
+
+
+def incremental_update(df_dict, price_data, state=None, n_clusters=15, seed=42, relative_performance=False,
+                       fundamentals_only=False, k=10, sell_threshold=0.3, initial_capital=100_000,
+                       n_workers=1, model_dir=KMEANS_DIR, model='RandomForest'):
+    """
+    Bring `state` (from a previous run, or None) up to date with df_dict / price_data.
+    Returns the new state; state['updated'] lists the quarters whose features and models were rebuilt.
+    The quarter calendar is df_dict's (data_calendar), so a newly added quarter extends it.
+    """
+    calendar = data_calendar(df_dict)
+    config = (n_clusters, seed, relative_performance)
+    if (state is None or state.get('config') != config or state.get('fundamentals_only') != fundamentals_only
+            or state.get('model') != model):
+        state = {'config': config, 'fundamentals_only': fundamentals_only, 'model': model,
+                 'data_sigs': {}, 'data_dict': {}, 'rank_sigs': {}, 'rankings': {}}
+
+    # 1. features / targets
+    quarters = sorted(df_dict.keys())[:-2]
+    data_sigs = {q: quarter_signature(df_dict, price_data, q, config, calendar) for q in quarters}
+    data_sigs = {q: sig for q, sig in data_sigs.items() if sig is not None}
+    stale = [q for q, sig in data_sigs.items() if state['data_sigs'].get(q) != sig]
+
+    if stale:
+        models = train_kmeans({q: df_dict[q] for q in stale}, n_clusters=n_clusters, seed=seed, model_dir=model_dir)
+        index_dict = index_df_dict(df_dict)
+        returns_table = ReturnsTable(price_data)
+        for q in stale:
+            df = build_quarter_data(df_dict, price_data, q, models[q], index_dict, relative_performance, returns_table,
+                                    quarters_dict=calendar)
+            if df is None:
+                state['data_dict'].pop(q, None)
+            else:
+                state['data_dict'][q] = df
+
+    for q in set(state['data_dict']) - set(data_sigs):
+        del state['data_dict'][q]
+    state['data_sigs'] = data_sigs
+
+    # 2. per-quarter models and rankings
+    all_quarters = list(calendar)
+    rank_sigs = {}
+    for i in range(len(all_quarters) - 2):
+        q_train, q_feat = all_quarters[i], all_quarters[i+1]
+        if q_train in state['data_dict'] and q_feat in state['data_dict']:
+            rank_sigs[q_feat] = hashlib.sha1(f'{data_sigs[q_train]}|{data_sigs[q_feat]}'.encode()).hexdigest()
+    refit = {q for q, sig in rank_sigs.items() if state['rank_sigs'].get(q) != sig}
+
+    fitted = {}
+    if refit:
+        fitted = compute_rankings(state['data_dict'], all_quarters, fundamentals_only, n_workers=n_workers, only=refit,
+                                  model=model)
+    # pairs without usable targets yet produce no rankings; their signature is kept so they are not retried
+    rankings = {q: r for q, r in state['rankings'].items() if q not in refit}
+    rankings.update(fitted)
+    state['rankings'] = {q: rankings[q] for q in rank_sigs if q in rankings}
+    state['rank_sigs'] = rank_sigs
+
+    # 3. trades and ledger, replayed from the stored rankings
+    buys_df, sells_df = replay_rankings(state['rankings'], price_data, calendar, k=k,
+                                        sell_threshold=sell_threshold, verbose=False)
+    state['transactions'] = build_transactions(buys_df, sells_df, price_data, calendar)
+    state['ledger'] = simulate_portfolio_ledger(state['transactions'], price_data, initial_capital)
+    state['updated'] = {'features': stale, 'models': sorted(fitted)}
+    return state
+
+
+if __name__ == '__main__':
+    from .context import data_context
+
+    state = incremental_update(data_context.df_dict, data_context.price_data, state=load_state())
+    save_state(state)
+    print(f"Rebuilt features for {state['updated']['features'] or 'no quarters'}, "
+          f"refit models for {state['updated']['models'] or 'no quarters'}; state written to {STATE_PATH}")
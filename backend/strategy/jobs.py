@@ -0,0 +1,247 @@
+import logging
+import multiprocessing
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import numpy as np
+from .backtest import main, simulate_portfolio_ledger, window_prices
+from .benchmark import BenchmarkEngine
+from .cache import result_cache, result_key
+from .context import data_context
+from .timing import collect, merge
+from .utils import quarter_window, getMetrics
+
+logger = logging.getLogger(__name__)
+
+BACKTEST_PARAMS = ('k', 'initial_capital', 'random_state', 'model_strategy', 'sell_threshold', 'start_quarter', 'end_quarter',
+                   'benchmarks')
+# the parts of a backtest result that are cached and served
+RESULT_TABLES = ('transactions', 'ledger', 'metrics', 'benchmarks', 'relative')
+# backtests running at once: the job pool's size, and the bound on the ones API requests run in-process
+BACKTEST_CONCURRENCY = int(os.environ.get('BACKTEST_CONCURRENCY', 2))
+request_slots = threading.BoundedSemaphore(BACKTEST_CONCURRENCY)
+
+
+def run_backtest(params, progress=None, n_workers=1, context=None, use_cache=True, large_universe=False):
+    """
+    Full /api/backtest flow for one parameter set: transactions, ledger and metrics.
+    `context` supplies price_data / df_dict / spy_baseline and their quarters_dict (default: the shared data_context),
+    and its fingerprint, if it has one, keys the cached training data.
+    start_quarter / end_quarter restrict the run (models, trades, ledger and benchmark) to that window.
+    `benchmarks` (default SPY) are compared with the ledger (see benchmark.BenchmarkEngine).
+    large_universe: float32 prices and features built quarter by quarter (see backtest.stream_rankings).
+    """
+    context = context or data_context
+    calendar = context.quarters_dict
+    all_prices = context.price_data.astype(np.float32) if large_universe else context.price_data
+    start_quarter, end_quarter = params.get('start_quarter'), params.get('end_quarter')
+    window = quarter_window(start_quarter, end_quarter, calendar)
+    windowed = len(window) < len(calendar)
+    price_data = window_prices(all_prices, window, calendar) if windowed else all_prices
+
+    transactions = main(
+        df_dict=context.df_dict,
+        price_data=all_prices,
+        quarters_dict=calendar,
+        random_state=params['random_state'],
+        k=params['k'],
+        sell_threshold=params['sell_threshold'],
+        log=True,
+        write_csv=False,
+        fundamentals_only=False,
+        relative_performance=False,
+        use_cache=use_cache,
+        n_workers=n_workers,
+        progress=progress,
+        model=params['model_strategy'],
+        start_quarter=start_quarter,
+        end_quarter=end_quarter,
+        large_universe=large_universe,
+        fingerprint=getattr(context, 'fingerprint', None),
+    )
+
+    if progress:
+        progress('ledger', 0, 1)
+    ledger = simulate_portfolio_ledger(
+        returns_df=transactions,
+        price_data=price_data,
+        initial_capital=params['initial_capital']
+    )
+    if progress:
+        progress('ledger', 1, 1)
+    metrics = getMetrics(ledger, context.spy_baseline)
+
+    # every requested benchmark, aligned to the ledger's dates in one pass
+    names = params.get('benchmarks') or ('SPY',)
+    engine = getattr(context, 'benchmarks', None) or BenchmarkEngine(context.price_data, context.spy_baseline)
+    benchmarks = engine.compare(ledger, names)
+    relative = engine.quarterly_relative(ledger, window, names)
+
+    return {
+        "transactions": transactions,
+        "ledger": ledger,
+        "metrics": metrics,
+        "benchmarks": benchmarks,
+        "relative": relative
+    }
+
+
+# set in every pool worker by the initializer, so progress can be reported back to the API process
+progress_queue = None
+
+
+def init_worker(queue):
+    global progress_queue
+    progress_queue = queue
+
+
+def run_job(job_id, params):
+    def progress(stage, done, total):
+        progress_queue.put((job_id, stage, done, total))
+    data_context.refresh()  # each worker holds its own copy of the data
+    # the worker's stage timings travel back with the result and feed the API process's /metrics
+    result, events = collect(run_backtest, params, progress=progress)
+    result['timings'] = events
+    result['fingerprint'] = data_context.fingerprint  # what the result was computed from
+    return result
+
+
+class Job:
+    def __init__(self, job_id, params):
+        self.job_id = job_id
+        self.params = params
+        self.status = 'queued'
+        self.stage = None
+        self.done = 0
+        self.total = 0
+        self.result = None
+        self.encoded = None  # EncodedPayload of the result, built on first fetch
+        self.error = None
+        self.fingerprint = None  # of the data the result is cached for
+        self.submitted_at = time.time()
+        self.finished_at = None
+
+    def to_dict(self):
+        return {
+            "job_id": self.job_id,
+            "status": self.status,
+            "params": self.params,
+            "progress": {"stage": self.stage, "done": self.done, "total": self.total},
+            "error": self.error,
+            "submitted_at": self.submitted_at,
+            "finished_at": self.finished_at,
+        }
+
+
+class JobManager:
+    """
+    Runs backtests in a bounded process pool. Identical parameter sets that are queued or
+    running at the same time share one job, and parameter sets already in the result cache
+    finish immediately. Finished jobs are kept (up to max_finished) so their results can be fetched.
+    """
+
+    def __init__(self, max_workers=None, max_finished=32):
+        self.max_workers = max_workers or BACKTEST_CONCURRENCY
+        self.max_finished = max_finished
+        self.jobs = OrderedDict()
+        self.active = {}  # (data fingerprint, normalized params) -> job_id
+        self._lock = threading.RLock()  # a future that is already done runs its callback (_finish) in submit()
+        self._pool = None
+        self._queue = None
+
+    def _start(self):
+        # started on first submit, so importing the API does not spawn processes
+        if self._queue is None:
+            self._queue = multiprocessing.Queue()
+            threading.Thread(target=self._drain_progress, daemon=True).start()
+        if self._pool is None:
+            self._pool = ProcessPoolExecutor(max_workers=self.max_workers, initializer=init_worker,
+                                             initargs=(self._queue,))
+
+    def _discard(self, pool):
+        """Drop a pool broken by a dead worker; the next submit starts a new one."""
+        if self._pool is pool:
+            logger.warning("Backtest pool broken, restarting it")
+            self._pool = None
+            pool.shutdown(wait=False, cancel_futures=True)
+
+    def _drain_progress(self):
+        while True:
+            job_id, stage, done, total = self._queue.get()
+            job = self.jobs.get(job_id)
+            if job is not None and job.status in ('queued', 'running'):
+                job.status = 'running'
+                job.stage, job.done, job.total = stage, done, total
+
+    def submit(self, params):
+        params = {name: params[name] for name in BACKTEST_PARAMS}
+        fingerprint = data_context.refresh()
+        key = (fingerprint, tuple(sorted(params.items())))
+        with self._lock:
+            if key in self.active:
+                return self.jobs[self.active[key]]
+
+            job = Job(uuid.uuid4().hex, params)
+            job.fingerprint = fingerprint
+            cached = result_cache.get(result_key(params, fingerprint))
+            if cached is not None:
+                job.result, job.encoded = cached.value, cached
+                job.status, job.finished_at = 'done', time.time()
+                self.jobs[job.job_id] = job
+                self._trim()
+                return job
+
+            self._start()
+            try:
+                future = self._pool.submit(run_job, job.job_id, params)
+            except BrokenProcessPool:
+                self._discard(self._pool)
+                self._start()
+                future = self._pool.submit(run_job, job.job_id, params)
+            self.jobs[job.job_id] = job
+            self.active[key] = job.job_id
+            pool = self._pool
+            future.add_done_callback(lambda f: self._finish(job, key, f, pool))
+            return job
+
+    def _finish(self, job, key, future, pool=None):
+        result = encoded = error = None
+        try:
+            result = future.result()
+            merge(result.pop('timings', []))
+            # a worker that reloaded newer data than the job was keyed on still answers the job, uncached
+            if result.pop('fingerprint', None) == job.fingerprint:
+                encoded = result_cache.put(result_key(job.params, job.fingerprint),
+                                           {name: result[name] for name in RESULT_TABLES})
+        except Exception as e:
+            error = f"{type(e).__name__}: {e}"
+            if isinstance(e, BrokenProcessPool):
+                with self._lock:
+                    self._discard(pool)
+
+        with self._lock:
+            if error is None:
+                job.result, job.encoded = result, encoded
+                job.status = 'done'
+                job.done = job.total  # the last progress events may still be queued
+            else:
+                job.error = error
+                job.status = 'failed'
+            job.finished_at = time.time()
+            self.active.pop(key, None)
+            self._trim()
+
+    def _trim(self):
+        finished = [job_id for job_id, j in self.jobs.items() if j.status in ('done', 'failed')]
+        for job_id in finished[:max(0, len(finished) - self.max_finished)]:
+            del self.jobs[job_id]
+
+    def get(self, job_id):
+        return self.jobs.get(job_id)
+
+
+job_manager = JobManager()
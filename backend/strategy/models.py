@@ -1,32 +1,93 @@
+import logging
+import os
+from collections import namedtuple
 import pandas as pd
 import numpy as np
-from sklearn.ensemble import RandomForestClassifier
-from .clustering import train_kmeans, get_cluster_mapping, construct_params
+from sklearn.ensemble import RandomForestClassifier, HistGradientBoostingClassifier
+from .clustering import train_kmeans, construct_quarter_params, performance_window
+from .utils import quarters_dict, index_df_dict, next_quarter, ReturnsTable
+from .positions import PositionBook
 from sklearn.linear_model import LogisticRegression
 from sklearn.model_selection import cross_val_score, GridSearchCV
+from sklearn.pipeline import make_pipeline
+from sklearn.preprocessing import StandardScaler
+from threadpoolctl import threadpool_limits
+from .timing import timed
 
-def build_training_data(df_dict, price_data, n_clusters=15, seed=42, relative_performance=True):
+logger = logging.getLogger(__name__)
 
-    models = train_kmeans(df_dict, n_clusters=n_clusters, seed=seed)
-    stock_list = sorted({symbol for df in df_dict.values() for symbol in df['symbol'].unique()})
-    data_dict = {}
+@timed('features')
+def build_quarter_data(df_dict, price_data, quarter, model, index_dict, relative_performance=True, returns_table=None, feature_start_idx=3,
+                       quarters_dict=quarters_dict):
+    """Cluster-relative features and targets for a single quarter, or None if nothing could be built."""
+    if returns_table is None:
+        returns_table = ReturnsTable(price_data)
 
-    for quarter in sorted(df_dict.keys())[:-2]:
+    # one batched predict, then every cluster's features in one pass
+    labels = model.predict(df_dict[quarter].iloc[:, feature_start_idx:])
+    df = construct_quarter_params(price_data, quarter, labels, index_dict, returns_table, relative_performance, quarters_dict)
+    if df is None or df.empty:
+        return None
+    return df
+
+def build_quarters(df_dict, price_data, quarters, n_clusters=15, seed=42, relative_performance=True,
+                   warm_start=False, minibatch=False, model_dir=None, quarters_dict=quarters_dict):
+    """
+    {quarter: features and targets, or None if nothing could be built} for `quarters`. Only those quarters
+    are clustered (with warm_start, every earlier quarter too, since each one starts from the previous
+    one's centroids), and only their feature rows and the prices their targets read are indexed.
+    """
+    if warm_start:
+        fit = [q for q in sorted(df_dict) if q <= max(quarters)]
+    else:
+        fit = quarters
+    models = train_kmeans({q: df_dict[q] for q in fit}, n_clusters=n_clusters, seed=seed, warm_start=warm_start,
+                          minibatch=minibatch, model_dir=model_dir)
+    needed = set(quarters) | {next_quarter(q) for q in quarters}
+    index_dict = index_df_dict({q: df for q, df in df_dict.items() if q in needed})
+    returns_table = ReturnsTable(price_data)
+
+    data = {}
+    for quarter in quarters:
         model = models.get(quarter)
-        if model is None:
-            continue
+        data[quarter] = None if model is None else build_quarter_data(
+            df_dict, price_data, quarter, model, index_dict, relative_performance, returns_table,
+            quarters_dict=quarters_dict)
+    return data
+
+def target_prices(price_data, quarter, quarters_dict=quarters_dict):
+    """The price_data rows a quarter's targets read: its next quarter's report through the following quarter's performance window."""
+    q1 = next_quarter(quarter)
+    start, _ = performance_window(q1, quarters_dict=quarters_dict)
+    _, end = performance_window(next_quarter(q1), quarters_dict=quarters_dict)
+    dates = price_data.index
+    return price_data.iloc[dates.searchsorted(start):dates.searchsorted(end, side='right')]
 
-        cluster_map = get_cluster_mapping(df_dict, model, quarter, stock_list)
+def build_quarter_chunk(df_dict, price_data, quarter, n_clusters=15, seed=42, relative_performance=True,
+                        minibatch=False, model_dir=None, quarters_dict=quarters_dict, dtype=np.float32):
+    """
+    One quarter of build_training_data() on its own, for universes too large to featurize every quarter at
+    once: clusters only this quarter, indexes it and the next, computes targets from a ReturnsTable over just
+    target_prices() and stores the features as `dtype`. None if nothing could be built.
+    """
+    model = train_kmeans({quarter: df_dict[quarter]}, n_clusters=n_clusters, seed=seed, minibatch=minibatch,
+                         model_dir=model_dir)[quarter]
+    index_dict = index_df_dict({q: df_dict[q] for q in (quarter, next_quarter(quarter)) if q in df_dict})
+    prices = target_prices(price_data, quarter, quarters_dict)
+    df = build_quarter_data(df_dict, prices, quarter, model, index_dict, relative_performance, ReturnsTable(prices),
+                            quarters_dict=quarters_dict)
+    if df is None:
+        return None
+    return df.astype(dict.fromkeys(df.columns[1:], dtype))
 
-        for cluster in cluster_map.values():
-            df = construct_params(price_data, cluster, quarter, df_dict, relative_performance)
-            if df is not None and not df.empty:
-                if quarter not in data_dict:
-                    data_dict[quarter] = []
-                data_dict[quarter].append(df)
+def build_training_data(df_dict, price_data, n_clusters=15, seed=42, relative_performance=True,
+                        warm_start=False, minibatch=False, model_dir=None, quarters_dict=quarters_dict):
 
-    for quarter in data_dict:
-        data_dict[quarter] = pd.concat(data_dict[quarter], ignore_index=True)
+    quarters = sorted(df_dict.keys())[:-2]
+    data = build_quarters(df_dict, price_data, quarters, n_clusters=n_clusters, seed=seed,
+                          relative_performance=relative_performance, warm_start=warm_start,
+                          minibatch=minibatch, model_dir=model_dir, quarters_dict=quarters_dict)
+    data_dict = {quarter: df for quarter, df in data.items() if df is not None}
 
     if not data_dict:
         raise ValueError("No data generated. Check cluster mapping or construct_params.")
@@ -41,12 +102,13 @@ param_grid = {
     'max_features': ['sqrt', 'log2'],
 }
 
-def train_random_forest(X_train, y_train, threshold, seed):
-    """Train and return a Random Forest classifier using top-quantile labeling."""
-    threshold = y_train.quantile(0.75)
-    y_binary = (y_train > threshold).astype(int)
+def top_quantile_labels(y_train, quantile=0.75):
+    """1 for the stocks whose target is in the top quartile of the training quarter, else 0."""
+    threshold = y_train.quantile(quantile)
+    return (y_train > threshold).astype(int)
 
-    model = RandomForestClassifier(
+def make_random_forest(seed, n_jobs=-1):
+    return RandomForestClassifier(
         n_estimators=500,         
         max_depth=None,          
         min_samples_split=5,     
@@ -55,15 +117,79 @@ def train_random_forest(X_train, y_train, threshold, seed):
         class_weight='balanced',
         bootstrap=True,         
         oob_score=True,           
-        n_jobs=-1,              
+        n_jobs=n_jobs,              
         random_state=seed,
         verbose=0
     )
 
-    model.fit(X_train, y_binary)
-    cv_auc = cross_val_score(model, X_train, y_binary, scoring='roc_auc', cv=5)
-    
-    return model
+def make_random_forest_light(seed, n_jobs=-1):
+    # a fifth of the trees, shallower, no out-of-bag pass
+    return RandomForestClassifier(
+        n_estimators=100,
+        max_depth=12,
+        min_samples_split=5,
+        min_samples_leaf=2,
+        max_features='sqrt',
+        class_weight='balanced',
+        bootstrap=True,
+        oob_score=False,
+        n_jobs=n_jobs,
+        random_state=seed,
+    )
+
+def make_hist_gradient_boosting(seed, n_jobs=-1):
+    # histogram-binned features; threads come from OpenMP, so n_jobs does not apply.
+    # No class_weight: sample weights make the binner compute weighted percentiles (~4s per fit here),
+    # and only the ordering of predict_proba is used for ranking
+    return HistGradientBoostingClassifier(
+        learning_rate=0.05,
+        max_iter=100,
+        max_leaf_nodes=7,
+        min_samples_leaf=20,
+        l2_regularization=1.0,
+        early_stopping=False,
+        random_state=seed,
+    )
+
+def make_logistic_regression(seed, n_jobs=-1):
+    return make_pipeline(
+        StandardScaler(),
+        LogisticRegression(C=1.0, class_weight='balanced', max_iter=1000, random_state=seed),
+    )
+
+# fit_cost / predict_cost are per-quarter times relative to fitting the default 500-tree RandomForest
+# (= 1.0), measured on the bundled data; the API rejects backends whose total is above MAX_MODEL_COST
+ModelBackend = namedtuple('ModelBackend', ['name', 'build', 'fit_cost', 'predict_cost', 'description'])
+
+MODEL_REGISTRY = {
+    'RandomForest': ModelBackend('RandomForest', make_random_forest, 1.0, 0.04,
+                                 '500-tree random forest with out-of-bag scoring'),
+    'RandomForestLight': ModelBackend('RandomForestLight', make_random_forest_light, 0.15, 0.007,
+                                      '100 trees of depth <= 12, no out-of-bag scoring'),
+    'HistGradientBoosting': ModelBackend('HistGradientBoosting', make_hist_gradient_boosting, 0.08, 0.003,
+                                         'histogram gradient boosting, 100 iterations of 7-leaf trees'),
+    'LogisticRegression': ModelBackend('LogisticRegression', make_logistic_regression, 0.01, 0.001,
+                                       'standardized L2 logistic regression'),
+}
+
+MAX_MODEL_COST = float(os.environ.get('MAX_MODEL_COST', 1.5))
+
+def get_model_backend(name):
+    """Look up a backend by name; case, spaces, '-' and '_' are ignored ('Random Forest' == 'RandomForest')."""
+    key = ''.join(ch for ch in str(name).lower() if ch not in ' -_')
+    for backend_name, backend in MODEL_REGISTRY.items():
+        if backend_name.lower() == key:
+            return backend
+    raise NotImplementedError(f"Model '{name}' not supported. Choose one of {', '.join(MODEL_REGISTRY)}.")
+
+def model_cost(name):
+    """Fit + predict cost of one quarter with backend `name`, relative to the default RandomForest."""
+    backend = get_model_backend(name)
+    return backend.fit_cost + backend.predict_cost
+
+def train_random_forest(X_train, y_train, threshold, seed, n_jobs=-1, diagnostics=False):
+    """Train and return a Random Forest classifier using top-quantile labeling."""
+    return train_model(X_train, y_train, 'RandomForest', threshold, seed, n_jobs=n_jobs, diagnostics=diagnostics)
 
 def train_random_forest_gridsearch(X_train, y_train, threshold, seed):
     """Train and return a Random Forest classifier using top-quantile labeling."""
@@ -81,18 +207,32 @@ def train_random_forest_gridsearch(X_train, y_train, threshold, seed):
         n_jobs=-1,
     )
     grid_search.fit(X_train, y_binary)
-    print("Best AUC:", grid_search.best_score_)
-    print("Best params:", grid_search.best_params_)
+    logger.info("Best AUC: %s", grid_search.best_score_)
+    logger.info("Best params: %s", grid_search.best_params_)
 
     best_model = grid_search.best_estimator_
     return best_model
 
-def train_model(X_train, y_train, model='RandomForest', threshold=0.25, seed=17):
-    """Train a model based on a string identifier."""
-    if model == 'RandomForest':
-        return train_random_forest(X_train, y_train, threshold, seed)
-    else:
-        raise NotImplementedError(f"Model '{model}' not supported.")
+def train_model(X_train, y_train, model='RandomForest', threshold=0.25, seed=17, n_jobs=-1, diagnostics=False, params=None):
+    """
+    Train a model from MODEL_REGISTRY based on a string identifier, using top-quantile labeling.
+    `params` overrides the backend's preset hyperparameters (see strategy.tuning).
+    """
+    backend = get_model_backend(model)
+    y_binary = top_quantile_labels(y_train)
+
+    clf = backend.build(seed, n_jobs=n_jobs)
+    if params:
+        clf.set_params(**params)
+    # n_jobs=1 means a pool worker: keep OpenMP/BLAS backends (HistGradientBoosting, lbfgs) single-threaded too
+    with threadpool_limits(limits=1 if n_jobs == 1 else None):
+        clf.fit(X_train, y_binary)
+    if diagnostics:
+        # 5 extra fits per quarter --> opt-in only
+        cv_auc = cross_val_score(clf, X_train, y_binary, scoring='roc_auc', cv=5)
+        logger.info("%s CV AUC: %.3f (+/- %.3f)", backend.name, cv_auc.mean(), cv_auc.std())
+
+    return clf
 
 def rank_stocks(clf, X_test, y_test, symbols):
     """Return top-k predicted symbols with associated scores and targets."""
@@ -107,10 +247,18 @@ def get_buys(ranked_stocks_df, k):
     return ranked_stocks_df.head(k)
 
 def get_sells(ranked_stocks_df, positions, threshold=0.3):
+    """
+    Positions whose symbol is in the bottom `threshold` of the rankings: slots of a PositionBook
+    (found through its symbol index), or the matching dicts of a list of positions.
+    """
     n_tail = int(len(ranked_stocks_df) * threshold)
-    poor_symbols = set(ranked_stocks_df.tail(n_tail)['symbol'].values)
+    symbols = ranked_stocks_df['symbol'].to_numpy()
+    poor_symbols = symbols[len(symbols) - n_tail:]
+    if isinstance(positions, PositionBook):
+        return positions.holding(poor_symbols)
 
-    # Filter current active positions for those now deemed poor
+    # Filter current active positions for those now deemed poor: one set lookup per position
+    poor_symbols = set(poor_symbols)
     sells = [p for p in positions if p['symbol'] in poor_symbols]
     return sells
 
@@ -0,0 +1,129 @@
+"""
+Compact storage for the walk-forward's open positions and trade records.
+
+PositionBook keeps positions as parallel numpy arrays (symbol code, entry price, entry date) with an
+open flag, plus a symbol -> open slots index, so opening and closing a position are O(1) and the
+positions of a set of symbols are found without scanning the whole book. TradeLog collects trade
+records a batch of columns at a time and concatenates them once, when the frame is needed.
+"""
+import numpy as np
+import pandas as pd
+
+INITIAL_CAPACITY = 64
+
+
+class PositionBook:
+    """
+    Open positions, one slot each. Slots are handed out in opening order and never reused, so
+    sorting slots sorts positions by when they were opened (the order a list of positions had).
+    """
+
+    def __init__(self, dtype=np.float64, capacity=INITIAL_CAPACITY):
+        self.size = 0
+        self.code = np.empty(capacity, dtype=np.int32)
+        self.start_price = np.empty(capacity, dtype=dtype)
+        self.start_date = np.empty(capacity, dtype=object)
+        self.is_open = np.zeros(capacity, dtype=bool)
+        self.codes = {}     # symbol -> code
+        self.names = []     # code -> symbol
+        self.slots = {}     # code -> {slot: None}, open slots in opening order
+        self.n_open = 0
+
+    def __len__(self):
+        return self.n_open
+
+    def _grow(self, needed):
+        capacity = max(needed, 2 * len(self.code))
+        for name in ('code', 'start_price', 'start_date', 'is_open'):
+            old = getattr(self, name)
+            new = np.zeros(capacity, dtype=old.dtype) if name == 'is_open' else np.empty(capacity, dtype=old.dtype)
+            new[:self.size] = old[:self.size]
+            setattr(self, name, new)
+
+    def _code(self, symbol):
+        code = self.codes.get(symbol)
+        if code is None:
+            code = self.codes[symbol] = len(self.names)
+            self.names.append(symbol)
+        return code
+
+    def open(self, symbols, start_prices, start_date):
+        """Open one position per symbol at its price on start_date. Returns the new slots."""
+        n = len(symbols)
+        if self.size + n > len(self.code):
+            self._grow(self.size + n)
+        slots = np.arange(self.size, self.size + n)
+        for slot, symbol in zip(slots, symbols):
+            code = self._code(symbol)
+            self.code[slot] = code
+            self.slots.setdefault(code, {})[int(slot)] = None
+        self.start_price[slots] = start_prices
+        self.start_date[slots] = start_date
+        self.is_open[slots] = True
+        self.size += n
+        self.n_open += n
+        return slots
+
+    def close(self, slots):
+        """Close the positions in `slots` (all of which must be open)."""
+        for slot in slots:
+            del self.slots[self.code[slot]][int(slot)]
+        self.is_open[slots] = False
+        self.n_open -= len(slots)
+
+    def holding(self, symbols):
+        """Slots of the open positions in any of `symbols`, in opening order."""
+        found = []
+        for symbol in set(symbols):
+            code = self.codes.get(symbol)
+            if code is not None:
+                found.extend(self.slots[code])
+        return np.sort(np.array(found, dtype=np.int64))
+
+    def symbols(self, slots):
+        return np.array(self.names, dtype=object)[self.code[slots]] if len(slots) else np.array([], dtype=object)
+
+    def open_slots(self):
+        return np.flatnonzero(self.is_open[:self.size])
+
+    def mark(self, price_row):
+        """
+        Unrealized return of every open position against `price_row` (a price_data row, i.e. a
+        Series indexed by symbol); NaN for symbols without a price. In opening order.
+        """
+        slots = self.open_slots()
+        cols = price_row.index.get_indexer(np.array(self.names, dtype=object))
+        prices = np.append(price_row.to_numpy(), np.nan)[cols][self.code[slots]]  # -1 --> the appended NaN
+        entry = self.start_price[slots]
+        return (prices - entry) / entry
+
+    def to_frame(self):
+        """The open positions as a symbol / start_price / start_date frame, in opening order."""
+        slots = self.open_slots()
+        return pd.DataFrame({'symbol': self.symbols(slots), 'start_price': self.start_price[slots],
+                             'start_date': self.start_date[slots]})
+
+
+class TradeLog:
+    """Append-only trade records, stored as batches of columns and turned into a frame once."""
+
+    def __init__(self, columns):
+        self.columns = list(columns)
+        self.batches = []
+        self.n_rows = 0
+
+    def __len__(self):
+        return self.n_rows
+
+    def add(self, **values):
+        """Append a batch of rows: every column an array of equal length, or a scalar repeated for the batch."""
+        n = max((len(v) for v in values.values() if np.ndim(v)), default=0)
+        if n:
+            self.batches.append({c: values[c] if np.ndim(values[c]) else np.repeat(np.array(values[c], dtype=object), n)
+                                 for c in self.columns})
+            self.n_rows += n
+
+    def to_frame(self):
+        if not self.batches:
+            return pd.DataFrame(columns=self.columns)
+        return pd.DataFrame({c: np.concatenate([batch[c] for batch in self.batches]) for c in self.columns})
@@ -0,0 +1,232 @@
+"""
+Risk analytics over backtest ledgers and transactions.
+
+Every ledger metric works on a (dates x ledgers) matrix of portfolio values, so one ledger and a whole
+sweep's worth go through the same array operations: rolling Sharpe / Sortino from cumulative sums,
+drawdowns and their durations from running maxima. Transaction metrics (hit rate, turnover,
+per-cluster attribution) are grouped sums over integer codes (np.bincount) rather than pandas loops.
+"""
+import warnings
+import numpy as np
+import pandas as pd
+from .benchmark import PERIODS_PER_YEAR
+from .clustering import train_kmeans
+from .timing import timed
+
+ROLLING_WINDOW = 63  # business days, about a quarter
+
+
+def value_matrix(ledgers):
+    """
+    (dates, values) for a list of ledgers: the union of their dates and a (dates x ledgers) matrix of
+    portfolio values, forward-filled over another ledger's extra dates and NaN outside a ledger's own dates.
+    """
+    dates = pd.DatetimeIndex(sorted(set().union(*(pd.to_datetime(l['date']) for l in ledgers))))
+    values = np.full((len(dates), len(ledgers)), np.nan)
+    for j, ledger in enumerate(ledgers):
+        own = pd.DatetimeIndex(pd.to_datetime(ledger['date']))
+        if not len(own):
+            continue  # a ledger without trades stays NaN
+        pos = own.searchsorted(dates, side='right') - 1
+        column = ledger['portfolio_value'].to_numpy(dtype=np.float64)[np.clip(pos, 0, None)]
+        values[:, j] = np.where(pos >= 0, column, np.nan)
+        values[dates > own[-1], j] = np.nan  # a shorter ledger has ended, not gone flat
+    return dates, values
+
+
+def period_returns(values):
+    """Row-over-row returns, with a leading NaN row so they line up with `values`."""
+    returns = np.full(values.shape, np.nan)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        returns[1:] = values[1:] / values[:-1] - 1
+    return returns
+
+
+def rolling_sums(x, window):
+    """Sums of the non-NaN entries and their counts over each trailing `window` rows, from cumulative sums."""
+    valid = ~np.isnan(x)
+    totals = np.cumsum(np.where(valid, x, 0.0), axis=0)
+    counts = np.cumsum(valid, axis=0)
+    totals[window:] = totals[window:] - totals[:-window].copy()
+    counts[window:] = counts[window:] - counts[:-window].copy()
+    return totals, counts
+
+
+def rolling_sharpe(returns, window=ROLLING_WINDOW, periods_per_year=PERIODS_PER_YEAR):
+    """Annualized Sharpe ratio over each trailing window; NaN until a window has `window` returns."""
+    sums, n = rolling_sums(returns, window)
+    squares, _ = rolling_sums(returns ** 2, window)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        mean = sums / n
+        std = np.sqrt(np.maximum(squares - sums * mean, 0) / (n - 1))
+        sharpe = np.where(std > 0, mean / std, np.nan) * np.sqrt(periods_per_year)
+    return np.where(n >= window, sharpe, np.nan)
+
+
+def rolling_sortino(returns, window=ROLLING_WINDOW, periods_per_year=PERIODS_PER_YEAR):
+    """Annualized Sortino ratio (mean over downside deviation) over each trailing window."""
+    sums, n = rolling_sums(returns, window)
+    downside, _ = rolling_sums(np.minimum(returns, 0) ** 2, window)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        deviation = np.sqrt(downside / n)
+        sortino = np.where(deviation > 0, (sums / n) / deviation, np.nan) * np.sqrt(periods_per_year)
+    return np.where(n >= window, sortino, np.nan)
+
+
+def drawdowns(values):
+    """Drawdown from the running peak and the number of rows since that peak, per column."""
+    peak = np.fmax.accumulate(values, axis=0)
+    with np.errstate(invalid='ignore'):
+        drawdown = values / peak - 1
+    rows = np.arange(len(values))[:, None]
+    last_peak = np.maximum.accumulate(np.where(values >= peak, rows, 0), axis=0)
+    duration = np.where(np.isnan(values), 0, rows - last_peak)
+    return drawdown, duration
+
+
+def ledger_summary(values, periods_per_year=PERIODS_PER_YEAR):
+    """Whole-period Sharpe, Sortino, volatility, max drawdown and longest drawdown, one entry per column."""
+    if not len(values):
+        return {name: np.full(values.shape[1], np.nan) for name in
+                ('sharpe_ratio', 'sortino_ratio', 'volatility', 'max_drawdown', 'max_drawdown_duration')}
+    returns = period_returns(values)
+    with np.errstate(invalid='ignore', divide='ignore'), warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)  # a run without trades is an all-NaN column
+        mean = np.nanmean(returns, axis=0)
+        std = np.nanstd(returns, axis=0, ddof=1)
+        downside = np.sqrt(np.nanmean(np.minimum(returns, 0) ** 2, axis=0))
+        drawdown, duration = drawdowns(values)
+        return {
+            'sharpe_ratio': np.where(std > 0, mean / std, np.nan) * np.sqrt(periods_per_year),
+            'sortino_ratio': np.where(downside > 0, mean / downside, np.nan) * np.sqrt(periods_per_year),
+            'volatility': std * np.sqrt(periods_per_year),
+            'max_drawdown': np.nanmin(drawdown, axis=0),
+            'max_drawdown_duration': duration.max(axis=0),
+        }
+
+
+def quarter_stats(transactions, ledger=None):
+    """
+    Per buy quarter: trades, hit rate (share with a positive return), edge hit rate (share beating
+    the SPY baseline) and mean return. With the ledger, also name turnover: positions opened plus
+    positions closed during the quarter, over twice the average number held.
+    """
+    columns = ['quarter', 'trades', 'hit_rate', 'edge_hit_rate', 'mean_return']
+    if transactions.empty:
+        return pd.DataFrame(columns=columns + (['turnover'] if ledger is not None else []))
+    quarters, code = np.unique(transactions['quarter'].astype(str).to_numpy(), return_inverse=True)
+    trades = np.bincount(code, minlength=len(quarters))
+    returns = transactions['return'].to_numpy(dtype=np.float64)
+    stats = pd.DataFrame({
+        'quarter': quarters,
+        'trades': trades,
+        'hit_rate': np.bincount(code, returns > 0, len(quarters)) / trades,
+        'edge_hit_rate': np.bincount(code, transactions['strat_edge'].to_numpy() > 0, len(quarters)) / trades,
+        'mean_return': np.bincount(code, returns, len(quarters)) / trades,
+    })
+    if ledger is None:
+        return stats
+
+    # a quarter runs from its buy date to the next quarter's
+    starts = pd.to_datetime(transactions.groupby(code)['purchase_date'].min().to_numpy(), format='ISO8601').values
+    sell_dates = pd.to_datetime(transactions['sell_date'], format='ISO8601').to_numpy()
+    closed_in = np.searchsorted(starts, sell_dates, side='right') - 1
+    closed_in = closed_in[(closed_in >= 0) & (sell_dates <= pd.to_datetime(ledger['date']).max())]
+    closes = np.bincount(closed_in, minlength=len(quarters))
+
+    ledger_dates = pd.to_datetime(ledger['date']).to_numpy()
+    first_row = np.minimum(np.searchsorted(ledger_dates, starts, side='left'), len(ledger_dates) - 1)
+    held = ledger['num_positions'].to_numpy(dtype=np.float64)
+    rows = np.diff(np.r_[first_row, len(held)])
+    average_held = np.add.reduceat(held, first_row) / np.maximum(rows, 1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        stats['turnover'] = np.where(average_held > 0, (trades + closes) / (2 * average_held), np.nan)
+    return stats
+
+
+def cluster_labels(df_dict, quarters, n_clusters=15, seed=42, model_dir=None, feature_start_idx=3):
+    """quarter / symbol / cluster of every symbol in `quarters`, from the same per-quarter KMeans the features use."""
+    quarters = [q for q in quarters if q in df_dict]
+    models = train_kmeans({q: df_dict[q] for q in quarters}, n_clusters=n_clusters, seed=seed, model_dir=model_dir)
+    frames = []
+    for q in quarters:
+        df = df_dict[q]
+        frames.append(pd.DataFrame({'quarter': q, 'symbol': df['symbol'].to_numpy(),
+                                    'cluster': models[q].predict(df.iloc[:, feature_start_idx:])}))
+    if not frames:
+        return pd.DataFrame(columns=['quarter', 'symbol', 'cluster'])
+    return pd.concat(frames, ignore_index=True).drop_duplicates(['quarter', 'symbol'])
+
+
+def cluster_attribution(transactions, labels):
+    """
+    Per cluster (of the symbol in its buy quarter): trades, hit rate, mean return and edge, and the
+    average contribution to a quarter's return when each quarter's buys are weighted by confidence,
+    as simulate_portfolio_ledger allocates them.
+    """
+    columns = ['cluster', 'trades', 'hit_rate', 'mean_return', 'mean_edge', 'contribution']
+    trades = transactions.merge(labels, on=['quarter', 'symbol'], how='inner')
+    if trades.empty:
+        return pd.DataFrame(columns=columns)
+    clusters, code = np.unique(trades['cluster'].to_numpy(), return_inverse=True)
+    returns = trades['return'].to_numpy(dtype=np.float64)
+    confidence = trades['confidence'].to_numpy(dtype=np.float64)
+    _, buy_date = np.unique(trades['purchase_date'].astype(str).to_numpy(), return_inverse=True)
+    weight = confidence / np.bincount(buy_date, confidence)[buy_date]
+
+    n = np.bincount(code, minlength=len(clusters))
+    return pd.DataFrame({
+        'cluster': clusters,
+        'trades': n,
+        'hit_rate': np.bincount(code, returns > 0, len(clusters)) / n,
+        'mean_return': np.bincount(code, returns, len(clusters)) / n,
+        'mean_edge': np.bincount(code, trades['strat_edge'].to_numpy(dtype=np.float64), len(clusters)) / n,
+        'contribution': np.bincount(code, weight * returns, len(clusters)) / (buy_date.max() + 1),
+    })
+
+
+@timed('risk')
+def risk_report(ledger, transactions, window=ROLLING_WINDOW, labels=None):
+    """
+    Everything the dashboard shows for one backtest: a summary, the rolling series (Sharpe, Sortino,
+    drawdown and its duration per date), per-quarter stats and, given cluster labels, attribution.
+    """
+    dates, values = value_matrix([ledger])
+    returns = period_returns(values)
+    drawdown, duration = drawdowns(values)
+    quarters = quarter_stats(transactions, ledger)
+    summary = {name: value[0] for name, value in ledger_summary(values).items()}
+    summary.update(hit_rate=float((transactions['return'] > 0).mean()) if len(transactions) else np.nan,
+                   turnover=quarters['turnover'].mean() if len(quarters) else np.nan)
+
+    report = {
+        'summary': summary,
+        'rolling': pd.DataFrame({
+            'date': dates,
+            'rolling_sharpe': rolling_sharpe(returns, window)[:, 0],
+            'rolling_sortino': rolling_sortino(returns, window)[:, 0],
+            'drawdown': drawdown[:, 0],
+            'drawdown_duration': duration[:, 0],
+        }),
+        'quarters': quarters,
+    }
+    if labels is not None:
+        report['clusters'] = cluster_attribution(transactions, labels)
+    return report
+
+
+@timed('risk')
+def batch_summary(ledgers, transactions=None):
+    """
+    ledger_summary() of many ledgers (e.g. a sweep's) in one pass, one row each. With their
+    transactions, also each run's hit rate, computed over all runs' trades at once.
+    """
+    _, values = value_matrix(ledgers)
+    summary = pd.DataFrame(ledger_summary(values))
+    if transactions is not None:
+        run = np.repeat(np.arange(len(transactions)), [len(t) for t in transactions])
+        returns = np.concatenate([t['return'].to_numpy(dtype=np.float64) for t in transactions]) if len(run) else np.array([])
+        with np.errstate(invalid='ignore', divide='ignore'):
+            summary['hit_rate'] = (np.bincount(run, returns > 0, len(transactions))
+                                   / np.bincount(run, minlength=len(transactions)))
+    return summary
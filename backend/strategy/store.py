@@ -0,0 +1,150 @@
+"""
+Columnar binary store for price_data and the quarterly fundamentals.
+
+Each float block is saved as a .npy file and loaded with mmap_mode='r', so every worker
+process maps the same read-only pages instead of parsing the CSVs again. The manifest
+records the size/mtime of the source CSVs; a missing or stale store falls back to the CSVs.
+
+Build (or rebuild) it from the backend directory with:
+    python -m strategy.store
+"""
+import json
+import os
+import numpy as np
+import pandas as pd
+
+PRICE_CSV = 'data/price_data.csv'
+QUARTERLY_DIR = 'data/quarterly/'
+STORE_DIR = 'data/store/'
+STORE_VERSION = 1
+
+
+def read_price_csv(path=PRICE_CSV):
+    price_data = pd.read_csv(path)
+    price_data['Date'] = pd.to_datetime(price_data['Date'])
+    price_data.set_index('Date', inplace=True)
+    return price_data
+
+
+def read_quarterly_csv(fname):
+    df = pd.read_csv(fname)
+    df = df.loc[:, ~df.columns.str.contains('^Unnamed')]
+    df = df.sort_values(by='symbol').reset_index(drop=True)
+    return df
+
+
+def quarterly_files(path=QUARTERLY_DIR):
+    if not os.path.isdir(path):
+        return {}
+    return {fname.replace('.csv', ''): os.path.join(path, fname)
+            for fname in sorted(os.listdir(path)) if fname.endswith('.csv')}
+
+
+def file_stats(fname):
+    try:
+        stat = os.stat(fname)
+    except OSError:
+        return None
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+def read_manifest(store_dir=STORE_DIR):
+    try:
+        with open(os.path.join(store_dir, 'manifest.json')) as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if manifest.get('version') != STORE_VERSION:
+        return None
+    return manifest
+
+
+def prices_fresh(manifest, price_path=PRICE_CSV):
+    if manifest is None or 'prices' not in manifest:
+        return False
+    current = file_stats(price_path)
+    # a store shipped without its CSV is still usable
+    return current is None or current == manifest['prices']['source']
+
+
+def quarterlies_fresh(manifest, path=QUARTERLY_DIR):
+    if manifest is None or 'quarters' not in manifest:
+        return False
+    files = quarterly_files(path)
+    if not files:
+        return True
+    if set(files) != set(manifest['quarters']):
+        return False
+    return all(file_stats(fname) == manifest['quarters'][q]['source'] for q, fname in files.items())
+
+
+def write_frame(df, fname):
+    """Save the float64 columns of df as one .npy matrix; everything else goes in the returned spec."""
+    float_cols = [col for col in df.columns if df[col].dtype == np.float64]
+    np.save(fname, np.ascontiguousarray(df[float_cols].to_numpy(dtype=np.float64)))
+    other = {col: {'dtype': str(df[col].dtype), 'values': df[col].tolist()}
+             for col in df.columns if col not in float_cols}
+    return {'columns': list(df.columns), 'float_columns': float_cols, 'other': other}
+
+
+def read_frame(spec, fname):
+    values = np.load(fname, mmap_mode='r')
+    df = pd.DataFrame(values, columns=spec['float_columns'], copy=False)
+    for col in spec['columns']:
+        if col in spec['other']:
+            loc = spec['columns'].index(col)
+            other = spec['other'][col]
+            df.insert(loc, col, pd.Series(other['values'], dtype=other['dtype']))
+    return df
+
+
+def build_store(price_path=PRICE_CSV, quarterly_path=QUARTERLY_DIR, store_dir=STORE_DIR):
+    """One-shot conversion of price_data.csv and the quarterly CSVs into the binary store."""
+    os.makedirs(store_dir, exist_ok=True)
+    manifest = {'version': STORE_VERSION, 'quarters': {}}
+
+    if os.path.exists(price_path):
+        price_data = read_price_csv(price_path)
+        np.save(os.path.join(store_dir, 'prices.npy'),
+                np.ascontiguousarray(price_data.to_numpy(dtype=np.float64)))
+        np.save(os.path.join(store_dir, 'price_dates.npy'), price_data.index.values)
+        manifest['prices'] = {'source': file_stats(price_path), 'columns': list(price_data.columns)}
+
+    for quarter, fname in quarterly_files(quarterly_path).items():
+        df = read_quarterly_csv(fname)
+        spec = write_frame(df, os.path.join(store_dir, f'{quarter}.npy'))
+        spec['source'] = file_stats(fname)
+        manifest['quarters'][quarter] = spec
+
+    # manifest last, so a half-written store is never picked up
+    tmp = os.path.join(store_dir, 'manifest.json.tmp')
+    with open(tmp, 'w') as f:
+        json.dump(manifest, f)
+    os.replace(tmp, os.path.join(store_dir, 'manifest.json'))
+    return manifest
+
+
+def load_price_data(price_path=PRICE_CSV, store_dir=STORE_DIR):
+    """price_data indexed by Date, memory-mapped from the store when it is up to date."""
+    manifest = read_manifest(store_dir)
+    if not prices_fresh(manifest, price_path):
+        return read_price_csv(price_path)
+
+    values = np.load(os.path.join(store_dir, 'prices.npy'), mmap_mode='r')
+    dates = pd.DatetimeIndex(np.load(os.path.join(store_dir, 'price_dates.npy')), name='Date')
+    return pd.DataFrame(values, index=dates, columns=manifest['prices']['columns'], copy=False)
+
+
+def load_quarterlies(path=QUARTERLY_DIR, store_dir=STORE_DIR):
+    """{quarter: fundamentals frame}, memory-mapped from the store when it is up to date."""
+    manifest = read_manifest(store_dir)
+    if not quarterlies_fresh(manifest, path):
+        return {quarter: read_quarterly_csv(fname) for quarter, fname in quarterly_files(path).items()}
+
+    return {quarter: read_frame(spec, os.path.join(store_dir, f'{quarter}.npy'))
+            for quarter, spec in manifest['quarters'].items()}
+
+
+if __name__ == '__main__':
+    manifest = build_store()
+    print(f"Store written to {STORE_DIR}: prices={'prices' in manifest}, quarters={len(manifest['quarters'])}")
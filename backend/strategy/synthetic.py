@@ -0,0 +1,94 @@
+"""
+Synthetic stand-ins for the quarterly fundamentals, price_data and the SPY baseline, shaped like
+the bundled data so every pipeline stage runs on them unchanged. Used by strategy.bench to measure
+how the stages scale with the number of symbols, quarters and price days. Histories longer than
+quarters_dict use synthetic_quarters(), which extends it with the same report dates.
+"""
+import numpy as np
+import pandas as pd
+from .utils import quarters_dict, quarter_calendar
+
+FEATURE_NAMES = ['currentRatio', 'quickRatio', 'returnOnEquity', 'returnOnAssets', 'netProfitMargin',
+                 'priceEarningsRatio', 'priceBookValueRatio', 'priceToSalesRatio', 'freeCashFlowPerShare',
+                 'operatingCashFlowPerShare', 'cashFlowToDebtRatio', 'debtEquityRatio',
+                 'longTermDebtToCapitalization', 'assetTurnover', 'inventoryTurnover']
+
+START_DATE = '2021-01-04'
+CHUNK_DAYS = 256  # price rows generated at a time, so peak memory doesn't grow with the history length
+
+
+def feature_names(n_features):
+    return FEATURE_NAMES[:n_features] + [f'feature{i}' for i in range(len(FEATURE_NAMES), n_features)]
+
+
+def synthetic_quarters(n_quarters):
+    """The first n_quarters of quarters_dict, continued with the same report dates past its end."""
+    return quarter_calendar(next(iter(quarters_dict)), n_quarters)
+
+
+def days_needed(n_quarters):
+    """Business days from START_DATE through the last quarter's evaluation window."""
+    last = pd.Timestamp(list(synthetic_quarters(n_quarters).values())[-1]) + pd.Timedelta(days=120)
+    return len(pd.bdate_range(START_DATE, last))
+
+
+def synthetic_data(n_symbols=500, n_quarters=len(quarters_dict), n_days=None, n_features=15, seed=0,
+                   missing=0.02, dtype=np.float64):
+    """
+    Returns (df_dict, price_data, spy) for `n_symbols` symbols over the first `n_quarters` quarters of
+    synthetic_quarters() and `n_days` business days of prices (default: enough to cover every quarter).
+    Fundamentals are persistent from quarter to quarter and one of them drives the symbol's drift,
+    so the clustering and the models see realistic structure. `missing` is the fraction of symbols
+    absent from each quarterly report. Prices (SPY included, as one block) are stored as `dtype` and
+    generated CHUNK_DAYS rows at a time; the values don't depend on the chunking.
+    """
+    rng = np.random.default_rng(seed)
+    calendar = synthetic_quarters(n_quarters)
+    quarters = list(calendar)
+    symbols = np.array([f'S{i:05d}' for i in range(n_symbols)])
+    columns = feature_names(n_features)
+
+    df_dict = {}
+    features = rng.standard_normal((n_symbols, n_features))
+    drift = np.zeros((n_quarters, n_symbols))
+    for i, quarter in enumerate(quarters):
+        features = 0.8 * features + 0.6 * rng.standard_normal((n_symbols, n_features))
+        drift[i] = 2e-4 * features[:, 0]
+        present = rng.random(n_symbols) >= missing
+        year, period = quarter.split('_')
+        df = pd.DataFrame(features[present], columns=columns)
+        df.insert(0, 'symbol', symbols[present])
+        df.insert(1, 'calendarYear', int(year))
+        df.insert(2, 'period', period)
+        df_dict[quarter] = df
+
+    n_days = n_days or days_needed(n_quarters)
+    dates = pd.bdate_range(START_DATE, periods=n_days)
+    # each day takes the drift of the latest quarter reported by then
+    report_dates = pd.to_datetime([calendar[q] for q in quarters])
+    quarter_pos = np.clip(np.searchsorted(report_dates.values, dates.values, side='right') - 1, 0, None)
+
+    # random-walk log prices, accumulated chunk by chunk; the last column is SPY
+    prices = np.empty((n_days, n_symbols + 1), dtype=dtype)
+    market = np.empty(n_days)
+    level = np.zeros(n_symbols)
+    for first in range(0, n_days, CHUNK_DAYS):
+        last = min(first + CHUNK_DAYS, n_days)
+        log_returns = drift[quarter_pos[first:last]] + 0.02 * rng.standard_normal((last - first, n_symbols))
+        market[first:last] = log_returns.mean(axis=1)
+        log_returns[0] += level  # continue the running sum exactly where the previous chunk stopped
+        np.cumsum(log_returns, axis=0, out=log_returns)
+        level = log_returns[-1].copy()
+        prices[first:last, :n_symbols] = 50 * np.exp(log_returns)
+    prices[:, n_symbols] = spy_close = 400 * np.exp(np.cumsum(market))
+
+    # a few symbols only start trading part-way through
+    listed = rng.random(n_symbols) < 0.05
+    first_day = rng.integers(0, n_days, n_symbols)
+    for symbol in np.flatnonzero(listed):
+        prices[:first_day[symbol], symbol] = np.nan
+
+    # like price_data.csv, the SPY baseline is also a price_data column
+    price_data = pd.DataFrame(prices, index=pd.DatetimeIndex(dates, name='Date'), columns=list(symbols) + ['SPY'])
+    spy = pd.DataFrame({'Date': dates.strftime('%Y-%m-%d'), 'Close': spy_close})
+    return df_dict, price_data, spy
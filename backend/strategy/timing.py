@@ -0,0 +1,148 @@
+"""
+Timing spans for the pipeline stages.
+
+    with span('features', quarter=q):
+        ...
+
+(or @timed('ledger') on a whole function) logs the stage's duration on the 'strategy.timing' logger, adds it to the current request's
+Timings (for the Server-Timing header) and to a process-wide latency histogram (for /metrics).
+Work done in pool workers is timed there with collect() and folded back in with merge().
+"""
+import bisect
+import contextvars
+import functools
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger('strategy.timing')
+
+# seconds; Prometheus-style cumulative buckets, +Inf is implicit
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+
+class Timings:
+    """
+    Spans recorded for one request: span name -> [count, seconds], plus the raw events.
+    A deferred Timings (see collect) leaves the histograms to whoever merges it.
+    """
+
+    def __init__(self, deferred=False):
+        self.spans = {}
+        self.events = []
+        self.deferred = deferred
+        self._lock = threading.Lock()
+
+    def add(self, name, seconds):
+        with self._lock:
+            entry = self.spans.setdefault(name, [0, 0.0])
+            entry[0] += 1
+            entry[1] += seconds
+            self.events.append((name, seconds))
+
+    def server_timing(self):
+        """Server-Timing header value; durations are in milliseconds."""
+        return ', '.join(f'{name};dur={seconds * 1000:.1f};desc="{count}x"'
+                         for name, (count, seconds) in self.spans.items())
+
+
+class Histogram:
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, seconds):
+        self.counts[bisect.bisect_left(BUCKETS, seconds)] += 1
+        self.count += 1
+        self.sum += seconds
+
+
+class Registry:
+    """Process-wide latency histograms keyed by (metric name, label tuple)."""
+
+    def __init__(self):
+        self.histograms = {}
+        self._lock = threading.Lock()
+
+    def observe(self, metric, seconds, **labels):
+        key = (metric, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram()
+            histogram.observe(seconds)
+
+    def render(self):
+        """Prometheus text exposition format."""
+        with self._lock:
+            items = sorted((key, list(h.counts), h.count, h.sum) for key, h in self.histograms.items())
+        lines, seen = [], set()
+        for (metric, labels), counts, count, total in items:
+            if metric not in seen:
+                lines.append(f'# TYPE {metric} histogram')
+                seen.add(metric)
+            label_str = ','.join(f'{k}="{v}"' for k, v in labels)
+            prefix = label_str + ',' if label_str else ''
+            cumulative = 0
+            for bound, n in zip(BUCKETS + ('+Inf',), counts):
+                cumulative += n
+                lines.append(f'{metric}_bucket{{{prefix}le="{bound}"}} {cumulative}')
+            lines.append(f'{metric}_sum{{{label_str}}} {total}')
+            lines.append(f'{metric}_count{{{label_str}}} {count}')
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+current_timings = contextvars.ContextVar('current_timings', default=None)
+
+
+def record(name, seconds):
+    """Account a finished span: the current request's Timings and the stage histogram."""
+    timings = current_timings.get()
+    if timings is not None:
+        timings.add(name, seconds)
+    if timings is None or not timings.deferred:
+        registry.observe('strategy_stage_seconds', seconds, stage=name)
+
+
+@contextmanager
+def span(name, **fields):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - start
+        record(name, seconds)
+        if logger.isEnabledFor(logging.DEBUG):
+            extra = ''.join(f' {k}={v}' for k, v in fields.items())
+            logger.debug('span=%s ms=%.1f%s', name, seconds * 1000, extra)
+
+
+def timed(name):
+    """Decorator form of span() for a whole function."""
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            with span(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def collect(fn, *args, **kwargs):
+    """Run fn with its own deferred Timings (e.g. inside a pool worker); returns (result, [(name, seconds)])."""
+    timings = Timings(deferred=True)
+    token = current_timings.set(timings)
+    try:
+        result = fn(*args, **kwargs)
+    finally:
+        current_timings.reset(token)
+    return result, timings.events
+
+
+def merge(events):
+    """Fold the spans returned by collect() into the caller's request and the histograms."""
+    for name, seconds in events:
+        record(name, seconds)
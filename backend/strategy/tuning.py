@@ -0,0 +1,202 @@
+"""
+Walk-forward hyperparameter search.
+
+Every candidate is scored on the same (q_train, q_feat) pairs the backtest fits: train on q_train,
+rank q_feat, and take the ROC AUC of the ranking against q_feat's top-quartile labels. Unlike
+train_random_forest_gridsearch's shuffled KFold on one quarter, no fold ever trains on the future.
+
+Each (model, params, fold, seed) score is appended to a JSON-lines store as soon as it is computed, keyed
+by a hash of the fold's data and the fits' seed, so an interrupted run resumes where it stopped, and scores
+for quarters whose features changed, or from a run with another seed, are simply recomputed.
+
+Run a search from the backend directory with:
+    python -m strategy.tuning [model] [random|halving|grid]
+"""
+import hashlib
+import json
+import math
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+import pandas as pd
+from sklearn.metrics import roc_auc_score
+from sklearn.model_selection import ParameterGrid, ParameterSampler
+from .backtest import get_train_test_data
+from .models import param_grid, train_model, top_quantile_labels, get_model_backend
+
+SCORES_PATH = 'data/tuning/scores.jsonl'
+
+PARAM_SPACES = {
+    'RandomForest': param_grid,
+    'RandomForestLight': {
+        'n_estimators': [50, 100, 200],
+        'max_depth': [6, 12, None],
+        'min_samples_leaf': [1, 2, 5],
+        'max_features': ['sqrt', 'log2'],
+    },
+    'HistGradientBoosting': {
+        'learning_rate': [0.02, 0.05, 0.1],
+        'max_iter': [50, 100, 200],
+        'max_leaf_nodes': [7, 15, 31],
+        'min_samples_leaf': [10, 20, 40],
+        'l2_regularization': [0.0, 1.0],
+    },
+    'LogisticRegression': {
+        'logisticregression__C': [0.01, 0.03, 0.1, 0.3, 1.0, 3.0, 10.0],
+    },
+}
+
+
+def params_key(params):
+    return json.dumps(params, sort_keys=True)
+
+
+def walk_forward_folds(data_dict, quarters, fundamentals_only=False):
+    """The backtest's (q_train, q_feat) pairs as {q_feat: (X_train, y_train, X_test, y_test, signature)}."""
+    folds = {}
+    for i in range(len(quarters) - 2):
+        q_train, q_feat = quarters[i], quarters[i+1]
+        X_train, y_train, X_test, y_test, _ = get_train_test_data(data_dict, q_train, q_feat, fundamentals_only)
+        if X_train is None:
+            continue
+        digest = hashlib.sha1()
+        for frame in (X_train, y_train, X_test, y_test):
+            digest.update(pd.util.hash_pandas_object(frame, index=False).values.tobytes())
+        folds[q_feat] = (X_train, y_train, X_test, y_test, digest.hexdigest())
+    return folds
+
+
+def score_fold(model, params, X_train, y_train, X_test, y_test, seed=17):
+    """ROC AUC of one fitted fold, or NaN if the test quarter has a single class."""
+    y_true = top_quantile_labels(y_test)
+    if y_true.nunique() < 2:
+        return float('nan')
+    clf = train_model(X_train, y_train, model=model, seed=seed, n_jobs=1, params=params)
+    return float(roc_auc_score(y_true, clf.predict_proba(X_test)[:, 1]))
+
+
+class ScoreStore:
+    """
+    Append-only (model, params, fold signature, seed) -> score store backed by a JSON-lines file.
+    Rows written before scores were keyed by seed never match, so those fits are redone.
+    """
+
+    def __init__(self, path=SCORES_PATH):
+        self.path = path
+        self.scores = {}
+        if path and os.path.exists(path):
+            with open(path) as f:
+                for line in f:
+                    try:
+                        row = json.loads(line)
+                    except ValueError:
+                        continue  # partially written last line of an interrupted run
+                    self.scores[(row['model'], row['params'], row['fold'], row.get('seed'))] = row['score']
+
+    def get(self, model, params, fold, seed):
+        return self.scores.get((model, params_key(params), fold, seed))
+
+    def put(self, model, params, fold, seed, quarter, score):
+        key = (model, params_key(params), fold, seed)
+        self.scores[key] = score
+        if self.path:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            with open(self.path, 'a') as f:
+                f.write(json.dumps({'model': model, 'params': key[1], 'fold': fold, 'seed': seed, 'quarter': quarter,
+                                    'score': score}) + '\n')
+
+
+def candidate_params(model, search='halving', n_candidates=None, seed=17, space=None):
+    """Grid of PARAM_SPACES[model], or n_candidates random draws from it for 'random'."""
+    space = space or PARAM_SPACES[model]
+    if search == 'random':
+        n_candidates = min(n_candidates or 20, len(ParameterGrid(space)))
+        return list(ParameterSampler(space, n_candidates, random_state=seed))
+    return list(ParameterGrid(space))
+
+
+def evaluate(model, candidates, folds, quarters, store, n_workers=1, seed=17, progress=None):
+    """Score every candidate on `quarters` (subset of folds); only pairs missing from the store are fitted."""
+    missing = [(params, q) for params in candidates for q in quarters
+               if store.get(model, params, folds[q][4], seed) is None]
+
+    def record(params, q, score):
+        store.put(model, params, folds[q][4], seed, q, score)
+
+    if n_workers is None or n_workers > 1:
+        with ProcessPoolExecutor(max_workers=n_workers) as pool:
+            futures = {pool.submit(score_fold, model, params, *folds[q][:4], seed=seed): (params, q)
+                       for params, q in missing}
+            for done, future in enumerate(as_completed(futures), start=1):
+                record(*futures[future], future.result())
+                if progress:
+                    progress('tuning', done, len(missing))
+    else:
+        for done, (params, q) in enumerate(missing, start=1):
+            record(params, q, score_fold(model, params, *folds[q][:4], seed=seed))
+            if progress:
+                progress('tuning', done, len(missing))
+
+    rows = []
+    for params in candidates:
+        scores = np.array([store.get(model, params, folds[q][4], seed) for q in quarters], dtype=float)
+        rows.append({'params': params, 'score': np.nanmean(scores) if not np.isnan(scores).all() else np.nan,
+                     'score_std': np.nanstd(scores), 'n_folds': len(quarters)})
+    return pd.DataFrame(rows)
+
+
+def fold_order(quarters, seed=17):
+    """Fold quarters in a fixed shuffled order, so every halving rung's fold set extends the previous one."""
+    rng = np.random.RandomState(seed)
+    return [quarters[i] for i in rng.permutation(len(quarters))]
+
+
+def tune(data_dict, quarters, model='RandomForest', search='halving', n_candidates=None, eta=3, min_folds=2,
+         fundamentals_only=False, n_workers=1, seed=17, store=None, space=None, progress=None):
+    """
+    Walk-forward search over PARAM_SPACES[model] (or `space`).
+      - 'grid':    every candidate on every fold
+      - 'random':  n_candidates random candidates on every fold
+      - 'halving': every candidate (or n_candidates random ones) on min_folds folds, then the best
+                   1/eta on eta times as many folds, until one rung has seen all folds
+    Returns the final rung's candidates sorted by mean AUC (best first).
+    """
+    model = get_model_backend(model).name
+    store = store if store is not None else ScoreStore()
+    folds = walk_forward_folds(data_dict, quarters, fundamentals_only)
+    if not folds:
+        raise ValueError("No walk-forward folds with targets to tune on.")
+
+    if search == 'halving':
+        candidates = candidate_params(model, 'random' if n_candidates else 'grid', n_candidates, seed, space)
+        order = fold_order(list(folds), seed)
+        n_folds = min(min_folds, len(order))
+        while True:
+            results = evaluate(model, candidates, folds, order[:n_folds], store, n_workers, seed, progress)
+            if n_folds == len(order) or len(candidates) == 1:
+                break
+            keep = max(1, math.ceil(len(candidates) / eta))
+            best = results.sort_values('score', ascending=False, na_position='last').head(keep).index
+            candidates = [candidates[i] for i in best]
+            n_folds = min(n_folds * eta, len(order))
+    else:
+        candidates = candidate_params(model, search, n_candidates, seed, space)
+        results = evaluate(model, candidates, folds, list(folds), store, n_workers, seed, progress)
+
+    return results.sort_values('score', ascending=False, na_position='last').reset_index(drop=True)
+
+
+if __name__ == '__main__':
+    from .context import data_context
+    from .cache import get_training_data
+    from .clustering import KMEANS_DIR
+    from .utils import quarters_dict
+
+    model = sys.argv[1] if len(sys.argv) > 1 else 'RandomForest'
+    search = sys.argv[2] if len(sys.argv) > 2 else 'halving'
+    data_dict = get_training_data(data_context.df_dict, data_context.price_data, relative_performance=False,
+                                  model_dir=KMEANS_DIR)
+    results = tune(data_dict, list(quarters_dict.keys()), model=model, search=search, n_workers=os.cpu_count())
+    print(results.head(10).to_string())
+    print(f"Best {model} params: {results['params'].iloc[0]} (walk-forward AUC {results['score'].iloc[0]:.3f})")
@@ -1,9 +1,19 @@
+import logging
 import pandas as pd
 import numpy as np
+from collections import namedtuple
+from numpy.lib.stride_tricks import sliding_window_view
+from .benchmark import align, benchmark_series, compare, drawdown
+from .timing import timed
 
-price_data = pd.read_csv('data/price_data.csv')
-price_data['Date'] = pd.to_datetime(price_data['Date'])
-price_data.set_index('Date', inplace=True)
+logger = logging.getLogger(__name__)
+
+def __getattr__(name):
+    # price_data used to be loaded at import time; it now comes from the lazy data context
+    if name == 'price_data':
+        from .context import data_context
+        return data_context.price_data
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 def next_quarter(current_quarter):
     year, quarter = current_quarter.split('_')
@@ -36,6 +46,53 @@ def returns(price_df, days=1):
 
     return returns_df
 
+class ReturnsTable:
+    """
+    Precomputed N-row window sums over a price panel, so returns() over any date window is O(1)
+    per symbol instead of slicing and averaging price_data each time. NaNs are skipped like
+    DataFrame.mean(). The sums come from strided windows rather than differences of a running
+    cumsum, which keeps the results bit-identical to returns().
+    """
+
+    def __init__(self, price_data):
+        values = price_data.to_numpy(dtype=np.float64)
+        self.valid = ~np.isnan(values)
+        self.filled = np.where(self.valid, values, 0.0)
+        self.dates = price_data.index
+        self.columns = {symbol: i for i, symbol in enumerate(price_data.columns)}
+        self.tables = {}
+
+    def window_table(self, days):
+        """(sums, counts) of every run of `days` consecutive rows, built once per window length."""
+        if days not in self.tables:
+            sums = sliding_window_view(self.filled, days, axis=0).sum(axis=-1)
+            counts = sliding_window_view(self.valid, days, axis=0).sum(axis=-1)
+            self.tables[days] = (sums, counts)
+        return self.tables[days]
+
+    def window_mean(self, first, last, cols):
+        """Mean over rows [first, last) for each column, NaN where there is no valid price."""
+        if last - first > 0 and last - first <= len(self.filled):
+            sums, counts = self.window_table(last - first)
+            total, count = sums[first, cols], counts[first, cols]
+        else:
+            total, count = np.zeros(len(cols)), np.zeros(len(cols))
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return total / count
+
+    def returns(self, symbols, start_date, end_date, days=1):
+        """Same frame as returns(price_data[symbols].loc[start_date:end_date], days)."""
+        cols = np.array([self.columns[symbol] for symbol in symbols], dtype=np.int64)
+        start = self.dates.searchsorted(start_date, side='left')
+        end = self.dates.searchsorted(end_date, side='right')
+
+        start_avg = self.window_mean(start, min(start + days, end), cols)
+        end_avg = self.window_mean(max(end - days, start), end, cols)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            rets = (end_avg - start_avg) / start_avg
+
+        return pd.DataFrame({'symbol': list(symbols), 'returns': rets})
+
 def get_data(symbol, quarter, df_dict, feature_start_idx=3):
     df = df_dict.get(quarter)
     if df is None:
@@ -45,6 +102,20 @@ def get_data(symbol, quarter, df_dict, feature_start_idx=3):
         return None
     return row.iloc[:, feature_start_idx:].reset_index(drop=True)
 
+QuarterIndex = namedtuple('QuarterIndex', ['symbols', 'rows', 'features', 'columns'])
+
+def build_quarter_index(df, feature_start_idx=3):
+    """Symbol -> row map over a contiguous float64 feature matrix for one quarter."""
+    symbols = df['symbol'].to_numpy()
+    rows = {}
+    for i, symbol in enumerate(symbols):
+        rows.setdefault(symbol, i)  # first occurrence wins, like get_data(...).iloc[0]
+    features = np.ascontiguousarray(df.iloc[:, feature_start_idx:].to_numpy(dtype=np.float64))
+    return QuarterIndex(symbols, rows, features, df.columns[feature_start_idx:])
+
+def index_df_dict(df_dict, feature_start_idx=3):
+    return {quarter: build_quarter_index(df, feature_start_idx) for quarter, df in df_dict.items()}
+
 quarters_dict = {
     "2021_Q1": "2021-05-15",
     "2021_Q2": "2021-08-15",
@@ -64,14 +135,97 @@ quarters_dict = {
     "2024_Q4": "2025-02-15"
 }
 
+# month-day each quarter's report is available (Q4 reports early in the following year), as in quarters_dict
+REPORT_DATES = {'Q1': (0, '05-15'), 'Q2': (0, '08-15'), 'Q3': (0, '11-15'), 'Q4': (1, '02-15')}
+
+def quarter_calendar(first_quarter, n_quarters):
+    """n_quarters consecutive quarters from first_quarter, dated like quarters_dict (for longer histories)."""
+    calendar = {}
+    quarter = first_quarter
+    for _ in range(n_quarters):
+        year, period = quarter.split('_')
+        years_later, month_day = REPORT_DATES[period]
+        calendar[quarter] = f"{int(year) + years_later}-{month_day}"
+        quarter = next_quarter(quarter)
+    return calendar
+
+def data_calendar(df_dict):
+    """quarter_calendar() from the first through the last quarter of df_dict, so the calendar follows the data."""
+    quarters = sorted(df_dict)
+    (first_year, first), (last_year, last) = (q.split('_Q') for q in (quarters[0], quarters[-1]))
+    n_quarters = 4 * (int(last_year) - int(first_year)) + int(last) - int(first) + 1
+    return quarter_calendar(quarters[0], n_quarters)
+
+def normalize_quarter(value):
+    """'2021_Q1', 'Q1_2021', '2021Q1' or '2021-q1' -> '2021_Q1'; None or '' -> None."""
+    if value is None or not str(value).strip():
+        return None
+    parts = str(value).strip().upper().replace('-', '_').replace(' ', '_')
+    parts = [p for p in parts.replace('Q', '_Q').split('_') if p]
+    years = [p for p in parts if p.isdigit() and len(p) == 4]
+    periods = [p for p in parts if p in ('Q1', 'Q2', 'Q3', 'Q4')]
+    if len(parts) != 2 or len(years) != 1 or len(periods) != 1:
+        raise ValueError(f"Unrecognized quarter '{value}'; expected e.g. 2021_Q1")
+    return f"{years[0]}_{periods[0]}"
+
+def trading_quarters(quarters_dict=quarters_dict, last_date=None):
+    """
+    Quarters a backtest can buy in: each needs the quarter before (training) and two after (features, evaluation).
+    Given the last price date, only those whose targets have prices, i.e. whose evaluation window
+    (starting two quarters later) starts by then; the others are fitted without test rows and never trade.
+    """
+    quarters = list(quarters_dict)
+    tradable = quarters[1:len(quarters) - 2]
+    if last_date is not None:
+        tradable = [q for i, q in enumerate(tradable) if pd.Timestamp(quarters_dict[quarters[i + 3]]) <= pd.Timestamp(last_date)]
+    return tradable
+
+def resolve_window(start_quarter=None, end_quarter=None, quarters_dict=quarters_dict, last_date=None):
+    """
+    First and last trading quarter of a backtest window. Bounds are clamped to trading_quarters()
+    and None leaves that side open. Raises ValueError for an unparseable quarter or an empty window,
+    and, given the last price date, for a window without any quarter that has prices to trade on.
+    """
+    tradable = trading_quarters(quarters_dict)
+    start = normalize_quarter(start_quarter) or tradable[0]
+    end = normalize_quarter(end_quarter) or tradable[-1]
+    start, end = max(start, tradable[0]), min(end, tradable[-1])
+    if start > end:
+        raise ValueError(f"Empty window: {start_quarter} .. {end_quarter} (tradable quarters are {tradable[0]} .. {tradable[-1]})")
+    if last_date is not None:
+        priced = trading_quarters(quarters_dict, last_date)
+        if not any(start <= q <= end for q in priced):
+            last = f"the last tradable quarter is {priced[-1]}" if priced else "no quarter is tradable"
+            raise ValueError(f"Nothing to trade in {start} .. {end}: prices end on {pd.Timestamp(last_date).date()}, "
+                             f"so {last}")
+    return start, end
+
+def quarter_window(start_quarter=None, end_quarter=None, quarters_dict=quarters_dict):
+    """
+    The slice of quarters_dict a backtest trading start_quarter .. end_quarter needs: the quarter before the
+    first (its model's training data) and the two after the last (feature deltas, targets, the final sells).
+    """
+    start, end = resolve_window(start_quarter, end_quarter, quarters_dict)
+    quarters = list(quarters_dict)
+    first, last = quarters.index(start) - 1, quarters.index(end) + 2
+    return {q: quarters_dict[q] for q in quarters[first:last + 1]}
+
+@timed('metrics')
 def getMetrics(ledger, spy):
-    net_return = (ledger.iloc[-1]['portfolio_value'] - ledger.iloc[0]['portfolio_value']) / ledger.iloc[0]['portfolio_value']
-    print(net_return)
-    # MUST REFINE SPY AND LEDGER AT SOME POINT BY DATE
-    spy_baseline = (spy.iloc[-1]['Close'] - spy.iloc[0]['Close']) / spy.iloc[0]['Close']
+    """
+    Return, CAGR and Sharpe of a ledger, and how it compares with SPY over the same dates: `spy`
+    (a spy_data.csv-style frame, or its benchmark_series()) is aligned to the ledger's dates first.
+    A ledger without two dates (no trades) has nothing to measure, and every metric is NaN.
+    """
+    if len(ledger) < 2:
+        return {name: np.nan for name in ('net_return', 'benchmarked_return', 'cagr', 'sharpe_ratio', 'max_drawdown',
+                                          'tracking_error', 'information_ratio', 'beta')}
+    portfolio = ledger['portfolio_value'].to_numpy(dtype=np.float64)
+    net_return = (portfolio[-1] - portfolio[0]) / portfolio[0]
+    spy_values = align(benchmark_series(spy), pd.to_datetime(ledger['date']))
+    spy_baseline = (spy_values[-1] - spy_values[0]) / spy_values[0]
     benchmarked_return = net_return - spy_baseline
-    print(spy_baseline)
-    print(benchmarked_return)
+    logger.debug("net return %s, SPY %s, benchmarked %s", net_return, spy_baseline, benchmarked_return)
     # compute CAGR    
     start_date = ledger['date'].min()
     end_date = ledger['date'].max()
@@ -84,11 +238,17 @@ def getMetrics(ledger, spy):
     std_dev = daily_returns.std()
     sharpe_ratio = (mean_return / std_dev) * np.sqrt(252) if std_dev != 0 else np.nan
 
+    versus_spy = compare(portfolio, spy_values)
+
     dict = {
         "net_return": net_return*100,
         "benchmarked_return": benchmarked_return*100,
         "cagr": cagr*100,
-        "sharpe_ratio": sharpe_ratio
+        "sharpe_ratio": sharpe_ratio,
+        "max_drawdown": drawdown(portfolio).min()*100,
+        "tracking_error": versus_spy['tracking_error'][0]*100,
+        "information_ratio": versus_spy['information_ratio'][0],
+        "beta": versus_spy['beta'][0]
     }
 
     return dict
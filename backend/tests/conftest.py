@@ -0,0 +1,34 @@
+import os
+import pytest
+from fastapi.testclient import TestClient
+from strategy.cache import result_cache
+from strategy.context import data_context
+from strategy.synthetic import synthetic_data
+from strategy.utils import quarters_dict
+
+BACKTEST = dict(k=5, initial_capital=100_000, random_state=102, model_strategy='LogisticRegression',
+                sell_threshold=0.3, start_quarter='2023_Q1', end_quarter='2023_Q2')
+
+
+def write_data(seed, n_symbols=40):
+    """Synthetic data files where the API reads them (data/ under the working directory), over quarters_dict."""
+    df_dict, price_data, spy = synthetic_data(n_symbols=n_symbols, n_quarters=len(quarters_dict), seed=seed)
+    os.makedirs('data/quarterly', exist_ok=True)
+    os.makedirs('data/seed', exist_ok=True)
+    for quarter, df in df_dict.items():
+        df.to_csv(f'data/quarterly/{quarter}.csv', index=False)
+    price_data.to_csv('data/price_data.csv')
+    spy.to_csv('data/seed/spy_data.csv', index=False)
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    """The API over a temporary data directory, with empty data and result caches."""
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(result_cache, 'path', str(tmp_path / 'cache'))
+    import main
+    data_context.reload()
+    result_cache.clear()
+    yield TestClient(main.app)
+    data_context.reload()
+    result_cache.clear()
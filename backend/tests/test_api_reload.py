@@ -0,0 +1,17 @@
+"""Rewriting the data files reloads them: /api/backtest neither serves nor caches results of the old data."""
+from strategy.context import data_context
+from conftest import BACKTEST, write_data
+
+
+def test_backtest_follows_rewritten_data(client):
+    write_data(seed=1)
+    first = client.get('/api/backtest', params=BACKTEST)
+    assert first.status_code == 200
+    assert client.get('/api/backtest', params=BACKTEST).headers['etag'] == first.headers['etag']
+
+    write_data(seed=2)
+    second = client.get('/api/backtest', params=BACKTEST)
+    assert second.status_code == 200
+    assert second.headers['etag'] != first.headers['etag']
+    assert second.json()['transactions'] != first.json()['transactions']
+    assert data_context.fingerprint == data_context.refresh()
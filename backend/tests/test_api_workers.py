@@ -0,0 +1,22 @@
+"""Backtests run by API requests stay in-process: no per-request process pool."""
+import os
+import pytest
+import strategy.backtest
+from conftest import BACKTEST, write_data
+
+
+@pytest.fixture
+def no_pools(monkeypatch):
+    def refuse(*args, **kwargs):
+        raise AssertionError('a request started a process pool')
+    monkeypatch.setattr(strategy.backtest, 'ProcessPoolExecutor', refuse)
+    monkeypatch.setattr(os, 'cpu_count', lambda: 8)  # as on a multi-core host
+
+
+def test_requests_run_in_process(client, no_pools):
+    write_data(seed=1)
+    assert client.get('/api/backtest', params=BACKTEST).status_code == 200
+    assert client.get('/api/risk', params=BACKTEST).status_code == 200
+    sweep = dict(BACKTEST, k=[3, 5], sell_threshold=[0.3])
+    assert client.get('/api/sweep', params=sweep).status_code == 200
+    assert client.get('/api/ensemble', params=dict(BACKTEST, n_seeds=2)).status_code == 200
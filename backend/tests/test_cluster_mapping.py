@@ -0,0 +1,46 @@
+"""Indexed cluster mapping and feature construction against the per-symbol lookups they replaced."""
+import pandas as pd
+import pytest
+from strategy.clustering import centroid, construct_data, construct_params, get_cluster_mapping, train_kmeans
+from strategy.synthetic import synthetic_data
+from strategy.utils import index_df_dict
+
+QUARTERS = 8
+
+
+@pytest.fixture(scope='module')
+def data():
+    df_dict, price_data, _ = synthetic_data(n_symbols=80, n_quarters=QUARTERS, seed=5)
+    stock_list = sorted({symbol for df in df_dict.values() for symbol in df['symbol']})
+    return df_dict, price_data, train_kmeans(df_dict), index_df_dict(df_dict), stock_list
+
+
+def clusters(data, quarter):
+    df_dict, _, models, index_dict, stock_list = data
+    return get_cluster_mapping(df_dict, models[quarter], quarter, stock_list, index=index_dict[quarter])
+
+
+@pytest.mark.parametrize('quarter', [f'{2021 + i // 4}_Q{i % 4 + 1}' for i in range(QUARTERS)])
+def test_mapping_and_cluster_frames(data, quarter):
+    df_dict, _, models, index_dict, stock_list = data
+    mapping = clusters(data, quarter)
+    assert mapping == get_cluster_mapping(df_dict, models[quarter], quarter, stock_list)
+    assert sorted(s for cluster in mapping.values() for s in cluster) == sorted(df_dict[quarter]['symbol'])
+    for cluster in mapping.values():
+        # the per-symbol frames were concatenated with their own (all zero) indexes
+        expected = construct_data(cluster, quarter, df_dict).reset_index(drop=True)
+        pd.testing.assert_frame_equal(construct_data(cluster, quarter, df_dict, index_dict[quarter]), expected,
+                                      check_exact=True)
+        # the centroid is the original DataFrame.mean() of those rows, whatever frame they come in
+        original = construct_data(cluster, quarter, df_dict).iloc[:, 1:].mean()
+        assert (centroid(expected).iloc[0, 1:].to_numpy(dtype=float) == original.to_numpy()).all()
+
+
+@pytest.mark.parametrize('relative_performance', [False, True])
+def test_params_match_per_symbol_lookups(data, relative_performance):
+    df_dict, price_data, _, index_dict, _ = data
+    for quarter in sorted(df_dict)[:-2]:
+        for cluster in clusters(data, quarter).values():
+            expected = construct_params(price_data, cluster, quarter, df_dict, relative_performance)
+            actual = construct_params(price_data, cluster, quarter, df_dict, relative_performance, index_dict=index_dict)
+            pd.testing.assert_frame_equal(actual, expected, check_exact=True)
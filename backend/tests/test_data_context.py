@@ -0,0 +1,52 @@
+"""DataContext: loading after a failed warm-up, and reloading once the files change."""
+import os
+import pandas as pd
+import pytest
+from strategy.cache import training_data_cache
+from strategy.context import DataContext
+
+
+def write_prices(path, closes):
+    dates = pd.bdate_range('2024-01-01', periods=len(closes)).strftime('%Y-%m-%d')
+    pd.DataFrame({'Date': dates, 'AAA': closes, 'SPY': closes}).to_csv(path, index=False)
+
+
+@pytest.fixture
+def files(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)  # no data/store/ here, so the CSVs are read directly
+    os.makedirs('quarterly')
+    pd.DataFrame({'symbol': ['AAA'], 'calendarYear': [2024], 'period': ['Q1'], 'currentRatio': [1.0]}).to_csv(
+        'quarterly/2024_Q1.csv', index=False)
+    pd.DataFrame({'Date': ['2024-01-01'], 'Close': [1.0]}).to_csv('spy.csv', index=False)
+    return DataContext(price_path='prices.csv', quarterly_path='quarterly/', spy_path='spy.csv')
+
+
+def test_error_clears_once_data_loads(files):
+    files.warm_up()
+    assert files.error is not None and not files.is_ready()
+
+    write_prices('prices.csv', [1.0, 2.0])
+    files.warm_up()
+    assert files.error is None and files.is_ready()
+
+
+def test_refresh_reloads_changed_files(files):
+    write_prices('prices.csv', [1.0, 2.0])
+    assert len(files.price_data) == 2
+    loaded = files.fingerprint
+    assert files.refresh() == loaded and len(files.price_data) == 2
+
+    write_prices('prices.csv', [1.0, 2.0, 3.0])
+    current = files.refresh()
+    assert current != loaded
+    assert len(files.price_data) == 3
+    assert files.fingerprint == current
+
+
+def test_reload_drops_training_data(files):
+    write_prices('prices.csv', [1.0, 2.0])
+    files.price_data
+    training_data_cache.put('built from the old frames', {})
+    write_prices('prices.csv', [1.0, 2.0, 3.0])
+    files.refresh()
+    assert len(training_data_cache) == 0
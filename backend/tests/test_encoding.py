@@ -0,0 +1,19 @@
+"""Content negotiation: Accept-Encoding q-values."""
+import pytest
+from strategy.encoding import accepts_gzip
+
+
+@pytest.mark.parametrize('header, expected', [
+    ('gzip, deflate, br', True),
+    ('br;q=1.0, gzip;q=0.8', True),
+    ('x-gzip', True),
+    ('GZIP', True),
+    ('gzip;q=0', False),
+    ('deflate, gzip;q=0.0', False),
+    ('gzip;q=bad', False),
+    ('identity', False),
+    ('', False),
+    (None, False),
+])
+def test_accepts_gzip(header, expected):
+    assert accepts_gzip(header) is expected
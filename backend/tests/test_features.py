@@ -0,0 +1,54 @@
+"""Whole-quarter features (build_training_data) against the per-cluster construct_params() they replaced."""
+import pandas as pd
+import pytest
+from strategy.backtest import compute_rankings
+from strategy.clustering import construct_params, get_cluster_mapping, train_kmeans
+from strategy.models import build_training_data
+from strategy.synthetic import synthetic_data, synthetic_quarters
+from strategy.utils import ReturnsTable, index_df_dict
+
+QUARTERS = 8
+
+
+@pytest.fixture(scope='module')
+def data():
+    df_dict, price_data, _ = synthetic_data(n_symbols=80, n_quarters=QUARTERS, seed=5)
+    return df_dict, price_data
+
+
+def per_cluster(df_dict, price_data, relative_performance):
+    """The previous build_training_data(): construct_params() cluster by cluster, concatenated."""
+    models = train_kmeans(df_dict)
+    index_dict = index_df_dict(df_dict)
+    returns_table = ReturnsTable(price_data)
+    data_dict = {}
+    for quarter in sorted(df_dict)[:-2]:
+        index = index_dict[quarter]
+        clusters = get_cluster_mapping(df_dict, models[quarter], quarter, sorted(index.rows), index=index)
+        frames = [construct_params(price_data, cluster, quarter, df_dict, relative_performance,
+                                   index_dict=index_dict, returns_table=returns_table)
+                  for cluster in clusters.values()]
+        data_dict[quarter] = pd.concat([df for df in frames if df is not None and not df.empty], ignore_index=True)
+    return data_dict
+
+
+@pytest.mark.parametrize('relative_performance', [False, True])
+def test_features_match_per_cluster(data, relative_performance):
+    df_dict, price_data = data
+    expected = per_cluster(df_dict, price_data, relative_performance)
+    actual = build_training_data(df_dict, price_data, relative_performance=relative_performance)
+    assert list(actual) == list(expected)
+    for quarter in expected:
+        # construct_params() leaves the distance columns as object; the values must match bit for bit
+        pd.testing.assert_frame_equal(actual[quarter], expected[quarter].infer_objects(), check_exact=True)
+
+
+def test_rankings_from_fixed_features(data):
+    df_dict, price_data = data
+    quarters = list(synthetic_quarters(QUARTERS))
+    expected = compute_rankings(per_cluster(df_dict, price_data, False), quarters, False, model='LogisticRegression')
+    actual = compute_rankings(build_training_data(df_dict, price_data, relative_performance=False), quarters, False,
+                              model='LogisticRegression')
+    assert list(actual) == list(expected) and len(actual) == QUARTERS - 3
+    for quarter in expected:
+        pd.testing.assert_frame_equal(actual[quarter], expected[quarter], check_exact=True)
@@ -0,0 +1,25 @@
+"""The incremental refresh follows the data's quarters, including ones past the bundled calendar."""
+import pandas as pd
+from strategy.backtest import main
+from strategy.incremental import incremental_update
+from strategy.synthetic import synthetic_data, synthetic_quarters
+from strategy.utils import data_calendar, quarters_dict
+
+
+def test_data_calendar():
+    assert data_calendar(quarters_dict) == quarters_dict
+    assert data_calendar({'2025_Q4': None, '2025_Q2': None}) == {'2025_Q2': '2025-08-15', '2025_Q3': '2025-11-15',
+                                                              '2025_Q4': '2026-02-15'}
+
+
+def test_incremental_covers_new_quarters(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)  # KMeans models are cached under data/
+    calendar = synthetic_quarters(len(quarters_dict) + 4)
+    df_dict, price_data, _ = synthetic_data(n_symbols=40, n_quarters=len(calendar), seed=3)
+
+    state = incremental_update(df_dict, price_data, model='LogisticRegression')
+    assert max(state['rankings']) > max(quarters_dict)
+
+    expected = main(df_dict, price_data, quarters_dict=calendar, relative_performance=False, log=False,
+                    model='LogisticRegression')
+    pd.testing.assert_frame_equal(state['transactions'], expected)
@@ -0,0 +1,82 @@
+"""JobManager after a worker dies, and what a failed job's result answers."""
+import os
+import time
+from types import SimpleNamespace
+from concurrent.futures import Future
+from concurrent.futures.process import BrokenProcessPool
+import pytest
+from fastapi.testclient import TestClient
+from strategy.jobs import RESULT_TABLES, Job, JobManager, job_manager, run_backtest
+from strategy.synthetic import synthetic_data, synthetic_quarters
+
+
+def test_broken_pool_is_replaced():
+    manager = JobManager(max_workers=1)
+    manager._start()
+    pool = manager._pool
+    with pytest.raises(BrokenProcessPool):
+        pool.submit(os._exit, 1).result()
+
+    job = Job('dead', {})
+    manager.jobs[job.job_id] = job
+    future = Future()
+    future.set_exception(BrokenProcessPool('A child process terminated abruptly'))
+    manager._finish(job, 'key', future, pool)
+    assert job.status == 'failed' and job.error.startswith('BrokenProcessPool')
+    assert manager._pool is None
+
+    manager._start()
+    assert manager._pool is not pool
+    assert manager._pool.submit(pow, 2, 3).result() == 8
+    manager._pool.shutdown()
+
+
+def test_submit_to_a_broken_pool(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)  # no data here: the job runs, and fails loading it
+    manager = JobManager(max_workers=1)
+    manager._start()
+    with pytest.raises(BrokenProcessPool):
+        manager._pool.submit(os._exit, 1).result()
+
+    job = manager.submit(dict(k=5, initial_capital=100_000, random_state=1, model_strategy='LogisticRegression',
+                              sell_threshold=0.3, start_quarter=None, end_quarter=None, benchmarks=('SPY',)))
+    deadline = time.time() + 60
+    while job.status not in ('done', 'failed') and time.time() < deadline:
+        time.sleep(0.1)
+    assert job.status == 'failed' and job.error.startswith('FileNotFoundError')
+    manager._pool.shutdown()
+
+
+def test_failed_job_result_is_a_conflict():
+    import main
+    job = Job('failed', {})
+    job.status, job.error = 'failed', 'ValueError: no data'
+    job_manager.jobs[job.job_id] = job
+    try:
+        response = TestClient(main.app).get(f'/api/jobs/{job.job_id}/result')
+    finally:
+        del job_manager.jobs[job.job_id]
+    assert response.status_code == 409
+    assert 'ValueError: no data' in response.json()['detail']
+
+
+def test_progress_reports_the_finished_ledger():
+    df_dict, price_data, spy = synthetic_data(n_symbols=40, n_quarters=6, seed=2)
+    context = SimpleNamespace(df_dict=df_dict, price_data=price_data, spy_baseline=spy,
+                              quarters_dict=synthetic_quarters(6))
+    events = []
+    run_backtest(dict(k=5, initial_capital=100_000, random_state=1, model_strategy='LogisticRegression',
+                      sell_threshold=0.3, start_quarter=None, end_quarter=None, benchmarks=('SPY',)),
+                 progress=lambda *event: events.append(event), context=context, use_cache=False)
+    assert events[-1] == ('ledger', 1, 1)
+
+
+def test_finished_job_is_complete():
+    manager = JobManager(max_workers=1)
+    job = Job('done', {})
+    job.status, job.stage, job.done, job.total = 'running', 'models', 2, 5  # later events still queued
+    manager.jobs[job.job_id] = job
+    future = Future()
+    future.set_result({**dict.fromkeys(RESULT_TABLES), 'fingerprint': 'newer data'})  # not cached
+    manager._finish(job, 'key', future)
+    assert job.status == 'done' and job.done == job.total
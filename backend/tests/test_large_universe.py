@@ -0,0 +1,40 @@
+"""
+Peak memory of a large-universe backtest grows at most linearly with the universe and with the history:
+a CI-sized stand-in for the 5000 x 80 run that `strategy.bench --large --memory-budget` checks.
+"""
+import gc
+import tracemalloc
+from types import SimpleNamespace
+import numpy as np
+import pytest
+import strategy.backtest
+from strategy.jobs import run_backtest
+from strategy.synthetic import synthetic_data, synthetic_quarters
+
+PARAMS = dict(k=10, initial_capital=100_000, random_state=102, model_strategy='LogisticRegression',
+              sell_threshold=0.3, start_quarter=None, end_quarter=None, benchmarks=('SPY',))
+
+
+@pytest.fixture(autouse=True)
+def small_blocks(monkeypatch):
+    # a 5000-symbol history holds far more symbols than one ledger block; so does this one, with small blocks
+    monkeypatch.setattr(strategy.backtest, 'LEDGER_BLOCK', 16)
+
+
+def peak_mb(n_symbols, n_quarters):
+    df_dict, price_data, spy = synthetic_data(n_symbols, n_quarters, seed=0, dtype=np.float32)
+    context = SimpleNamespace(df_dict=df_dict, price_data=price_data, spy_baseline=spy,
+                              quarters_dict=synthetic_quarters(n_quarters))
+    gc.collect()
+    tracemalloc.start()
+    try:
+        run_backtest(PARAMS, context=context, use_cache=False, large_universe=True)
+        return tracemalloc.get_traced_memory()[1] / 2**20
+    finally:
+        tracemalloc.stop()
+
+
+def test_memory_linear_in_universe_and_history():
+    base = peak_mb(200, 8)
+    assert peak_mb(800, 8) <= 4 * base
+    assert peak_mb(200, 32) <= 4 * base
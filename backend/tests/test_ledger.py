@@ -0,0 +1,78 @@
+"""The vectorized simulate_portfolio_ledger against the day-by-day loop it replaced, on fixed synthetic trades."""
+import numpy as np
+import pandas as pd
+import pytest
+from strategy.backtest import main, simulate_portfolio_ledger
+from strategy.synthetic import synthetic_data, synthetic_quarters
+
+QUARTERS = 8
+
+
+def loop_ledger(returns_df, price_data, initial_capital=100_000, confidence_weighted=True):
+    """The original simulate_portfolio_ledger(): positions opened, closed and marked one business day at a time."""
+    returns_df = returns_df.copy()
+    returns_df['purchase_date'] = pd.to_datetime(returns_df['purchase_date'])
+    returns_df['sell_date'] = pd.to_datetime(returns_df['sell_date'])
+
+    cash = initial_capital
+    positions = []
+    history = []
+    for current_date in pd.date_range(returns_df['purchase_date'].min(), returns_df['sell_date'].max(), freq='B'):
+        for pos in positions:
+            if pos['sell_date'] == current_date:
+                try:
+                    cash += price_data.at[current_date, pos['symbol']] * pos['shares']
+                except KeyError:
+                    continue
+        positions = [pos for pos in positions if pos['sell_date'] > current_date]
+
+        todays_buys = returns_df[returns_df['purchase_date'] == current_date]
+        if not todays_buys.empty:
+            total_conf = todays_buys['confidence'].sum()
+            if confidence_weighted and total_conf > 0:
+                weights = todays_buys['confidence'] / total_conf
+            else:
+                weights = np.repeat(1 / len(todays_buys), len(todays_buys))
+            for (_, row), weight in zip(todays_buys.iterrows(), weights):
+                allocation = cash * weight
+                try:
+                    buy_price = price_data.at[current_date, row['symbol']]
+                except KeyError:
+                    continue
+                positions.append({'symbol': row['symbol'], 'shares': allocation / buy_price,
+                                  'sell_date': row['sell_date']})
+                cash -= allocation
+
+        invested = 0
+        for pos in positions:
+            try:
+                price = price_data.at[current_date, pos['symbol']]
+            except KeyError:
+                price = price_data.loc[:current_date, pos['symbol']].dropna().iloc[-1]
+            invested += price * pos['shares']
+        history.append({'date': current_date, 'portfolio_value': cash + invested, 'cash': cash,
+                        'invested': invested, 'num_positions': len(positions)})
+    return pd.DataFrame(history)
+
+
+@pytest.fixture(scope='module')
+def trades():
+    df_dict, price_data, _ = synthetic_data(n_symbols=60, n_quarters=QUARTERS, seed=11)
+    transactions = main(df_dict, price_data, k=5, log=False, quarters_dict=synthetic_quarters(QUARTERS),
+                        model='LogisticRegression')
+    assert len(transactions)
+    return transactions, price_data
+
+
+@pytest.mark.parametrize('confidence_weighted', [True, False])
+def test_ledger_matches_daily_loop(trades, confidence_weighted):
+    transactions, price_data = trades
+    actual = simulate_portfolio_ledger(transactions, price_data, 100_000, confidence_weighted=confidence_weighted)
+    expected = loop_ledger(transactions, price_data, 100_000, confidence_weighted=confidence_weighted)
+    # the loop's extra last row is the liquidation day, after every position has closed
+    assert expected['num_positions'].iloc[-1] == 0
+    expected = expected.iloc[:-1]
+    assert (actual['date'].to_numpy() == expected['date'].to_numpy()).all()
+    assert (actual['num_positions'].to_numpy() == expected['num_positions'].to_numpy()).all()
+    for column in ('portfolio_value', 'cash', 'invested'):
+        np.testing.assert_allclose(actual[column].to_numpy(), expected[column].to_numpy(), rtol=1e-9, atol=1e-6)
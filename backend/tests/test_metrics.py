@@ -0,0 +1,61 @@
+"""getMetrics and BenchmarkEngine on a ledger small enough to check by hand."""
+import numpy as np
+import pandas as pd
+import pytest
+from strategy.benchmark import COMPARISON, BenchmarkEngine
+from strategy.utils import getMetrics
+
+DATES = pd.bdate_range('2024-01-02', periods=4)
+PORTFOLIO = [100.0, 110.0, 99.0, 121.0]
+# SPY has no close on the third ledger date, so that date takes the previous close
+SPY = pd.DataFrame({'Date': ['2023-12-29', '2024-01-02', '2024-01-03', '2024-01-05'],
+                    'Close': [9.0, 10.0, 11.0, 12.1]})
+SPY_ALIGNED = [10.0, 11.0, 11.0, 12.1]
+
+
+def ledger(values=PORTFOLIO):
+    return pd.DataFrame({'date': DATES[:len(values)], 'portfolio_value': values})
+
+
+def test_metrics_by_hand():
+    metrics = getMetrics(ledger(), SPY)
+    r = np.array([0.1, -0.1, 0.2 / 0.9])     # portfolio returns
+    R = np.array([0.1, 0.0, 0.1])             # aligned SPY returns
+    active = r - R
+    assert metrics['net_return'] == pytest.approx(21.0)
+    assert metrics['benchmarked_return'] == pytest.approx(0.0, abs=1e-12)  # both gained 21%
+    assert metrics['cagr'] == pytest.approx((1.21 ** (365.25 / 3) - 1) * 100)
+    assert metrics['sharpe_ratio'] == pytest.approx(r.mean() / r.std(ddof=1) * np.sqrt(252))
+    assert metrics['max_drawdown'] == pytest.approx(-10.0)  # 110 -> 99
+    assert metrics['tracking_error'] == pytest.approx(active.std(ddof=1) * np.sqrt(252) * 100)
+    assert metrics['information_ratio'] == pytest.approx(active.mean() * 252 / (active.std(ddof=1) * np.sqrt(252)))
+    assert metrics['beta'] == pytest.approx(np.cov(r, R)[0, 1] / R.var(ddof=1))
+
+
+@pytest.mark.parametrize('rows', [0, 1])
+def test_short_ledger_is_nan(rows):
+    metrics = getMetrics(ledger(PORTFOLIO[:rows]), SPY)
+    assert set(metrics) == set(getMetrics(ledger(), SPY))
+    assert all(np.isnan(value) for value in metrics.values())
+
+
+def test_engine_aligns_and_compares():
+    prices = pd.DataFrame({'QQQ': [20.0, 19.0, 21.0, 22.0]}, index=DATES)
+    engine = BenchmarkEngine(prices, SPY)
+    np.testing.assert_array_equal(engine.values(['SPY', 'QQQ'], DATES), np.column_stack([SPY_ALIGNED, prices['QQQ']]))
+
+    stats = engine.compare(ledger(), ['SPY', 'QQQ']).set_index('benchmark')
+    assert stats.loc['SPY', 'benchmark_return'] == pytest.approx(0.21)
+    assert stats.loc['QQQ', 'benchmark_return'] == pytest.approx(0.1)
+    assert stats.loc['QQQ', 'relative_return'] == pytest.approx(0.11)
+    assert stats.loc['QQQ', 'benchmark_max_drawdown'] == pytest.approx(-0.05)
+    metrics = getMetrics(ledger(), SPY)
+    assert stats.loc['SPY', 'beta'] == pytest.approx(metrics['beta'])
+    assert stats.loc['SPY', 'tracking_error'] * 100 == pytest.approx(metrics['tracking_error'])
+
+
+@pytest.mark.parametrize('rows', [0, 1])
+def test_engine_short_ledger_is_nan(rows):
+    stats = BenchmarkEngine(pd.DataFrame(index=DATES), SPY).compare(ledger(PORTFOLIO[:rows]))
+    assert list(stats['benchmark']) == ['SPY']
+    assert stats[list(COMPARISON)].isna().all(axis=None)
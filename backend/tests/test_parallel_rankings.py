@@ -0,0 +1,25 @@
+"""compute_rankings over a process or thread pool gives the serial rankings, frame for frame."""
+import pandas as pd
+import pytest
+from strategy.backtest import compute_rankings
+from strategy.models import build_training_data
+from strategy.synthetic import synthetic_data, synthetic_quarters
+
+QUARTERS = 7
+
+
+@pytest.fixture(scope='module')
+def data_dict():
+    df_dict, price_data, _ = synthetic_data(n_symbols=60, n_quarters=QUARTERS, seed=7)
+    return build_training_data(df_dict, price_data, relative_performance=False)
+
+
+@pytest.mark.parametrize('model', ['RandomForestLight', 'LogisticRegression'])
+@pytest.mark.parametrize('executor', ['process', 'thread'])
+def test_pool_matches_serial(data_dict, model, executor):
+    quarters = list(synthetic_quarters(QUARTERS))
+    serial = compute_rankings(data_dict, quarters, False, n_workers=1, model=model)
+    pooled = compute_rankings(data_dict, quarters, False, n_workers=2, executor=executor, model=model)
+    assert list(pooled) == list(serial) and len(serial) == QUARTERS - 3
+    for quarter in serial:
+        pd.testing.assert_frame_equal(pooled[quarter], serial[quarter], check_exact=True)
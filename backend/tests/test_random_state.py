@@ -0,0 +1,37 @@
+"""random_state is the models' seed: main(random_state=s) is ensemble() seed s, and different seeds differ."""
+import numpy as np
+import pandas as pd
+import pytest
+from strategy.backtest import ensemble, main, simulate_portfolio_ledger
+from strategy.synthetic import synthetic_data, synthetic_quarters
+from strategy.utils import getMetrics
+
+QUARTERS = 7
+MODEL = 'RandomForestLight'
+
+
+@pytest.fixture(scope='module')
+def data():
+    return synthetic_data(n_symbols=50, n_quarters=QUARTERS, seed=3)
+
+
+def backtest(data, random_state):
+    df_dict, price_data, _ = data
+    return main(df_dict, price_data, random_state=random_state, k=5, log=False, relative_performance=False,
+                quarters_dict=synthetic_quarters(QUARTERS), model=MODEL)
+
+
+def test_backtest_reproduces_ensemble_seed(data):
+    df_dict, price_data, spy = data
+    runs, _ = ensemble(df_dict, price_data, spy, seeds=[3], k=5, relative_performance=False,
+                       quarters_dict=synthetic_quarters(QUARTERS), model=MODEL)
+    transactions = backtest(data, 3)
+    metrics = getMetrics(simulate_portfolio_ledger(transactions, price_data, 100_000), spy)
+    assert runs['num_trades'].iloc[0] == len(transactions)
+    for name, value in metrics.items():
+        assert runs[name].iloc[0] == pytest.approx(value, nan_ok=True)
+
+
+def test_random_state_changes_the_models(data):
+    a, b = backtest(data, 1), backtest(data, 2)
+    assert not (len(a) == len(b) and np.array_equal(a['confidence'].to_numpy(), b['confidence'].to_numpy()))
@@ -0,0 +1,58 @@
+"""ResultCache memory accounting: sizes taken once per entry, grown by bodies encoded later."""
+import numpy as np
+import pandas as pd
+import pytest
+from strategy.cache import ResultCache
+from strategy.encoding import JSON, EncodedPayload
+
+
+def result(rows):
+    return {'ledger': pd.DataFrame({'date': pd.date_range('2023-01-02', periods=rows, freq='B'),
+                                    'portfolio_value': np.linspace(1e5, 2e5, rows)})}
+
+
+def frame_bytes(rows):
+    return int(result(rows)['ledger'].memory_usage(deep=True).sum())
+
+
+@pytest.fixture
+def cache():
+    return ResultCache(memory_bytes=10 * frame_bytes(100), disk_bytes=0)
+
+
+def test_sizes_measured_once(cache, monkeypatch):
+    cache.put('a', result(100))
+    calls = []
+    nbytes = EncodedPayload.nbytes
+    monkeypatch.setattr(EncodedPayload, 'nbytes', lambda self: calls.append(self) or nbytes(self))
+    for key in 'bcd':
+        cache.put(key, result(100))
+    assert len(calls) == 3  # one per new entry, not one per cached entry per put
+    assert cache._bytes == 4 * frame_bytes(100)
+
+
+def test_encoded_bodies_are_counted(cache):
+    entry = cache.put('a', result(100))
+    plain = entry.body(JSON)
+    packed = entry.body(JSON, compressed=True)
+    entry.body(JSON)  # already encoded, nothing added
+    assert cache._bytes == frame_bytes(100) + len(plain) + len(packed)
+
+
+def test_encoding_evicts_oldest(cache):
+    cache.memory_bytes = 2 * frame_bytes(100)
+    first = cache.put('a', result(100))
+    cache.put('b', result(100))
+    assert cache.get('a') is first  # 'b' is now the least recently used
+    first.body(JSON)
+    assert list(cache._entries) == ['a']
+    assert cache._bytes == frame_bytes(100) + len(first.body(JSON))
+
+
+def test_replaced_and_evicted_entries_stop_counting(cache):
+    old = cache.put('a', result(100))
+    cache.put('a', result(50))
+    old.body(JSON)
+    assert cache._bytes == frame_bytes(50)
+    cache.clear()
+    assert cache._bytes == 0 and not cache._sizes
@@ -0,0 +1,35 @@
+"""ReturnsTable.returns() against utils.returns() over a price_data slice, edge cases included."""
+import numpy as np
+import pandas as pd
+import pytest
+from strategy.utils import ReturnsTable, returns
+
+
+@pytest.fixture(scope='module')
+def prices():
+    rng = np.random.default_rng(7)
+    dates = pd.bdate_range('2023-01-02', periods=120, name='Date')
+    values = 50 * np.exp(np.cumsum(0.02 * rng.standard_normal((len(dates), 5)), axis=0))
+    price_data = pd.DataFrame(values, index=dates, columns=['AAA', 'BBB', 'CCC', 'DDD', 'EEE'])
+    price_data.iloc[:30, 1] = np.nan        # listed part-way through
+    price_data.iloc[10:15, 2] = np.nan      # a gap
+    price_data.iloc[:, 3] = np.nan          # never priced
+    return price_data
+
+
+@pytest.mark.parametrize('start, end, days', [
+    ('2023-01-02', '2023-06-16', 7),    # the whole panel
+    ('2023-02-01', '2023-04-30', 7),    # an ordinary window, from and to non-trading days
+    ('2023-01-10', '2023-03-01', 1),
+    ('2023-02-01', '2023-02-03', 7),    # fewer rows than `days`: the averages overlap
+    ('2023-01-12', '2023-01-20', 3),    # across the gap
+    ('2023-05-01', '2023-12-31', 7),    # runs past the last price
+    ('2023-02-04', '2023-02-05', 7),    # a weekend: no rows at all
+    ('2023-08-01', '2023-09-01', 7),    # after the last price
+    ('2023-03-01', '2023-02-01', 7),    # end before start
+])
+def test_returns_table_matches_returns(prices, start, end, days):
+    symbols = list(prices.columns)
+    expected = returns(prices[symbols].loc[start:end], days=days)
+    actual = ReturnsTable(prices).returns(symbols, pd.Timestamp(start), pd.Timestamp(end), days=days)
+    pd.testing.assert_frame_equal(actual, expected, check_exact=True)
@@ -0,0 +1,27 @@
+"""batch_summary() of several ledgers scores each exactly as it would be scored alone."""
+import numpy as np
+import pandas as pd
+import pytest
+from strategy.risk import batch_summary, value_matrix
+
+
+def ledger(first, days, seed):
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({'date': pd.bdate_range(first, periods=days),
+                         'portfolio_value': 1e5 * np.cumprod(1 + rng.normal(0, 0.01, days))})
+
+
+@pytest.mark.parametrize('b_first', ['2023-01-02', '2022-06-01'])
+def test_batch_matches_single_ledgers(b_first):
+    a, b = ledger('2023-01-02', 100, 0), ledger(b_first, 300, 1)
+    batch = batch_summary([a, b])
+    for row, single in enumerate((a, b)):
+        alone = batch_summary([single]).iloc[0]
+        pd.testing.assert_series_equal(batch.iloc[row], alone, check_names=False, rtol=1e-12)
+
+
+def test_ledger_is_nan_outside_its_dates():
+    a, b = ledger('2023-01-02', 100, 0), ledger('2023-01-02', 300, 1)
+    dates, values = value_matrix([a, b])
+    assert np.isnan(values[100:, 0]).all() and not np.isnan(values[:100, 0]).any()
+    assert not np.isnan(values[:, 1]).any()
@@ -0,0 +1,68 @@
+"""compute_quarterly_returns against the row-by-row matching it replaced, including perma-holds."""
+import numpy as np
+import pandas as pd
+import pytest
+from strategy.backtest import compute_quarterly_returns, compute_rankings, replay_rankings
+from strategy.models import build_training_data
+from strategy.synthetic import synthetic_data, synthetic_quarters
+
+QUARTERS = 8
+
+
+def loop_returns(buys_df, sells_df, price_data, quarters_dict):
+    """The original compute_quarterly_returns(): each buy scans the quarters and every sell."""
+    results = []
+    for _, row in buys_df.iterrows():
+        symbol, buy_date = row['symbol'], row['buy_date']
+        quarter = next((q for q, start in quarters_dict.items() if start == buy_date), None)
+        sell_row = next((r for r in sells_df.itertuples() if r.symbol == symbol and r.sell_date > buy_date), None)
+        if sell_row:
+            sell_price, sell_date = sell_row.sell_price, sell_row.sell_date
+        else:
+            # perma hold: last available price
+            try:
+                held = price_data.loc[buy_date:, symbol].dropna()
+                sell_price, sell_date = held.iloc[-1], held.index[-1]
+            except (KeyError, IndexError):
+                continue
+        results.append({'symbol': symbol, 'buy_date': buy_date, 'buy_price': row['buy_price'], 'sell_date': sell_date,
+                         'sell_price': sell_price, 'gain': (sell_price - row['buy_price']) / row['buy_price'],
+                         'quarter': quarter, 'confidence': row['confidence']})
+    return pd.DataFrame(results)
+
+
+def assert_same_trades(actual, expected):
+    # sells carry the replay's date strings and perma-holds a price_data Timestamp, in both versions
+    dated = [frame.assign(sell_date=pd.to_datetime(frame['sell_date'])) for frame in (actual, expected)]
+    pd.testing.assert_frame_equal(*dated, check_exact=True, check_dtype=False)
+
+
+def test_hand_made_trades():
+    dates = pd.bdate_range('2023-05-15', '2023-12-29')
+    prices = pd.DataFrame({'AAA': np.linspace(10, 20, len(dates)), 'BBB': np.linspace(5, 4, len(dates)),
+                           'CCC': np.linspace(1, 2, len(dates))}, index=dates)
+    prices.loc[dates[-20]:, 'BBB'] = np.nan  # delisted: perma-held to its last price
+    prices['CCC'] = np.nan                   # never priced: no perma-hold
+    quarters = {'2023_Q1': '2023-05-15', '2023_Q2': '2023-08-15', '2023_Q3': '2023-11-15'}
+    buys = pd.DataFrame({'symbol': ['AAA', 'BBB', 'CCC', 'AAA', 'DDD'],
+                         'buy_date': ['2023-05-15', '2023-05-15', '2023-05-15', '2023-08-15', '2023-08-15'],
+                         'buy_price': [10.0, 5.0, 1.0, 15.0, 3.0], 'confidence': [0.9, 0.8, 0.7, 0.6, 0.5]})
+    sells = pd.DataFrame({'symbol': ['AAA'], 'sell_date': ['2023-08-15'], 'sell_price': [15.0], 'gain': [0.5]})
+    actual = compute_quarterly_returns(buys, sells, prices, quarters)
+    assert_same_trades(actual, loop_returns(buys, sells, prices, quarters))
+    # the first AAA closes at the sell, the second and BBB are perma-held; CCC and DDD have no price
+    assert list(actual['symbol']) == ['AAA', 'BBB', 'AAA']
+    assert actual['sell_date'].iloc[1] == dates[-21]
+
+
+@pytest.mark.parametrize('k, sell_threshold', [(5, 0.3), (15, 0.6)])
+def test_replayed_trades(k, sell_threshold):
+    df_dict, price_data, _ = synthetic_data(n_symbols=60, n_quarters=QUARTERS, seed=4)
+    quarters_dict = synthetic_quarters(QUARTERS)
+    rankings = compute_rankings(build_training_data(df_dict, price_data, relative_performance=False),
+                                list(quarters_dict), False, model='LogisticRegression')
+    buys, sells = replay_rankings(rankings, price_data, quarters_dict, k=k, sell_threshold=sell_threshold)
+    actual = compute_quarterly_returns(buys, sells, price_data, quarters_dict)
+    expected = loop_returns(buys, sells, price_data, quarters_dict)
+    assert len(actual) > len(sells)  # some positions are perma-held
+    assert_same_trades(actual, expected)
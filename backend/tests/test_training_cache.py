@@ -0,0 +1,49 @@
+"""Cached training data is keyed by the data it was built from, not by whatever data_context holds."""
+import os
+from types import SimpleNamespace
+import pandas as pd
+import pytest
+from conftest import BACKTEST, write_data
+from strategy.cache import training_data_cache
+from strategy.context import DataContext
+from strategy.jobs import run_backtest
+
+
+def context(name, seed):
+    os.makedirs(name)
+    os.chdir(name)
+    try:
+        write_data(seed)
+    finally:
+        os.chdir('..')
+    return DataContext(price_path=f'{name}/data/price_data.csv', quarterly_path=f'{name}/data/quarterly/',
+                       spy_path=f'{name}/data/seed/spy_data.csv')
+
+
+@pytest.fixture
+def contexts(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    training_data_cache.clear()
+    yield context('a', 1), context('b', 2)
+    training_data_cache.clear()
+
+
+def transactions(ctx, **kwargs):
+    return run_backtest(dict(BACKTEST, benchmarks=('SPY',)), context=ctx, **kwargs)['transactions']
+
+
+def test_contexts_do_not_share_training_data(contexts):
+    a, b = contexts
+    from_a = transactions(a)
+    from_b = transactions(b)
+    assert len(training_data_cache) == 2
+    pd.testing.assert_frame_equal(from_b, transactions(b, use_cache=False))
+    assert not from_a.equals(from_b)
+
+
+def test_frames_without_fingerprint_are_not_cached(contexts):
+    _, b = contexts
+    frames = SimpleNamespace(df_dict=b.df_dict, price_data=b.price_data, spy_baseline=b.spy_baseline,
+                             quarters_dict=b.quarters_dict)
+    transactions(frames)
+    assert len(training_data_cache) == 0
@@ -0,0 +1,23 @@
+"""ScoreStore: a resumed search reuses the scores of fits with the same seed only."""
+import strategy.tuning
+from strategy.tuning import ScoreStore, evaluate
+
+FOLDS = {'2021_Q2': (None, None, None, None, 'fold-a'), '2021_Q3': (None, None, None, None, 'fold-b')}
+CANDIDATES = [{'C': 0.1}, {'C': 1.0}]
+
+
+def test_resume_refits_for_another_seed(tmp_path, monkeypatch):
+    fits = []
+    monkeypatch.setattr(strategy.tuning, 'score_fold',
+                        lambda model, params, *fold, seed: fits.append(seed) or params['C'] + seed)
+    path = str(tmp_path / 'scores.jsonl')
+
+    evaluate('LogisticRegression', CANDIDATES, FOLDS, list(FOLDS), ScoreStore(path), seed=1)
+    assert fits == [1] * 4
+    # a resumed run (a new store over the same file) reuses its own seed's scores...
+    evaluate('LogisticRegression', CANDIDATES, FOLDS, list(FOLDS), ScoreStore(path), seed=1)
+    assert len(fits) == 4
+    # ...but not another seed's
+    results = evaluate('LogisticRegression', CANDIDATES, FOLDS, list(FOLDS), ScoreStore(path), seed=2)
+    assert fits[4:] == [2] * 4
+    assert list(results['score']) == [2.1, 3.0]
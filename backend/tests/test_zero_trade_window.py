@@ -0,0 +1,69 @@
+"""A window whose only trading quarter has no target prices: no trades, and no crash anywhere downstream."""
+from types import SimpleNamespace
+import numpy as np
+import pandas as pd
+import pytest
+from strategy.backtest import build_transactions, simulate_portfolio_ledger
+from strategy.jobs import run_backtest
+from strategy.risk import batch_summary, risk_report
+from strategy.synthetic import synthetic_data, synthetic_quarters
+from strategy.utils import getMetrics, resolve_window, trading_quarters
+
+CALENDAR = synthetic_quarters(8)  # 2021_Q1 .. 2022_Q4
+# like price_data.csv ending 2024-12-30: the last calendar trading quarter (2022_Q2) has no target prices
+LAST_DATE = pd.Timestamp('2022-12-30')
+PARAMS = dict(k=5, initial_capital=100_000, random_state=102, model_strategy='LogisticRegression',
+              sell_threshold=0.3, benchmarks=('SPY',))
+
+
+@pytest.fixture(scope='module')
+def context():
+    n_days = len(pd.bdate_range('2021-01-04', LAST_DATE))
+    df_dict, price_data, spy = synthetic_data(n_symbols=60, n_quarters=len(CALENDAR), n_days=n_days, seed=1)
+    return SimpleNamespace(df_dict=df_dict, price_data=price_data, spy_baseline=spy, quarters_dict=CALENDAR)
+
+
+def test_trading_quarters_need_target_prices():
+    assert trading_quarters(CALENDAR)[-1] == '2022_Q2'
+    assert trading_quarters(CALENDAR, LAST_DATE)[-1] == '2022_Q1'
+    assert resolve_window('2022_Q2', '2022_Q2', CALENDAR) == ('2022_Q2', '2022_Q2')
+    with pytest.raises(ValueError, match='Nothing to trade'):
+        resolve_window('2022_Q2', '2022_Q2', CALENDAR, last_date=LAST_DATE)
+    # a window that reaches a priced quarter is still accepted, unchanged
+    assert resolve_window('2022_Q1', None, CALENDAR, last_date=LAST_DATE) == ('2022_Q1', '2022_Q2')
+
+
+def test_zero_trade_window(context):
+    result = run_backtest(dict(PARAMS, start_quarter='2022_Q2', end_quarter='2022_Q2'), context=context,
+                          use_cache=False)
+
+    transactions, ledger = result['transactions'], result['ledger']
+    assert transactions.empty
+    assert list(transactions.columns) == ['quarter', 'purchase_date', 'sell_date', 'baseline_return', 'symbol',
+                                          'start_price', 'end_price', 'return', 'strat_edge', 'confidence']
+    assert ledger.empty
+    assert list(ledger.columns) == ['date', 'portfolio_value', 'cash', 'invested', 'num_positions']
+    assert all(np.isnan(value) for value in result['metrics'].values())
+    assert list(result['benchmarks']['benchmark']) == ['SPY']
+    assert result['benchmarks'].drop(columns='benchmark').isna().all().all()
+    assert result['relative'].empty
+
+    report = risk_report(ledger, transactions)
+    assert np.isnan(report['summary']['sharpe_ratio'])
+    assert report['rolling'].empty and report['quarters'].empty
+
+
+def test_empty_trades_next_to_trades(context):
+    # a sweep can mix runs with and without trades
+    traded = run_backtest(dict(PARAMS, start_quarter=None, end_quarter=None), context=context, use_cache=False)
+    assert len(traded['transactions'])
+
+    empty = build_transactions(pd.DataFrame(columns=['symbol', 'buy_date', 'buy_price', 'confidence']),
+                               pd.DataFrame(columns=['symbol', 'sell_date', 'sell_price', 'gain']),
+                               context.price_data, CALENDAR)
+    ledger = simulate_portfolio_ledger(empty, context.price_data)
+    assert np.isnan(getMetrics(ledger, context.spy_baseline)['net_return'])
+
+    summary = batch_summary([traded['ledger'], ledger], [traded['transactions'], empty])
+    assert np.isfinite(summary['sharpe_ratio'][0]) and np.isnan(summary['sharpe_ratio'][1])
+    assert np.isnan(summary['hit_rate'][1])